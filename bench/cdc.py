@@ -0,0 +1,128 @@
+"""
+Content-defined chunking benchmark against the local stand-in API.
+
+Builds successive versions of a synthetic checkpoint -- a file of "tensors" where
+each version rewrites a few of them in place, and some versions also insert a new
+tensor partway through (shifting every byte after it) -- then uploads and downloads
+each version in CDC mode, reporting how many bytes went over the wire and how long
+it took compared to sending the whole file, and checking every download matches.
+
+Usage:
+
+  $ python bench/cdc.py [--size-mb 64] [--versions 4] [--changed 0.1]
+
+"""
+import argparse
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_api import StubApi
+from sweettea.utils.abstract_api import AbstractApi
+from sweettea.utils.file_utils.cdc import ChunkIndex, CdcFileDownloader, CdcFileUploader
+
+MB = 1024 * 1024
+TENSOR_SIZE = 2 * MB
+
+
+def make_versions(count, size, changed, rng):
+  """:return: List of checkpoint versions, each a list of tensors (bytes)"""
+  tensors = [os.urandom(TENSOR_SIZE) for _ in range(size // TENSOR_SIZE)]
+  versions = [list(tensors)]
+
+  for v in range(1, count):
+    tensors = list(tensors)
+
+    # Update some tensors in place...
+    for i in rng.sample(range(len(tensors)), max(1, int(len(tensors) * changed))):
+      tensors[i] = os.urandom(TENSOR_SIZE)
+
+    # ...and every other version, insert a small new one partway through.
+    if v % 2 == 0:
+      tensors.insert(rng.randrange(len(tensors)), os.urandom(TENSOR_SIZE // 7))
+
+    versions.append(tensors)
+
+  return versions
+
+
+def write_version(path, tensors):
+  with open(path, 'wb') as f:
+    for t in tensors:
+      f.write(t)
+
+
+def file_digest(path):
+  h = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(4 * MB), b''):
+      h.update(block)
+  return h.hexdigest()
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+  parser.add_argument('--size-mb', type=int, default=64)
+  parser.add_argument('--versions', type=int, default=4)
+  parser.add_argument('--changed', type=float, default=0.1, help='fraction of tensors rewritten per version')
+  parser.add_argument('--seed', type=int, default=0)
+  opts = parser.parse_args()
+
+  work_dir = tempfile.mkdtemp(prefix='st-bench-')
+  versions = make_versions(opts.versions, opts.size_mb * MB, opts.changed, random.Random(opts.seed))
+
+  stub = StubApi()
+  api = AbstractApi(base_url=stub.start(), pool_maxsize=4)
+
+  # Separate chunk indexes, standing in for the training machine and the serving machine.
+  uploader = CdcFileUploader(api, default_completion_msg=None,
+                             index=ChunkIndex(os.path.join(work_dir, 'up-index.json')))
+  downloader = CdcFileDownloader(api, index=ChunkIndex(os.path.join(work_dir, 'down-index.json')))
+
+  ok = True
+  results = []
+
+  for v, tensors in enumerate(versions):
+    src = os.path.join(work_dir, 'checkpoint-v{}.bin'.format(v))
+    dest = os.path.join(work_dir, 'downloaded-v{}.bin'.format(v))
+    write_version(src, tensors)
+    size = os.path.getsize(src)
+
+    received_before = stub.bytes_received
+    start = time.perf_counter()
+    uploader.upload('/model', src, name='bench')
+    up_time = time.perf_counter() - start
+    up_bytes = stub.bytes_received - received_before
+
+    sent_before = stub.bytes_sent
+    start = time.perf_counter()
+    downloader.download('/model', dest, payload={'model': 'bench'})
+    down_time = time.perf_counter() - start
+    down_bytes = stub.bytes_sent - sent_before
+
+    intact = file_digest(dest) == file_digest(src)
+    ok = ok and intact
+    results.append((v, size, up_bytes, up_time, down_bytes, down_time, intact))
+
+  print('\n{:>7} {:>9} {:>11} {:>9} {:>13} {:>9} {:>7}'.format(
+    'version', 'size MB', 'uploaded MB', 'up secs', 'downloaded MB', 'down secs', 'intact'))
+
+  for v, size, up_bytes, up_time, down_bytes, down_time, intact in results:
+    print('{:>7} {:>9.1f} {:>11.1f} {:>9.2f} {:>13.1f} {:>9.2f} {:>7}'.format(
+      v, size / MB, up_bytes / MB, up_time, down_bytes / MB, down_time, str(intact)))
+
+  api.close()
+  stub.stop()
+  stub.cleanup()
+
+  if not ok:
+    exit(1)
+
+
+if __name__ == '__main__':
+  main()
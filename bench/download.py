@@ -0,0 +1,119 @@
+"""
+Model download throughput benchmark against the local stand-in API.
+
+Serves a synthetic model file with every connection capped at --throttle-mbps
+(standing in for a per-connection bottleneck like a long fat pipe or a
+per-flow rate limit), downloads it once per --segments value and reports
+throughput, checking each downloaded file matches the original byte for byte.
+
+A final run interrupts a segmented download partway through and re-runs it,
+checking that only the unfinished segments were fetched again.
+
+Usage:
+
+  $ python bench/download.py [--size-mb 128] [--throttle-mbps 32] [--segments 1 2 4 8]
+
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_api import StubApi
+from sweettea.utils.abstract_api import AbstractApi
+from sweettea.utils.file_utils.file_downloader import FileDownloader
+
+MB = 1024 * 1024
+
+
+def make_model(path, size):
+  with open(path, 'wb') as f:
+    remaining = size
+    while remaining:
+      n = min(remaining, 4 * MB)
+      f.write(os.urandom(n))
+      remaining -= n
+
+
+def file_digest(path):
+  h = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(4 * MB), b''):
+      h.update(block)
+  return h.hexdigest()
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+  parser.add_argument('--size-mb', type=int, default=128)
+  parser.add_argument('--throttle-mbps', type=float, default=32)
+  parser.add_argument('--segments', type=int, nargs='+', default=[1, 2, 4, 8])
+  opts = parser.parse_args()
+
+  work_dir = tempfile.mkdtemp(prefix='st-bench-')
+  model_path = os.path.join(work_dir, 'model.bin')
+  make_model(model_path, opts.size_mb * MB)
+  expected = file_digest(model_path)
+
+  stub = StubApi()
+  stub.add_model('bench', model_path, 'bin')
+  stub.throttle_bps = opts.throttle_mbps * MB if opts.throttle_mbps else None
+
+  api = AbstractApi(base_url=stub.start(), pool_maxsize=max(opts.segments))
+  downloader = FileDownloader(api, retries=0, min_segment_size=MB)
+  ok = True
+  results = []
+
+  for segments in opts.segments:
+    dest = os.path.join(work_dir, 'out-{}.bin'.format(segments))
+
+    start = time.perf_counter()
+    downloader.download('/model', dest, payload={'model': 'bench'}, segments=segments)
+    elapsed = time.perf_counter() - start
+
+    intact = file_digest(dest) == expected
+    ok = ok and intact
+    results.append((segments, elapsed, intact))
+    os.remove(dest)
+
+  print('\n{:>8} {:>10} {:>10} {:>8}'.format('segments', 'seconds', 'MB/s', 'intact'))
+
+  for segments, elapsed, intact in results:
+    print('{:>8} {:>10.2f} {:>10.1f} {:>8}'.format(segments, elapsed, opts.size_mb / elapsed, str(intact)))
+
+  # Interrupt a segmented download (every connection drops partway) and resume it.
+  segments = max(opts.segments)
+  dest = os.path.join(work_dir, 'out-resume.bin')
+  stub.throttle_bps = None
+  stub.drop_after_bytes = opts.size_mb * MB // segments // 2
+
+  try:
+    downloader.download('/model', dest, payload={'model': 'bench'}, segments=segments)
+  except SystemExit:
+    pass
+
+  stub.drop_after_bytes = None
+  sent_before_resume = stub.bytes_sent
+  downloader.download('/model', dest, payload={'model': 'bench'}, segments=segments)
+  resumed_mb = (stub.bytes_sent - sent_before_resume) / MB
+
+  intact = file_digest(dest) == expected
+  ok = ok and intact
+
+  print('\nresume after interruption: {:.1f} of {} MB served again, intact: {}'.format(
+    resumed_mb, opts.size_mb, intact))
+
+  api.close()
+  stub.stop()
+  stub.cleanup()
+
+  if not ok:
+    exit(1)
+
+
+if __name__ == '__main__':
+  main()
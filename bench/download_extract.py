@@ -0,0 +1,91 @@
+"""
+Time-to-ready benchmark for directory model downloads against the local stand-in API.
+
+Serves a synthetic model directory (with every connection capped at
+--throttle-mbps) and downloads it into a directory twice: once as a zip
+saved to disk and extracted afterwards, and once as a tar extracted while it
+downloads. Reports the time until the model is on disk and checks both copies
+match the original.
+
+Usage:
+
+  $ python bench/download_extract.py [--files 64] [--file-mb 4] [--throttle-mbps 64]
+
+"""
+import argparse
+import filecmp
+import io
+import os
+import sys
+import tempfile
+import time
+from contextlib import redirect_stderr, redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_api import StubApi
+from sweettea.utils.abstract_api import AbstractApi
+from sweettea.utils.file_utils.file_downloader import FileDownloader
+
+MB = 1024 * 1024
+
+
+def make_model_dir(path, files, file_size):
+  os.makedirs(path)
+
+  # Half random (incompressible) and half repetitive data, like weights next to configs/vocab files.
+  for i in range(files):
+    with open(os.path.join(path, 'part-{:04d}.bin'.format(i)), 'wb') as f:
+      f.write(os.urandom(file_size) if i % 2 else (b'sweettea ' * (file_size // 9 + 1))[:file_size])
+
+
+def dirs_match(a, b):
+  cmp = filecmp.dircmp(a, b)
+  return not (cmp.left_only or cmp.right_only or
+              filecmp.cmpfiles(a, b, cmp.common_files, shallow=False)[1])
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+  parser.add_argument('--files', type=int, default=64)
+  parser.add_argument('--file-mb', type=float, default=4)
+  parser.add_argument('--throttle-mbps', type=float, default=64)
+  opts = parser.parse_args()
+
+  work_dir = tempfile.mkdtemp(prefix='st-bench-')
+  model_dir = os.path.join(work_dir, 'model')
+  make_model_dir(model_dir, opts.files, int(opts.file_mb * MB))
+
+  stub = StubApi()
+  stub.add_model_dir('bench', model_dir)
+  stub.throttle_bps = opts.throttle_mbps * MB if opts.throttle_mbps else None
+
+  api = AbstractApi(base_url=stub.start())
+  downloader = FileDownloader(api)
+  ok = True
+
+  print('{:<28} {:>14}  {}'.format('mode', 'time-to-ready', 'intact'))
+
+  for name, stream_extract in (('download, then extract zip', False), ('extract tar while streaming', True)):
+    dest = os.path.join(work_dir, 'out-{}'.format(int(stream_extract)))
+
+    with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+      start = time.perf_counter()
+      downloader.download('/model', dest, payload={'model': 'bench'}, stream_extract=stream_extract)
+      elapsed = time.perf_counter() - start
+
+    intact = dirs_match(model_dir, dest)
+    ok = ok and intact
+
+    print('{:<28} {:>13.2f}s  {}'.format(name, elapsed, intact))
+
+  api.close()
+  stub.stop()
+  stub.cleanup()
+
+  if not ok:
+    exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,101 @@
+"""
+Single-stream download write path benchmark against the local stand-in API.
+
+Streams a synthetic model file from the stand-in API to disk, once with the
+old write path (512-byte iter_content chunks, progress redrawn per chunk) and
+once with ProgressDownloadStream, and reports MB/s for each.
+
+Usage:
+
+  $ python bench/download_stream.py [--size-mb 512] [--runs 3]
+
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+from contextlib import redirect_stderr, redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clint.textui.progress import Bar as ProgressBar
+from stub_api import StubApi
+from sweettea.utils.abstract_api import AbstractApi
+from sweettea.utils.file_utils.file_downloader import ProgressDownloadStream
+
+MB = 1024 * 1024
+
+
+def make_model(path, size):
+  with open(path, 'wb') as f:
+    remaining = size
+    while remaining:
+      n = min(remaining, 4 * MB)
+      f.write(os.urandom(n))
+      remaining -= n
+
+
+def legacy_stream_to_file(resp, size, path):
+  """The write path ProgressDownloadStream used to have."""
+  bar = ProgressBar(expected_size=size, filled_char='=')
+  progress = 0
+
+  with open(path, 'wb') as f:
+    for chunk in resp.iter_content(chunk_size=512):
+      f.write(chunk)
+      progress += int(len(chunk))
+      bar.show(progress)
+
+
+def current_stream_to_file(resp, size, path):
+  ProgressDownloadStream(stream=resp, expected_size=size).stream_to_file(path)
+
+
+def measure(api, write, size, path):
+  resp = api.get('/model', payload={'model': 'bench'}, stream=True)
+
+  # Keep progress bar output out of the measurements' way.
+  with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+    start = time.perf_counter()
+    write(resp.response_obj, size, path)
+    elapsed = time.perf_counter() - start
+
+  if os.path.getsize(path) != size:
+    raise AssertionError('downloaded {} of {} bytes'.format(os.path.getsize(path), size))
+
+  os.remove(path)
+
+  return elapsed
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+  parser.add_argument('--size-mb', type=int, default=512)
+  parser.add_argument('--runs', type=int, default=3)
+  opts = parser.parse_args()
+
+  work_dir = tempfile.mkdtemp(prefix='st-bench-')
+  model_path = os.path.join(work_dir, 'model.bin')
+  size = opts.size_mb * MB
+  make_model(model_path, size)
+
+  stub = StubApi()
+  stub.add_model('bench', model_path, 'bin')
+  api = AbstractApi(base_url=stub.start())
+
+  print('{:<24} {:>10} {:>10}'.format('write path', 'best s', 'MB/s'))
+
+  for name, write in (('512 B chunks (old)', legacy_stream_to_file),
+                      ('ProgressDownloadStream', current_stream_to_file)):
+    best = min(measure(api, write, size, os.path.join(work_dir, 'out.bin')) for _ in range(opts.runs))
+    print('{:<24} {:>10.2f} {:>10.1f}'.format(name, best, opts.size_mb / best))
+
+  api.close()
+  stub.stop()
+  stub.cleanup()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,116 @@
+"""
+Local log archive benchmark: archiving a long train job log, then searching it.
+
+Archives --lines timestamped log lines (one per second of training) into a
+LogArchive, then times searches of it:
+
+  full scan   every segment decompressed and grep'ed in turn (no index, one thread)
+  --grep      every segment, decompressed and grep'ed on --workers threads
+  --since     only the segments the index puts after --since-hours ago
+  --tail      only the last segments
+
+Reports archive throughput (including generating the lines) and compression,
+and each search's time and match count, checking the indexed searches against a
+plain filter of the whole log.
+
+Usage:
+
+  $ python bench/log_archive.py [--lines 5000000] [--since-hours 24] [--workers 4]
+
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sweettea.utils.log_archive import LogArchive
+from sweettea.utils.log_filter import LogFilter
+
+MB = 1024 * 1024
+PATTERN = r'loss=nan|Traceback'
+
+
+def iter_lines(count, end):
+  start = end - timedelta(seconds=count)
+
+  for i in range(count):
+    ts = (start + timedelta(seconds=i)).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+    if i % 50000 == 0:
+      yield '{} Traceback (most recent call last):'.format(ts)
+    else:
+      yield '{} epoch {} step {:>8} loss={} lr=3.0e-04 samples/s=1234.5'.format(
+        ts, i // 10000, i, 'nan' if i % 99991 == 0 else '{:.6f}'.format(1.0 / (i + 1)))
+
+
+def timed(fn):
+  start = time.perf_counter()
+  result = fn()
+  return time.perf_counter() - start, result
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+  parser.add_argument('--lines', type=int, default=5000000)
+  parser.add_argument('--since-hours', type=float, default=24)
+  parser.add_argument('--workers', type=int, default=4)
+  opts = parser.parse_args()
+
+  work_dir = tempfile.mkdtemp(prefix='st-bench-')
+  archive = LogArchive(os.path.join(work_dir, 'job'))
+  archive.open_for_writing()
+  end = datetime.now(timezone.utc)
+
+  def write():
+    raw_size = sum(len(line) + 1 for line in archive.tee(iter_lines(opts.lines, end), 0, batch_size=10000))
+    archive.close()
+    return raw_size
+
+  write_time, raw_size = timed(write)
+  archived_size = sum(s['size'] for s in archive.segments)
+
+  print('\nlog: {} lines, {:.0f} MB -> {:.0f} MB archived in {} segments ({:.1f}x), {:.0f} MB/s'.format(
+    opts.lines, raw_size / MB, archived_size / MB, len(archive.segments), raw_size / archived_size,
+    raw_size / MB / write_time))
+
+  since = end - timedelta(hours=opts.since_hours)
+  searches = (
+    ('full scan', LogFilter(pattern=PATTERN), 1),
+    ('--grep', LogFilter(pattern=PATTERN), opts.workers),
+    ('--since --grep', LogFilter(since=since, pattern=PATTERN), opts.workers),
+    ('--tail 100', LogFilter(tail=100), opts.workers),
+  )
+
+  expected = {}
+  ok = True
+
+  print('\n{:>16} {:>9} {:>9}'.format('search', 'seconds', 'matches'))
+
+  for name, log_filter, workers in searches:
+    elapsed, matches = timed(lambda: list(LogArchive(archive.path).search(log_filter, workers=workers)))
+
+    # Check against filtering the whole log line by line.
+    key = (log_filter.since, log_filter.pattern, log_filter.tail)
+
+    if key not in expected:
+      expected[key] = list(LogFilter(since=log_filter.since, pattern=log_filter.pattern, tail=log_filter.tail)
+                           .apply(iter_lines(opts.lines, end)))
+
+    ok = ok and matches == expected[key]
+    print('{:>16} {:>9.2f} {:>9}'.format(name, elapsed, len(matches)))
+
+  print('\nall searches match a plain filter of the log: {}'.format(ok))
+
+  shutil.rmtree(work_dir, ignore_errors=True)
+
+  if not ok:
+    exit(1)
+
+
+if __name__ == '__main__':
+  main()
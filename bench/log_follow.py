@@ -0,0 +1,156 @@
+"""
+Reconnecting log follow test against a local stand-in API that drops connections.
+
+A producer thread appends --lines lines to a train job's log while it's being
+followed the way 'st logs -f', 'st logs -f --grep' and 'st train' follow it, with
+the stand-in cutting each chunk of the stream off partway through with
+probability --drop-rate (and failing reconnects with a 503 as often). Lines
+include empty ones, ignored ones ('...') and ones containing characters
+str.splitlines() would break on, to check lines are counted exactly as sent.
+
+Then follows a finished log the way 'st logs -f --tail N --grep X' does, where the
+API does the grep (and still sends a log offset), checking the follow neither
+resumes nor archives from a count of grep'ed lines.
+
+Checks every expected line was printed exactly once and in order, and reports
+the number of reconnects and the time taken.
+
+Usage:
+
+  $ python bench/log_follow.py [--lines 200000] [--drop-rate 0.05] [--seed 1]
+
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_api import StubApi
+from sweettea.utils.abstract_api import AbstractApi
+from sweettea.utils.log_archive import LogArchive, train_job_id
+from sweettea.utils.log_filter import LogFilter, applied_filters
+
+
+def make_lines(count):
+  lines = []
+
+  for i in range(count):
+    if i % 1000 == 0:
+      lines.append('')
+    elif i % 1000 == 1:
+      lines.append('...')
+    elif i % 1000 == 2:
+      lines.append('step {} progress 50%\r100%\x0c done'.format(i))
+    else:
+      lines.append('epoch {} step {:>7} loss={:.6f}'.format(i // 1000, i, 1.0 / (i + 1)))
+
+  return lines
+
+
+def produce(stub, lines, batch=500):
+  for i in range(0, len(lines), batch):
+    stub.add_logs(lines[i:i + batch])
+    time.sleep(0.001)
+
+  stub.end_logs()
+
+
+def follow(stub, start_request, line_filter=None):
+  api = AbstractApi(base_url=stub.start())
+  work_dir = tempfile.mkdtemp(prefix='st-bench-')
+  out_path = os.path.join(work_dir, 'out.log')
+  archive = LogArchive(os.path.join(work_dir, 'archive'))
+
+  def resume(offset):
+    return api.get('/train_job/logs', payload={'follow': 'true', 'offset': offset, 'train_job_id': job}, stream=True,
+                   log_on_error=False, exit_on_error=False, raise_errors=True)
+
+  stdout = sys.stdout
+
+  with open(out_path, 'w', encoding='utf-8', newline='') as out:
+    sys.stdout = out
+
+    try:
+      start = time.perf_counter()
+      resp = start_request(api)
+      job = train_job_id(resp.headers)
+
+      # As 'st logs' does: only a log of a known job that the API didn't grep can be resumed and archived.
+      contiguous = 'grep' not in applied_filters(resp.headers)
+      archive.open_for_writing()
+
+      resp.log_stream(line_filter=line_filter, resume=resume if contiguous and job else None,
+                      archive=archive if contiguous else None)
+      elapsed = time.perf_counter() - start
+    finally:
+      sys.stdout = stdout
+
+  with open(out_path, encoding='utf-8', newline='') as f:
+    received = f.read().split('\n')[:-1]
+
+  archive.close()
+  archived = list(LogArchive(archive.path).search(LogFilter()))
+  reconnects = sum(1 for _, path, _ in stub.requests if path == '/train_job/logs') - 1
+  api.close()
+  stub.stop()
+  stub.cleanup()
+
+  return elapsed, received, reconnects, archived
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+  parser.add_argument('--lines', type=int, default=200000)
+  parser.add_argument('--drop-rate', type=float, default=0.05)
+  parser.add_argument('--seed', type=int, default=1)
+  opts = parser.parse_args()
+
+  random.seed(opts.seed)
+  lines = make_lines(opts.lines)
+  shown = [line for line in lines if line and line != '...']
+  pattern = r'step +\d*7 '
+  tail = 1000
+
+  runs = (
+    ('st logs -f', lambda api: api.get('/train_job/logs', payload={'follow': 'true'}, stream=True), None, shown),
+    ('st logs -f --grep', lambda api: api.get('/train_job/logs', payload={'follow': 'true'}, stream=True),
+     LogFilter(pattern=pattern).filter, list(LogFilter(pattern=pattern).apply(shown))),
+    ('st train', lambda api: api.post('/train_job', payload={}, stream=True), None, shown),
+  )
+
+  ok = True
+  print('\n{:>28} {:>9} {:>11} {:>9} {:>7}'.format('follow', 'lines', 'reconnects', 'seconds', 'intact'))
+
+  for name, start_request, line_filter, expected in runs:
+    stub = StubApi()
+    stub.drop_logs = opts.drop_rate
+    threading.Thread(target=produce, args=(stub, lines), daemon=True).start()
+
+    elapsed, received, reconnects, archived = follow(stub, start_request, line_filter)
+    intact = received == expected and archived == lines
+    ok = ok and intact
+    print('{:>28} {:>9} {:>11} {:>9.2f} {:>7}'.format(name, len(received), reconnects, elapsed, str(intact)))
+
+  # Grep'ed by the API: the lines received say nothing about where they are in the log.
+  stub = StubApi()
+  stub.grep_offsets = True
+  produce(stub, lines)
+
+  elapsed, received, reconnects, archived = follow(
+    stub, lambda api: api.get('/train_job/logs', payload={'follow': 'true', 'tail': tail, 'grep': pattern}, stream=True))
+  intact = received == list(LogFilter(pattern=pattern, tail=tail).apply(shown)) and not reconnects and not archived
+  ok = ok and intact
+  print('{:>28} {:>9} {:>11} {:>9.2f} {:>7}'.format(
+    'st logs -f --tail --grep', len(received), reconnects, elapsed, str(intact)))
+
+  if not ok:
+    exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,95 @@
+"""
+Log streaming throughput benchmark against the local stand-in API.
+
+Streams --lines synthetic training log lines (as a followed 'st logs -f' would
+receive them) as fast as the stand-in can send them, printing them through the
+previous log_stream loop (iter_lines with 10 byte chunks, a to_str and an
+unbuffered echo per line) and through the current one, with stdout redirected
+to a file. Reports sustained lines per second and checks every line arrived.
+
+Usage:
+
+  $ python bench/log_stream.py [--lines 500000]
+
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_api import StubApi
+from sweettea import log
+from sweettea.utils.abstract_api import AbstractApi
+from sweettea.utils.type_util import to_str
+
+
+def make_lines(count):
+  return ['epoch {} step {:>7} loss={:.6f} lr=3.0e-04 throughput=1234.5 samples/s é'.format(i // 1000, i, 1.0 / (i + 1))
+          for i in range(count)]
+
+
+def legacy_log_stream(resp, chunk_size=10, lines_to_ignore=('...',)):
+  for line in resp.response_obj.iter_lines(chunk_size=chunk_size):
+    line = to_str(line)
+
+    if not line or line in lines_to_ignore:
+      continue
+
+    log(line)
+
+
+def run(api, out_path, stream_fn):
+  resp = api.get('/train_job/logs', payload={'follow': 'true'}, stream=True)
+  stdout = sys.stdout
+
+  with open(out_path, 'w', encoding='utf-8') as out:
+    sys.stdout = out
+
+    try:
+      start = time.perf_counter()
+      stream_fn(resp)
+      elapsed = time.perf_counter() - start
+    finally:
+      sys.stdout = stdout
+
+  with open(out_path, encoding='utf-8') as f:
+    received = f.read().splitlines()
+
+  return elapsed, received
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+  parser.add_argument('--lines', type=int, default=500000)
+  opts = parser.parse_args()
+
+  lines = make_lines(opts.lines)
+  stub = StubApi()
+  stub.add_logs(lines)
+  stub.end_logs()
+
+  api = AbstractApi(base_url=stub.start())
+  out_path = os.path.join(tempfile.mkdtemp(prefix='st-bench-'), 'out.log')
+  ok = True
+
+  print('\n{:>10} {:>9} {:>12} {:>7}'.format('log_stream', 'seconds', 'lines/s', 'intact'))
+
+  for name, fn in (('previous', legacy_log_stream), ('current', lambda resp: resp.log_stream())):
+    elapsed, received = run(api, out_path, fn)
+    intact = received == lines
+    ok = ok and intact
+    print('{:>10} {:>9.2f} {:>12.0f} {:>7}'.format(name, elapsed, len(lines) / elapsed, str(intact)))
+
+  api.close()
+  stub.stop()
+  stub.cleanup()
+
+  if not ok:
+    exit(1)
+
+
+if __name__ == '__main__':
+  main()
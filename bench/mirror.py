@@ -0,0 +1,200 @@
+"""
+LAN mirror benchmark / check against the local stand-in API.
+
+Starts the stand-in API as the upstream (every connection capped at
+--throttle-mbps, standing in for a shared egress link) and an 'st mirror' in
+front of it, then has --clients machines download the same model through
+the mirror at once -- half of them as segmented (Range) downloads. Reports
+how many bytes crossed the upstream link versus how many the mirror served,
+and checks every copy matches the original.
+
+Then does the same for a directory model downloaded with --sync and a chunked
+file downloaded with --cdc, checking those go through the mirror's manifest,
+recipe and blob routes rather than falling back to a whole-model download.
+
+The stand-in only accepts the fleet's API token, and the mirror is checked to
+refuse a client with another token an object it has stored.
+
+Usage:
+
+  $ python bench/mirror.py [--size-mb 64] [--clients 16] [--throttle-mbps 64]
+
+"""
+import argparse
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stderr, redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_api import StubApi
+from sweettea.definitions import auth_header_name
+from sweettea.utils.abstract_api import AbstractApi
+from sweettea.utils.file_utils.cdc import ChunkIndex, CdcFileDownloader, CdcFileUploader
+from sweettea.utils.file_utils.file_downloader import FileDownloader
+from sweettea.utils.file_utils.manifest_sync import ManifestSyncDownloader, ManifestSyncUploader, build_manifest
+from sweettea.utils.mirror import ModelMirror
+
+MB = 1024 * 1024
+TOKEN = 'fleet-token'
+
+
+def make_model(path, size):
+  with open(path, 'wb') as f:
+    remaining = size
+    while remaining:
+      n = min(remaining, 4 * MB)
+      f.write(os.urandom(n))
+      remaining -= n
+
+
+def file_digest(path):
+  h = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(4 * MB), b''):
+      h.update(block)
+  return h.hexdigest()
+
+
+def make_dir_model(path, size):
+  for i in range(8):
+    shard = os.path.join(path, 'shards' if i else '', 'shard-{}.bin'.format(i))
+    os.makedirs(os.path.dirname(shard), exist_ok=True)
+    make_model(shard, size // 8)
+
+
+def token_api(base_url, token=TOKEN):
+  return AbstractApi(base_url=base_url, auth_header_name=auth_header_name, auth_header_val_getter=lambda: token)
+
+
+def plain_download(api, dest, i):
+  FileDownloader(api, min_segment_size=MB).download('/model', dest + '.bin', payload={'model': 'bench'},
+                                                    segments=4 if i % 2 else 1)
+  return dest + '.bin'
+
+
+def sync_download(api, dest, i):
+  ManifestSyncDownloader(api).download('/model', dest, payload={'model': 'bench-dir'})
+  return dest
+
+
+def cdc_download(api, dest, i):
+  # Each machine has its own (empty) chunk index.
+  index = ChunkIndex(dest + '-index.json')
+  CdcFileDownloader(api, index=index).download('/model', dest + '.bin', payload={'model': 'bench-cdc'})
+  return dest + '.bin'
+
+
+def download_wave(mirror_url, work_dir, clients, label, download=plain_download):
+  def client(i):
+    # Each client is its own machine: own connection pool, own destination.
+    with token_api(mirror_url) as api:
+      return download(api, os.path.join(work_dir, '{}-{}'.format(label, i)), i)
+
+  with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+      paths = list(executor.map(client, range(clients)))
+
+    elapsed = time.perf_counter() - start
+
+  return paths, elapsed
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+  parser.add_argument('--size-mb', type=int, default=64)
+  parser.add_argument('--clients', type=int, default=16)
+  parser.add_argument('--throttle-mbps', type=float, default=64)
+  opts = parser.parse_args()
+
+  work_dir = tempfile.mkdtemp(prefix='st-bench-')
+  model_path = os.path.join(work_dir, 'model.bin')
+  make_model(model_path, opts.size_mb * MB)
+  expected = file_digest(model_path)
+
+  dir_model_path = os.path.join(work_dir, 'model-dir')
+  make_dir_model(dir_model_path, opts.size_mb * MB)
+  expected_dir = build_manifest(dir_model_path)['files']
+
+  stub = StubApi()
+  stub.add_model('bench', model_path, 'bin')
+  stub.tokens = {TOKEN}
+  upstream_url = stub.start()
+
+  with token_api(upstream_url) as api, redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+    ManifestSyncUploader(api, default_completion_msg=None).upload('/model', dir_model_path, name='bench-dir')
+    CdcFileUploader(api, default_completion_msg=None, index=ChunkIndex(os.path.join(work_dir, 'up-index.json'))
+                    ).upload('/model', model_path, name='bench-cdc')
+
+  stub.throttle_bps = opts.throttle_mbps * MB if opts.throttle_mbps else None
+
+  mirror = ModelMirror(upstream_url, os.path.join(work_dir, 'mirror'), ttl=3600)
+  mirror_url = mirror.start()
+  ok = True
+
+  print('{:<26} {:>9} {:>14} {:>14}  {}'.format('wave', 'seconds', 'upstream MB', 'served MB', 'intact'))
+
+  for label in ('cold (concurrent)', 'warm (from store)'):
+    upstream_before = stub.bytes_sent
+    paths, elapsed = download_wave(mirror_url, work_dir, opts.clients, label.split()[0])
+    intact = all(file_digest(p) == expected for p in paths)
+    ok = ok and intact
+
+    print('{:<26} {:>9.2f} {:>14.1f} {:>14.1f}  {}'.format(
+      label, elapsed, (stub.bytes_sent - upstream_before) / MB, opts.clients * opts.size_mb, intact))
+
+    for p in paths:
+      os.remove(p)
+
+  # --sync and --cdc downloads, through the mirror's manifest / recipe / blob routes.
+  for label, download, name, check in (
+    ('--sync (concurrent)', sync_download, 'bench-dir', lambda p: build_manifest(p)['files'] == expected_dir),
+    ('--cdc (concurrent)', cdc_download, 'bench-cdc', lambda p: file_digest(p) == expected),
+  ):
+    upstream_before = stub.bytes_sent
+    requests_before = len(stub.requests)
+    paths, elapsed = download_wave(mirror_url, work_dir, opts.clients, label.split()[0].strip('-'), download)
+
+    # A plain GET /model upstream would mean the downloader fell back to a whole-model download.
+    mirrored = not any(path == '/model' for _, path, _ in stub.requests[requests_before:])
+    intact = mirrored and all(check(p) for p in paths)
+    ok = ok and intact
+
+    print('{:<26} {:>9.2f} {:>14.1f} {:>14.1f}  {}'.format(
+      label, elapsed, (stub.bytes_sent - upstream_before) / MB, opts.clients * opts.size_mb, intact))
+
+  # A client the API doesn't accept isn't served the stored copy.
+  with token_api(mirror_url, 'other-token') as api:
+    resp = api.get('/model', payload={'model': 'bench'}, log_on_error=False, exit_on_error=False)
+    refused = resp.status == 401
+
+  ok = ok and refused
+
+  print('\nclient with another token refused: {}'.format(refused))
+
+  # Expire the store: the next download revalidates upstream (304) rather than refetching.
+  mirror.ttl = 0
+  upstream_before = stub.bytes_sent
+  paths, _ = download_wave(mirror_url, work_dir, 1, 'revalidate')
+  revalidated = stub.bytes_sent == upstream_before and file_digest(paths[0]) == expected
+  ok = ok and revalidated
+
+  print('revalidated with a 304 (no body refetched): {}'.format(revalidated))
+
+  mirror.stop()
+  stub.stop()
+  stub.cleanup()
+
+  if not ok:
+    exit(1)
+
+
+if __name__ == '__main__':
+  main()
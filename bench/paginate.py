@@ -0,0 +1,115 @@
+"""
+Paginated listing benchmark against the local stand-in API.
+
+Lists --items synthetic train jobs from GET /train_jobs in pages of --page-size,
+with the stand-in taking --page-delay seconds to produce each page, three ways:
+
+  previous    a page at a time, each body buffered and parsed whole (resp.json)
+  streamed    AbstractApi.paginate without prefetching (items parsed as they're read)
+  prefetched  AbstractApi.paginate, requesting the next page while consuming this one
+
+Reports the time to the first item, the total time, and the peak memory allocated
+(tracemalloc) while listing, and checks every item arrived in order. The
+stand-in runs in a child process, so its allocations aren't counted.
+
+Usage:
+
+  $ python bench/paginate.py [--items 100000] [--page-size 10000] [--page-delay 0.2]
+
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_api import StubApi
+from sweettea.utils.abstract_api import AbstractApi
+
+MB = 1024 * 1024
+
+
+def legacy_paginate(api, route, items_path, payload):
+  cursor = None
+
+  while True:
+    resp = api.get(route, payload=dict(payload, cursor=cursor) if cursor else payload)
+    yield from resp.json[items_path]
+    cursor = resp.json.get('next_cursor')
+
+    if not cursor:
+      return
+
+
+def serve(items, page_delay, urls):
+  stub = StubApi()
+  stub.page_delay = page_delay
+  stub.train_jobs = [{'id': i, 'model': 'model-{}'.format(i % 7), 'status': 'succeeded',
+                      'metrics': {'loss': 1.0 / (i + 1), 'accuracy': 0.9}} for i in range(items)]
+
+  urls.put(stub.start())
+  multiprocessing.Event().wait()
+
+
+def run(items):
+  tracemalloc.start()
+  start = time.perf_counter()
+  first = None
+  ids = []
+
+  for item in items:
+    if first is None:
+      first = time.perf_counter() - start
+
+    ids.append(item['id'])
+
+  elapsed = time.perf_counter() - start
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+
+  return first, elapsed, peak, ids
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+  parser.add_argument('--items', type=int, default=100000)
+  parser.add_argument('--page-size', type=int, default=10000)
+  parser.add_argument('--page-delay', type=float, default=0.2)
+  opts = parser.parse_args()
+
+  urls = multiprocessing.Queue()
+  server = multiprocessing.Process(target=serve, args=(opts.items, opts.page_delay, urls), daemon=True)
+  server.start()
+
+  api = AbstractApi(base_url=urls.get())
+  payload = {'limit': opts.page_size}
+  expected = list(range(opts.items))
+  ok = True
+
+  listings = (
+    ('previous', lambda: legacy_paginate(api, '/train_jobs', 'train_jobs', payload)),
+    ('streamed', lambda: api.paginate('/train_jobs', 'train_jobs', payload=payload, prefetch=False)),
+    ('prefetched', lambda: api.paginate('/train_jobs', 'train_jobs', payload=payload))
+  )
+
+  print('\n{:>10} {:>14} {:>9} {:>15}'.format('listing', 'first item ms', 'seconds', 'peak alloc MB'))
+
+  for name, listing in listings:
+    first, elapsed, peak, ids = run(listing())
+    ok = ok and ids == expected
+    print('{:>10} {:>14.1f} {:>9.2f} {:>15.1f}'.format(name, first * 1000, elapsed, peak / MB))
+
+  print('\nall items in order: {}'.format(ok))
+
+  api.close()
+  server.terminate()
+
+  if not ok:
+    exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,89 @@
+"""
+Directory scanning benchmark for model trees with many small files.
+
+Builds a tree of --files small files spread over --dirs directories, then times
+the previous scan (os.walk plus an os.stat per member) against the os.scandir
+scanner, inline and with --scan-workers threads, and reports members per second.
+It finishes by zipping the tree and extracting it again, checking the round trip.
+
+Usage:
+
+  $ python bench/scan.py [--files 50000] [--dirs 500] [--scan-workers 8]
+
+"""
+import argparse
+import filecmp
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sweettea.utils.file_utils import extract_zip, walk_zip_members, zip_dir
+
+
+def make_tree(root, files, dirs):
+  for d in range(dirs):
+    os.makedirs(os.path.join(root, 'shard-{:04d}'.format(d)))
+
+  for i in range(files):
+    with open(os.path.join(root, 'shard-{:04d}'.format(i % dirs), 'part-{:07d}.bin'.format(i)), 'wb') as f:
+      f.write(os.urandom(64))
+
+
+def legacy_walk(path):
+  for root, dirs, files in os.walk(path):
+    for name in dirs + files:
+      member_path = os.path.join(root, name)
+      yield member_path, member_path.replace(path, '', 1), os.stat(member_path)
+
+
+def time_scan(members):
+  start = time.perf_counter()
+  count = sum(1 for _ in members)
+  return count, time.perf_counter() - start
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+  parser.add_argument('--files', type=int, default=50000)
+  parser.add_argument('--dirs', type=int, default=500)
+  parser.add_argument('--scan-workers', type=int, default=8)
+  opts = parser.parse_args()
+
+  work_dir = tempfile.mkdtemp(prefix='st-bench-')
+  src = os.path.join(work_dir, 'model') + '/'
+  make_tree(src, opts.files, opts.dirs)
+
+  results = [
+    ('os.walk + os.stat',) + time_scan(legacy_walk(src)),
+    ('scandir',) + time_scan(walk_zip_members(src)),
+    ('scandir, {} workers'.format(opts.scan_workers),) + time_scan(walk_zip_members(src, scan_workers=opts.scan_workers))
+  ]
+
+  print('\n{:>24} {:>9} {:>9} {:>12}'.format('scan', 'members', 'seconds', 'members/s'))
+
+  for name, count, elapsed in results:
+    print('{:>24} {:>9} {:>9.2f} {:>12.0f}'.format(name, count, elapsed, count / elapsed))
+
+  archive = os.path.join(work_dir, 'model.zip')
+  out = os.path.join(work_dir, 'out')
+
+  start = time.perf_counter()
+  zip_dir(src, archive, compression_level=0)
+  zip_time = time.perf_counter() - start
+  extract_zip(archive, out)
+
+  diff = filecmp.dircmp(src, out)
+  intact = not (diff.left_only or diff.right_only or diff.diff_files) and \
+    all(not (sub.left_only or sub.right_only or sub.diff_files) for sub in diff.subdirs.values())
+
+  print('\nzip_dir: {:.2f}s, round trip intact: {}'.format(zip_time, intact))
+
+  if not intact:
+    exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,97 @@
+"""
+Cold-start benchmark for the 'st' entrypoint.
+
+Runs each scenario in a fresh interpreter many times and compares the
+median wall time against a bare interpreter start (and against importing
+click alone, which every command needs), then lists which of the CLI's heavy
+third-party dependencies each scenario ended up importing.
+
+Usage:
+
+  $ python bench/startup.py [--runs 30]
+
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('requests', 'git', 'yaml', 'clint', 'requests_toolbelt', 'slugify')
+
+# Invoke the click entrypoint exactly like the 'st' console script does.
+ST_TEMPLATE = """
+import sys
+from sweettea.main import cli
+try:
+  cli({args!r}, prog_name='st')
+except SystemExit:
+  pass
+if {report}:
+  sys.stderr.write(','.join(m for m in {heavy!r} if m in sys.modules))
+"""
+
+# Scenarios are either raw python source (str) or 'st' arguments (list).
+SCENARIOS = (
+  ('python (baseline)', 'pass'),
+  ('python + click', 'import click'),
+  ('st version', ['version']),
+  ('st help', ['help']),
+  ('st --help', ['--help']),
+)
+
+
+def script_for(args, report=False):
+  if isinstance(args, str):
+    return args
+
+  return ST_TEMPLATE.format(args=args, report=report, heavy=HEAVY_MODULES)
+
+
+def run_once(code):
+  start = time.perf_counter()
+  subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True,
+                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+  return time.perf_counter() - start
+
+
+def heavy_imports(args):
+  if isinstance(args, str):
+    return ''
+
+  proc = subprocess.run([sys.executable, '-c', script_for(args, report=True)], cwd=ROOT,
+                        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+
+  return proc.stderr.decode().strip() or '-'
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+  parser.add_argument('--runs', type=int, default=30)
+  opts = parser.parse_args()
+
+  print('{:<20} {:>10} {:>10} {:>10}  {}'.format('scenario', 'median ms', 'min ms', 'vs base', 'heavy imports'))
+
+  baseline = None
+
+  for name, args in SCENARIOS:
+    code = script_for(args)
+
+    # Warm the OS page cache / bytecode cache before measuring.
+    run_once(code)
+
+    samples = [run_once(code) for _ in range(opts.runs)]
+    median = statistics.median(samples) * 1000
+
+    if baseline is None:
+      baseline = median
+
+    print('{:<20} {:>10.1f} {:>10.1f} {:>+10.1f}  {}'.format(
+      name, median, min(samples) * 1000, median - baseline, heavy_imports(args)))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,160 @@
+"""
+Zip64 / constant-memory stress test of the whole model transfer pipeline.
+
+Builds a model directory holding a sparse --size-gb weights file (zeros, apart
+from a few random blocks, some straddling 4 GiB boundaries) plus --small-files
+tiny files (more than 65535 of them needs Zip64's entry count), then pushes it
+through every stage against the local stand-in API:
+
+  scan      fingerprint the tree (dir_fingerprint)
+  hash      sha256 of the weights file (file_digest)
+  zip       zip_dir into a Zip64 archive
+  upload    FileUploader.upload (a single streamed multipart request)
+  download  FileDownloader.download into a directory (download + extract_zip)
+  verify    sha256 of the extracted weights file, and a count of the small files
+
+A background thread samples this process's resident set size throughout, and the
+peak of each stage is reported. Fails if any stage's peak exceeds --max-rss-mb,
+or if the round trip isn't intact.
+
+Needs roughly 1 GB of free disk space per 20 GB of --size-gb (the weights file,
+its extracted copy and the archives are all sparse or tiny).
+
+Usage:
+
+  $ python bench/stress_zip64.py [--size-gb 20] [--small-files 70000] [--max-rss-mb 256]
+
+"""
+import argparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_api import StubApi
+from sweettea.utils.abstract_api import AbstractApi
+from sweettea.utils.file_utils import dir_fingerprint, file_digest, zip_dir
+from sweettea.utils.file_utils.file_downloader import FileDownloader
+from sweettea.utils.file_utils.file_uploader import FileUploader
+
+MB = 1024 * 1024
+GB = 1024 * MB
+PAGE_SIZE = resource.getpagesize()
+
+
+class RssSampler(object):
+  """Samples resident set size on a background thread, tracking the peak since the last reset."""
+
+  def __init__(self, interval=0.02):
+    self.interval = interval
+    self.peak = 0
+    self.stopped = threading.Event()
+    threading.Thread(target=self._run, daemon=True).start()
+
+  def reset(self):
+    self.peak = current_rss()
+
+  def stop(self):
+    self.stopped.set()
+
+  def _run(self):
+    while not self.stopped.wait(self.interval):
+      self.peak = max(self.peak, current_rss())
+
+
+def current_rss():
+  with open('/proc/self/statm') as f:
+    return int(f.read().split()[1]) * PAGE_SIZE
+
+
+def make_model(model_dir, size, small_files):
+  os.makedirs(model_dir)
+
+  # Sparse weights file, with random data straddling each 4 GiB boundary and at the end
+  # (but not at the start, where it would make the whole file look incompressible).
+  with open(os.path.join(model_dir, 'weights.bin'), 'wb') as f:
+    f.truncate(size)
+
+    for offset in [64 * MB, size - MB] + list(range(4 * GB - MB // 2, size - MB, 4 * GB)):
+      f.seek(offset)
+      f.write(os.urandom(MB))
+
+  for i in range(small_files):
+    shard = os.path.join(model_dir, 'tokenizer', 'shard-{:03d}'.format(i % 256))
+
+    if i < 256:
+      os.makedirs(shard)
+
+    with open(os.path.join(shard, '{:06d}.txt'.format(i)), 'w') as f:
+      f.write(str(i))
+
+
+def count_files(path):
+  return sum(len(files) for _, _, files in os.walk(path))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+  parser.add_argument('--size-gb', type=float, default=20)
+  parser.add_argument('--small-files', type=int, default=70000)
+  parser.add_argument('--max-rss-mb', type=int, default=256)
+  opts = parser.parse_args()
+
+  work_dir = tempfile.mkdtemp(prefix='st-stress-')
+  model_dir = os.path.join(work_dir, 'model')
+  archive_path = os.path.join(work_dir, 'model.zip')
+  dest_dir = os.path.join(work_dir, 'downloaded')
+
+  make_model(model_dir, int(opts.size_gb * GB), opts.small_files)
+
+  stub = StubApi(data_dir=os.path.join(work_dir, 'stub'))
+  api = AbstractApi(base_url=stub.start())
+  sampler = RssSampler()
+  results = {}
+
+  def stage(name, fn):
+    sampler.reset()
+    start = time.perf_counter()
+    result = fn()
+    results[name] = (time.perf_counter() - start, sampler.peak)
+    return result
+
+  stage('scan', lambda: dir_fingerprint(model_dir))
+  expected = stage('hash', lambda: file_digest(os.path.join(model_dir, 'weights.bin')))
+  stage('zip', lambda: zip_dir(model_dir, archive_path))
+  stage('upload', lambda: FileUploader(api, default_completion_msg=None).upload(
+    '/model', archive_path, payload={'name': 'stress'}))
+  stage('download', lambda: FileDownloader(api).download('/model', dest_dir, payload={'model': 'stress'}))
+  actual = stage('verify', lambda: file_digest(os.path.join(dest_dir, 'weights.bin')))
+
+  sampler.stop()
+  api.close()
+  stub.stop()
+
+  intact = actual == expected and count_files(dest_dir) == opts.small_files + 1
+  ok = intact
+
+  print('\nweights: {:.1f} GB, archive: {:.1f} MB, files: {}'.format(
+    opts.size_gb, os.path.getsize(archive_path) / MB, opts.small_files + 1))
+  print('\n{:>9} {:>9} {:>13}'.format('stage', 'seconds', 'peak RSS MB'))
+
+  for name, (elapsed, peak) in results.items():
+    ok = ok and peak <= opts.max_rss_mb * MB
+    print('{:>9} {:>9.1f} {:>13.1f}'.format(name, elapsed, peak / MB))
+
+  print('\nmax RSS: {:.1f} MB, round trip intact: {}'.format(
+    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, intact))
+
+  shutil.rmtree(work_dir, ignore_errors=True)
+
+  if not ok:
+    exit(1)
+
+
+if __name__ == '__main__':
+  main()
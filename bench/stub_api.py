@@ -0,0 +1,853 @@
+"""
+Local stand-in for the SweetTea API, implementing just enough of the model
+transfer routes to exercise the CLI's transfer code without the real API.
+
+Run it standalone:
+
+  $ python bench/stub_api.py --port 8000 --data-dir /tmp/st-stub
+  $ API_URL=http://127.0.0.1:8000 st upload model --path ./model --chunked
+
+Or start it in-process:
+
+  stub = StubApi(data_dir)
+  url = stub.start()
+  ...
+  stub.stop()
+
+"""
+import argparse
+import email.parser
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from datetime import datetime, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PART_DIGEST_HEADER = 'Sweet-Tea-Part-Digest'
+FILE_TYPE_HEADER = 'Sweet-Tea-File-Type'
+AUTH_HEADER = 'Sweet-Tea-Api-Token'
+
+
+class StubApi(object):
+  """
+  In-memory bookkeeping + on-disk storage behind the stand-in server.
+
+  Knobs useful for exercising failure paths:
+
+    fail_parts_after  -- reject every part upload after this many have succeeded (None = never)
+    drop_after_bytes  -- cut every model download's connection after sending this many body bytes (None = never)
+    ranges            -- whether model downloads honor Range requests
+    throttle_bps      -- cap each download connection at this many bytes/sec (None = unthrottled),
+                         mimicking a per-connection bottleneck somewhere along the network path
+    tokens            -- API tokens accepted on model routes (None = any, or none, accepted)
+    grep_offsets      -- also send X-Log-Offset with grep'ed logs (as though their lines were contiguous)
+  """
+
+  def __init__(self, data_dir=None, model_route='/model'):
+    self.data_dir = data_dir or tempfile.mkdtemp(prefix='st-stub-')
+    os.makedirs(self.data_dir, exist_ok=True)
+    self.model_route = model_route.rstrip('/')
+    self.lock = threading.Lock()
+    self.uploads = {}
+    self.models = {}
+    self.manifests = {}
+    self.recipes = {}
+    self.log_lines = []
+    self.logs_cond = threading.Condition()
+    self.logs_done = False
+    self.log_filters = True
+    self.drop_logs = 0
+    self.grep_offsets = False
+    self.train_job_id = 'job-1'
+    self.train_jobs = []
+    self.page_delay = 0
+    self.cursor_header = True
+    self.parts_received = 0
+    self.bytes_received = 0
+    self.fail_parts_after = None
+    self.drop_after_bytes = None
+    self.ranges = True
+    self.throttle_bps = None
+    self.tokens = None
+    self.bytes_sent = 0
+    self.requests = []
+    self.server = None
+
+  # --- Lifecycle ---
+
+  def start(self, host='127.0.0.1', port=0):
+    """Serve in a background thread and return the base url."""
+    api = self
+
+    class Handler(StubApiHandler):
+      stub = api
+
+    self.server = ThreadingHTTPServer((host, port), Handler)
+    self.server.daemon_threads = True
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    return 'http://{}:{}'.format(host, self.server.server_port)
+
+  def stop(self):
+    if self.server:
+      self.server.shutdown()
+      self.server.server_close()
+      self.server = None
+
+  def cleanup(self):
+    shutil.rmtree(self.data_dir, ignore_errors=True)
+
+  # --- Chunked upload protocol ---
+
+  def create_upload(self, body):
+    upload_id = uuid.uuid4().hex
+
+    with self.lock:
+      self.uploads[upload_id] = {'meta': body, 'parts': {}, 'dir': os.path.join(self.data_dir, 'uploads', upload_id)}
+
+    os.makedirs(self.uploads[upload_id]['dir'], exist_ok=True)
+
+    return 201, {'uploadId': upload_id}
+
+  def list_parts(self, query):
+    upload = self.uploads.get(query.get('uploadId'))
+
+    if not upload:
+      return 404, {'error': 'upload_not_found'}
+
+    parts = [{'index': i, 'digest': p['digest'], 'size': p['size']} for i, p in sorted(upload['parts'].items())]
+
+    return 200, {'parts': parts}
+
+  def put_part(self, query, headers, data):
+    upload = self.uploads.get(query.get('uploadId'))
+
+    if not upload:
+      return 404, {'error': 'upload_not_found'}
+
+    with self.lock:
+      if self.fail_parts_after is not None and self.parts_received >= self.fail_parts_after:
+        return 503, {'error': 'injected_failure'}
+
+    digest = hashlib.sha256(data).hexdigest()
+
+    if digest != headers.get(PART_DIGEST_HEADER):
+      return 400, {'error': 'part_digest_mismatch'}
+
+    index = int(query['index'])
+
+    with open(os.path.join(upload['dir'], str(index)), 'wb') as f:
+      f.write(data)
+
+    with self.lock:
+      upload['parts'][index] = {'digest': digest, 'size': len(data), 'offset': int(query.get('offset', 0))}
+      self.parts_received += 1
+      self.bytes_received += len(data)
+
+    return 200, {}
+
+  def complete_upload(self, body):
+    upload = self.uploads.get(body.get('uploadId'))
+
+    if not upload:
+      return 404, {'error': 'upload_not_found'}
+
+    digests = body.get('parts') or []
+
+    if [upload['parts'].get(i, {}).get('digest') for i in range(len(digests))] != digests:
+      return 400, {'error': 'parts_mismatch'}
+
+    model_path = self.model_path(upload['meta'].get('name'))
+
+    # Assemble parts in order into the final model file.
+    with open(model_path, 'wb') as out:
+      for i in range(len(digests)):
+        with open(os.path.join(upload['dir'], str(i)), 'rb') as f:
+          shutil.copyfileobj(f, out)
+
+    shutil.rmtree(upload['dir'], ignore_errors=True)
+
+    with self.lock:
+      self.models[upload['meta'].get('name')] = {'path': model_path, 'ext': upload['meta'].get('ext')}
+      del self.uploads[body['uploadId']]
+
+    return 201, {}
+
+  # --- Single-request multipart upload (the API's original POST /model) ---
+
+  def multipart_upload(self, headers, chunks):
+    """Receive a multipart/form-data upload, streaming its file part to disk (so any size fits in memory)."""
+    boundary = headers.get_param('boundary', header='content-type')
+
+    if not boundary:
+      return 400, {'error': 'boundary_missing'}
+
+    tmp_path = os.path.join(self.data_dir, 'upload-{}.tmp'.format(uuid.uuid4().hex))
+    received = [0]
+
+    def counted():
+      for chunk in chunks:
+        received[0] += len(chunk)
+        yield chunk
+
+    with open(tmp_path, 'wb') as f:
+      fields, has_file = parse_multipart_stream(counted(), boundary.encode('utf-8'), f)
+
+    if not has_file:
+      os.remove(tmp_path)
+      return 400, {'error': 'file_missing'}
+
+    model_path = self.model_path(fields.get('name'))
+    os.replace(tmp_path, model_path)
+
+    with self.lock:
+      self.models[fields.get('name')] = {'path': model_path, 'ext': fields.get('ext')}
+      self.bytes_received += received[0]
+
+    return 201, {}
+
+  # --- Model download (GET /model) ---
+
+  def add_model(self, name, src_path, ext):
+    """Register a local file as a downloadable model."""
+    path = self.model_path(name)
+    shutil.copyfile(src_path, path)
+
+    with self.lock:
+      self.models[name] = {'path': path, 'ext': ext}
+
+  def add_model_dir(self, name, src_dir):
+    """
+    Register a local directory as a downloadable model, stored as a zip archive like uploads are,
+    plus a gzipped tar variant served to clients that ask for one in the file type header.
+    """
+    path = self.model_path(name)
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+      for root, dirs, files in os.walk(src_dir):
+        for f in sorted(dirs + files):
+          full_path = os.path.join(root, f)
+          archive.write(full_path, os.path.relpath(full_path, src_dir))
+
+    with tarfile.open(path + '.tar.gz', 'w:gz') as archive:
+      for f in sorted(os.listdir(src_dir)):
+        archive.add(os.path.join(src_dir, f), f)
+
+    with self.lock:
+      self.models[name] = {'path': path, 'ext': 'zip', 'variants': {'tar': {'path': path + '.tar.gz', 'ext': 'tar'}}}
+
+    # Also make it available to manifest syncs.
+    files, dirs = [], []
+
+    for root, dir_names, file_names in os.walk(src_dir):
+      rel_root = os.path.relpath(root, src_dir)
+
+      if not dir_names and not file_names and rel_root != '.':
+        dirs.append(rel_root)
+
+      for f in file_names:
+        with open(os.path.join(root, f), 'rb') as body:
+          data = body.read()
+
+        digest = self.put_blob_data(data)
+        files.append({'path': os.path.normpath(os.path.join(rel_root, f)), 'size': len(data), 'digest': digest})
+
+    self.manifests[name] = {'files': files, 'dirs': dirs}
+
+  def model_etag(self, model):
+    st = os.stat(model['path'])
+    key = (st.st_size, st.st_mtime_ns)
+
+    if model.get('etag_key') != key:
+      h = hashlib.sha256()
+
+      with open(model['path'], 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+          h.update(block)
+
+      model['etag'], model['etag_key'] = '"{}"'.format(h.hexdigest()), key
+
+    return model['etag']
+
+  def download_model(self, handler, query):
+    model = self.models.get(query.get('model'))
+
+    if not model:
+      return handler.send_json(404, {'error': 'model_not_found'})
+
+    # Serve another format of the model if the client asked for one we have.
+    model = (model.get('variants') or {}).get(handler.headers.get(FILE_TYPE_HEADER), model)
+
+    size = os.path.getsize(model['path'])
+    etag = self.model_etag(model)
+
+    headers = {
+      'ETag': etag,
+      'Last-Modified': formatdate(os.path.getmtime(model['path']), usegmt=True),
+      FILE_TYPE_HEADER: model['ext'],
+      'Content-Type': 'application/octet-stream'
+    }
+
+    if self.ranges:
+      headers['Accept-Ranges'] = 'bytes'
+
+    # The client's cached copy is current.
+    if handler.headers.get('If-None-Match') == etag:
+      return handler.send_file(304, headers, model['path'], 0, 0, None)
+
+    start, end = parse_range(handler.headers.get('Range'), size) if self.ranges else (None, None)
+    if_range = handler.headers.get('If-Range')
+
+    # Serve the whole file if no (satisfiable) range was asked for, or if If-Range doesn't match.
+    if start is None or (if_range and if_range != etag):
+      return handler.send_file(200, headers, model['path'], 0, size, self.drop_after_bytes)
+
+    if start >= size:
+      headers['Content-Range'] = 'bytes */{}'.format(size)
+      return handler.send_file(416, headers, model['path'], 0, 0, None)
+
+    headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+
+    return handler.send_file(206, headers, model['path'], start, end - start + 1, self.drop_after_bytes)
+
+  # --- Manifest sync (content-addressed blobs + per-model manifests) ---
+
+  def blob_path(self, digest):
+    return os.path.join(self.data_dir, 'blobs', digest)
+
+  def put_blob_data(self, data):
+    digest = hashlib.sha256(data).hexdigest()
+    path = self.blob_path(digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, 'wb') as f:
+      f.write(data)
+
+    return digest
+
+  def missing_blobs(self, body):
+    digests = {f['digest'] for f in body.get('files') or []}
+    return 200, {'missing': sorted(d for d in digests if not os.path.exists(self.blob_path(d)))}
+
+  def put_blob(self, query, headers, data):
+    if hashlib.sha256(data).hexdigest() != query.get('digest') or query.get('digest') != headers.get(PART_DIGEST_HEADER):
+      return 400, {'error': 'blob_digest_mismatch'}
+
+    self.put_blob_data(data)
+
+    with self.lock:
+      self.bytes_received += len(data)
+
+    return 200, {}
+
+  def commit_manifest(self, body):
+    files = body.get('files') or []
+
+    if any(not os.path.exists(self.blob_path(f['digest'])) for f in files):
+      return 400, {'error': 'blobs_missing'}
+
+    with self.lock:
+      self.manifests[body.get('name')] = {'files': files, 'dirs': body.get('dirs') or []}
+
+    return 201, {}
+
+  def get_manifest(self, query):
+    manifest = self.manifests.get(query.get('model'))
+
+    if manifest is None:
+      return 404, {'error': 'manifest_not_found'}
+
+    return 200, manifest
+
+  def get_blob(self, handler, query):
+    path = self.blob_path(query.get('digest') or '')
+
+    if not os.path.exists(path):
+      return handler.send_json(404, {'error': 'blob_not_found'})
+
+    # Blobs are addressed by their digest, so it doubles as their ETag.
+    headers = {'Content-Type': 'application/octet-stream', 'ETag': '"{}"'.format(query['digest'])}
+
+    if handler.headers.get('If-None-Match') == headers['ETag']:
+      return handler.send_file(304, headers, path, 0, 0, None)
+
+    return handler.send_file(200, headers, path, 0, os.path.getsize(path), self.drop_after_bytes)
+
+  # --- Chunked files (content-defined chunks stored as blobs + per-model recipes) ---
+
+  def commit_recipe(self, body):
+    chunks = body.get('chunks') or []
+
+    if any(not os.path.exists(self.blob_path(c['digest'])) for c in chunks):
+      return 400, {'error': 'blobs_missing'}
+
+    if sum(c['size'] for c in chunks) != body.get('size'):
+      return 400, {'error': 'recipe_size_mismatch'}
+
+    # Assemble the file too, so it can also be downloaded the regular way.
+    path = self.model_path(body.get('name'))
+
+    with open(path + '.tmp', 'wb') as f:
+      for c in chunks:
+        with open(self.blob_path(c['digest']), 'rb') as blob:
+          shutil.copyfileobj(blob, f)
+
+    os.replace(path + '.tmp', path)
+
+    with self.lock:
+      self.recipes[body.get('name')] = {'ext': body.get('ext'), 'size': body.get('size'), 'chunks': chunks}
+      self.models[body.get('name')] = {'path': path, 'ext': body.get('ext')}
+
+    return 201, {}
+
+  def get_recipe(self, query):
+    recipe = self.recipes.get(query.get('model'))
+
+    if recipe is None:
+      return 404, {'error': 'recipe_not_found'}
+
+    return 200, recipe
+
+  # --- Train job logs (GET /train_job/logs) ---
+
+  def add_logs(self, lines):
+    """Append lines to the train job's log (sent to followers as they arrive)."""
+    with self.logs_cond:
+      self.log_lines.extend(lines)
+      self.logs_cond.notify_all()
+
+  def end_logs(self):
+    """Mark the train job as finished, ending follow streams once they've sent every line."""
+    with self.logs_cond:
+      self.logs_done = True
+      self.logs_cond.notify_all()
+
+  def stream_logs(self, handler, query, batch_lines=1000):
+    follow = query.get('follow') == 'true'
+    resuming = bool(query.get('offset'))
+
+    # A reconnect for an earlier train job's log finds that job's log gone.
+    if query.get('train_job_id') not in (None, self.train_job_id):
+      return handler.send_json(404, {'error': 'train_job_not_found'})
+
+    # A follower reconnecting with drop_logs on may find the API unavailable.
+    if resuming and self.drop_logs and random.random() < self.drop_logs:
+      return handler.send_json(503, {'error': 'unavailable'})
+
+    # Filters (tail, since, grep) are only applied with log_filters on, like the real API.
+    # Resuming from an offset replaces tail and since.
+    if resuming:
+      query = {k: v for k, v in query.items() if k not in ('tail', 'since')}
+
+    log_filter = LogQueryFilter(query if self.log_filters else {})
+    headers = {'X-Log-Filters': ','.join(log_filter.applied), 'X-Train-Job-Id': self.train_job_id}
+
+    with self.logs_cond:
+      pos = len(self.log_lines)
+      start = min(int(query.get('offset') or 0), pos)
+      history = log_filter.tail(log_filter.filter(self.log_lines[start:pos]))
+
+    # Unless grep'ed, the lines sent are a contiguous run of the log, so their offset can be given.
+    if log_filter.regex is None or self.grep_offsets:
+      headers['X-Log-Offset'] = str(pos - len(history))
+
+    if not follow:
+      return handler.send_json(200, {'logs': history}, headers=headers)
+
+    handler.start_chunked(200, dict(headers, **{'Content-Type': 'text/plain; charset=utf-8'}))
+
+    try:
+      for i in range(0, len(history), batch_lines):
+        if not self.send_log_chunk(handler, history[i:i + batch_lines]):
+          return
+
+      while True:
+        with self.logs_cond:
+          while pos >= len(self.log_lines) and not self.logs_done:
+            self.logs_cond.wait()
+
+          batch = self.log_lines[pos:pos + batch_lines]
+
+        if not batch:
+          break
+
+        pos += len(batch)
+        batch = log_filter.filter(batch)
+
+        if batch and not self.send_log_chunk(handler, batch):
+          return
+
+      handler.write_chunk(b'')
+    except (BrokenPipeError, ConnectionResetError):
+      handler.close_connection = True
+
+  def send_log_chunk(self, handler, lines):
+    """
+    Send lines of a followed log as a chunk -- or, with drop_logs on, sometimes cut
+    the connection partway through it.
+
+    :return: Whether the connection is still up
+    """
+    data = ('\n'.join(lines) + '\n').encode('utf-8')
+
+    if self.drop_logs and random.random() < self.drop_logs:
+      handler.wfile.write('{:x}\r\n'.format(len(data)).encode('ascii') + data[:random.randrange(len(data))])
+      handler.wfile.flush()
+      handler.close_connection = True
+      return False
+
+    handler.write_chunk(data)
+    return True
+
+  # --- Train job listing (GET /train_jobs?limit=&cursor=) ---
+
+  def list_train_jobs(self, handler, query):
+    # Time to produce a page (e.g. a database query).
+    time.sleep(self.page_delay)
+
+    start = int(query.get('cursor') or 0)
+    end = start + int(query.get('limit') or 100)
+    next_cursor = str(end) if end < len(self.train_jobs) else None
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor and self.cursor_header else {}
+
+    handler.send_json(200, {'train_jobs': self.train_jobs[start:end], 'next_cursor': next_cursor}, headers=headers)
+
+  # --- Helpers ---
+
+  def model_path(self, name):
+    path = os.path.join(self.data_dir, 'models', name or 'default')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+class StubApiHandler(BaseHTTPRequestHandler):
+  """Routes requests onto the owning StubApi instance."""
+  protocol_version = 'HTTP/1.1'
+  stub = None
+
+  def log_message(self, *args):
+    pass
+
+  def do_GET(self):
+    self._dispatch('GET')
+
+  def do_POST(self):
+    self._dispatch('POST')
+
+  def do_PUT(self):
+    self._dispatch('PUT')
+
+  def _dispatch(self, method):
+    url = urlparse(self.path)
+    query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+    route = url.path[len(self.stub.model_route):] if url.path.startswith(self.stub.model_route) else None
+
+    with self.stub.lock:
+      self.stub.requests.append((method, url.path, dict(self.headers)))
+
+    if route is not None and self.stub.tokens is not None and self.headers.get(AUTH_HEADER) not in self.stub.tokens:
+      self._raw_body()
+      return self.send_json(401, {'error': 'unauthorized'})
+
+    if url.path == '/train_job/logs' and method == 'GET':
+      return self.stub.stream_logs(self, query)
+    elif url.path == '/train_job' and method == 'POST':
+      # Creating a train job streams its logs.
+      self._json_body()
+      return self.stub.stream_logs(self, {'follow': 'true'})
+    elif url.path == '/train_jobs' and method == 'GET':
+      return self.stub.list_train_jobs(self, query)
+    elif route == '' and method == 'GET':
+      return self.stub.download_model(self, query)
+    elif route == '' and method == 'POST':
+      status, body = self.stub.multipart_upload(self.headers, self._iter_body())
+    elif route == '/manifest/missing' and method == 'POST':
+      status, body = self.stub.missing_blobs(self._json_body())
+    elif route == '/blobs' and method == 'PUT':
+      status, body = self.stub.put_blob(query, self.headers, self._raw_body())
+    elif route == '/blobs' and method == 'GET':
+      return self.stub.get_blob(self, query)
+    elif route == '/manifest' and method == 'POST':
+      status, body = self.stub.commit_manifest(self._json_body())
+    elif route == '/manifest' and method == 'GET':
+      status, body = self.stub.get_manifest(query)
+    elif route == '/recipe' and method == 'POST':
+      status, body = self.stub.commit_recipe(self._json_body())
+    elif route == '/recipe' and method == 'GET':
+      status, body = self.stub.get_recipe(query)
+    elif route == '/uploads' and method == 'POST':
+      status, body = self.stub.create_upload(self._json_body())
+    elif route == '/uploads/parts' and method == 'GET':
+      status, body = self.stub.list_parts(query)
+    elif route == '/uploads/part' and method == 'PUT':
+      status, body = self.stub.put_part(query, self.headers, self._raw_body())
+    elif route == '/uploads/complete' and method == 'POST':
+      status, body = self.stub.complete_upload(self._json_body())
+    else:
+      self._raw_body()
+      status, body = 404, {'error': 'route_not_found'}
+
+    self.send_json(status, body)
+
+  def _raw_body(self):
+    if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+      return b''.join(self._iter_chunked_body())
+
+    length = int(self.headers.get('Content-Length') or 0)
+    return self.rfile.read(length) if length else b''
+
+  def _iter_body(self, block_size=1024 * 1024):
+    if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+      yield from self._iter_chunked_body()
+      return
+
+    remaining = int(self.headers.get('Content-Length') or 0)
+
+    while remaining:
+      chunk = self.rfile.read(min(block_size, remaining))
+
+      if not chunk:
+        return
+
+      remaining -= len(chunk)
+      yield chunk
+
+  def _iter_chunked_body(self):
+    while True:
+      size = int(self.rfile.readline().split(b';', 1)[0].strip(), 16)
+
+      if size == 0:
+        # Skip (empty) trailers.
+        while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+          pass
+        return
+
+      yield self.rfile.read(size)
+      self.rfile.readline()
+
+  def _json_body(self):
+    data = self._raw_body()
+    return json.loads(data.decode('utf-8')) if data else {}
+
+  def send_file(self, status, headers, path, start, length, drop_after=None):
+    self.send_response(status)
+
+    for k, v in headers.items():
+      self.send_header(k, v)
+
+    self.send_header('Content-Length', str(length))
+    self.end_headers()
+
+    sent = 0
+    started = time.perf_counter()
+
+    try:
+      with open(path, 'rb') as f:
+        f.seek(start)
+
+        while sent < length:
+          block = f.read(min(64 * 1024, length - sent))
+
+          if drop_after is not None and sent + len(block) > drop_after:
+            # Simulate a dropped connection partway through the body.
+            self.wfile.write(block[:drop_after - sent])
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+            self.close_connection = True
+            sent = drop_after
+            break
+
+          self.wfile.write(block)
+          sent += len(block)
+
+          if self.stub.throttle_bps:
+            # Sleep off however far ahead of the per-connection rate we are.
+            ahead = sent / self.stub.throttle_bps - (time.perf_counter() - started)
+
+            if ahead > 0:
+              time.sleep(ahead)
+    except (BrokenPipeError, ConnectionResetError):
+      # Client went away (e.g. it only wanted the headers before resuming with a Range request).
+      self.close_connection = True
+
+    with self.stub.lock:
+      self.stub.bytes_sent += sent
+
+  def start_chunked(self, status, headers):
+    self.send_response(status)
+
+    for k, v in headers.items():
+      self.send_header(k, v)
+
+    self.send_header('Transfer-Encoding', 'chunked')
+    self.end_headers()
+
+  def write_chunk(self, data):
+    """Write one chunk of a chunked response (an empty one ends the body)."""
+    self.wfile.write('{:x}\r\n'.format(len(data)).encode('ascii') + data + b'\r\n')
+    self.wfile.flush()
+
+  def send_json(self, status, body, headers=None):
+    data = json.dumps(body).encode('utf-8')
+    self.send_response(status)
+
+    for k, v in (headers or {}).items():
+      self.send_header(k, v)
+
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+
+class LogQueryFilter(object):
+  """
+  The API's handling of the tail/since/grep query params of GET /train_job/logs.
+  Lines are expected to start with an ISO 8601 timestamp; ones that don't (e.g.
+  the rest of a traceback) go with the line before them.
+  """
+
+  def __init__(self, query):
+    self.tail_count = int(query['tail']) if query.get('tail') else None
+    self.since = self.parse_ts(query['since']) if query.get('since') else None
+    self.regex = re.compile(query['grep']) if query.get('grep') else None
+    self.in_range = self.since is None
+    self.applied = [name for name in ('tail', 'since', 'grep') if query.get(name)]
+
+  @staticmethod
+  def parse_ts(value):
+    try:
+      ts = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+      return None
+
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+  def filter(self, lines):
+    passed = []
+
+    for line in lines:
+      if self.since is not None:
+        ts = self.parse_ts(line.split(' ', 1)[0])
+
+        if ts is not None:
+          self.in_range = ts >= self.since
+
+      if self.in_range and (self.regex is None or self.regex.search(line)):
+        passed.append(line)
+
+    return passed
+
+  def tail(self, lines):
+    if self.tail_count is None:
+      return lines
+
+    return lines[max(len(lines) - self.tail_count, 0):] if self.tail_count else []
+
+
+def parse_multipart_stream(chunks, boundary, file_out):
+  """
+  Parse a multipart/form-data body as it arrives, writing the (single) file part's
+  contents to 'file_out' and keeping only a boundary's length of it in memory.
+
+  :return: (dict of the other fields, whether a file part was found)
+  """
+  delim = b'\r\n--' + boundary
+  buf, state = b'\r\n', 'preamble'
+  fields, part = {}, None
+  has_file = False
+
+  def emit(data):
+    if part['file']:
+      file_out.write(data)
+    else:
+      part['value'] += data
+
+  for chunk in chunks:
+    buf += chunk
+
+    while True:
+      if state in ('preamble', 'body'):
+        i = buf.find(delim)
+
+        if i < 0:
+          # Hold back enough bytes to catch a delimiter split across chunks.
+          keep = len(delim) - 1
+
+          if state == 'body' and len(buf) > keep:
+            emit(buf[:-keep])
+            buf = buf[-keep:]
+          break
+
+        if state == 'body':
+          emit(buf[:i])
+
+          if not part['file']:
+            fields[part['name']] = part['value'].decode('utf-8')
+
+        buf, state = buf[i + len(delim):], 'headers'
+      else:
+        if buf.startswith(b'--'):
+          return fields, has_file
+
+        j = buf.find(b'\r\n\r\n')
+
+        if j < 0:
+          break
+
+        msg = email.parser.BytesParser().parsebytes(buf[:j].lstrip(b'\r\n') + b'\r\n\r\n', headersonly=True)
+        is_file = msg.get_param('filename', header='content-disposition') is not None
+        has_file = has_file or is_file
+        part = {'name': msg.get_param('name', header='content-disposition'), 'file': is_file, 'value': b''}
+        buf, state = buf[j + 4:], 'body'
+
+  return fields, has_file
+
+
+def parse_range(value, size):
+  """
+  Parse a single 'Range: bytes=start-end' header (suffix ranges included).
+
+  :return: (start, end) inclusive, or (None, None) if absent/unsupported
+  """
+  if not value or not value.startswith('bytes=') or ',' in value:
+    return None, None
+
+  first, last = value[len('bytes='):].split('-', 1)
+
+  if not first:
+    return max(size - int(last), 0), size - 1
+
+  return int(first), min(int(last), size - 1) if last else size - 1
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Local stand-in for the SweetTea API.')
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=8000)
+  parser.add_argument('--data-dir')
+  opts = parser.parse_args()
+
+  stub = StubApi(opts.data_dir)
+  print('Serving stand-in SweetTea API at {} (data in {})'.format(stub.start(opts.host, opts.port), stub.data_dir))
+
+  try:
+    threading.Event().wait()
+  except KeyboardInterrupt:
+    stub.stop()
+
+
+if __name__ == '__main__':
+  main()
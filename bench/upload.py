@@ -0,0 +1,100 @@
+"""
+Model upload benchmark / resume check against the local stand-in API.
+
+Uploads a synthetic model file with the chunked uploader, interrupting the
+first attempt partway through (the stand-in starts rejecting parts), then
+re-runs the upload and checks that it resumed rather than restarted and that
+the assembled file matches the original byte for byte.
+
+Usage:
+
+  $ python bench/upload.py [--size-mb 256] [--part-size-mb 8] [--parallel 4]
+
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_api import StubApi
+from sweettea.utils.abstract_api import AbstractApi
+from sweettea.utils.file_utils.chunked_uploader import ChunkedFileUploader
+
+MB = 1024 * 1024
+
+
+def make_model(path, size):
+  with open(path, 'wb') as f:
+    remaining = size
+    while remaining:
+      n = min(remaining, 4 * MB)
+      f.write(os.urandom(n))
+      remaining -= n
+
+
+def file_digest(path):
+  h = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(4 * MB), b''):
+      h.update(block)
+  return h.hexdigest()
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+  parser.add_argument('--size-mb', type=int, default=256)
+  parser.add_argument('--part-size-mb', type=int, default=8)
+  parser.add_argument('--parallel', type=int, default=4)
+  opts = parser.parse_args()
+
+  work_dir = tempfile.mkdtemp(prefix='st-bench-')
+  model_path = os.path.join(work_dir, 'model.bin')
+  make_model(model_path, opts.size_mb * MB)
+
+  stub = StubApi()
+  api = AbstractApi(base_url=stub.start())
+  uploader = ChunkedFileUploader(api, part_size=opts.part_size_mb * MB,
+                                 state_dir=os.path.join(work_dir, 'state'),
+                                 parallel=opts.parallel,
+                                 part_retries=0)
+
+  total_parts = len(uploader.split_parts(os.path.getsize(model_path)))
+  stub.fail_parts_after = total_parts // 2
+
+  # First attempt dies halfway through.
+  try:
+    uploader.upload('/model', model_path, payload={'name': 'bench'})
+  except SystemExit:
+    pass
+
+  sent_before_resume = stub.parts_received
+  stub.fail_parts_after = None
+  uploader.part_retries = 4
+
+  start = time.perf_counter()
+  uploader.upload('/model', model_path, payload={'name': 'bench'}, completion_msg='')
+  elapsed = time.perf_counter() - start
+
+  resumed_parts = stub.parts_received - sent_before_resume
+  intact = file_digest(stub.models['bench']['path']) == file_digest(model_path)
+
+  print('\nparts: {} total, {} before interruption, {} after resume'.format(
+    total_parts, sent_before_resume, resumed_parts))
+  print('resume upload: {:.1f} MB in {:.2f}s ({:.1f} MB/s, parallel={})'.format(
+    resumed_parts * opts.part_size_mb, elapsed, resumed_parts * opts.part_size_mb / elapsed, opts.parallel))
+  print('assembled model matches: {}'.format(intact))
+
+  api.close()
+  stub.stop()
+  stub.cleanup()
+
+  if not intact or resumed_parts != total_parts - sent_before_resume:
+    exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -10,6 +10,7 @@ setup(name='sweettea',
       license='MIT',
       packages=find_packages(),
       include_package_data=True,
+      python_requires='>=3.9',
       install_requires=[
         'click',
         'awesome-slugify',
@@ -1,29 +1,18 @@
-from sweettea.commands.create import create
-from sweettea.commands.delete import delete
-from sweettea.commands.download import download
-from sweettea.commands.get import get
-from sweettea.commands.help import help
-from sweettea.commands.init import init
-from sweettea.commands.login import login
-from sweettea.commands.logout import logout
-from sweettea.commands.logs import logs
-from sweettea.commands.train import train
-from sweettea.commands.update import update
-from sweettea.commands.upload import upload
-from sweettea.commands.version import version
-
-all_cmds = [
-  create,
-  delete,
-  download,
-  get,
-  help,
-  init,
-  login,
-  logout,
-  logs,
-  train,
-  update,
-  upload,
-  version
-]
\ No newline at end of file
+# Map of command name --> import path of each top-level command.
+# Modules are only imported once their command is used (see LazyGroup).
+all_cmds = {
+  'create': 'sweettea.commands.create:create',
+  'delete': 'sweettea.commands.delete:delete',
+  'download': 'sweettea.commands.download:download',
+  'get': 'sweettea.commands.get:get',
+  'help': 'sweettea.commands.help:help',
+  'init': 'sweettea.commands.init:init',
+  'login': 'sweettea.commands.login:login',
+  'logout': 'sweettea.commands.logout:logout',
+  'logs': 'sweettea.commands.logs:logs',
+  'mirror': 'sweettea.commands.mirror:mirror',
+  'train': 'sweettea.commands.train:train',
+  'update': 'sweettea.commands.update:update',
+  'upload': 'sweettea.commands.upload:upload',
+  'version': 'sweettea.commands.version:version'
+}
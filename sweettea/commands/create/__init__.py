@@ -1,13 +1,14 @@
 import click
-from sweettea.resources import deploy
 from sweettea.utils.auth import auth_required
+from sweettea.utils.lazy_group import LazyGroup
 
-sub_commands = [
-  deploy.create
-]
+# Map of sub-command name --> import path of that sub-command.
+sub_commands = {
+  'deploy': 'sweettea.resources.deploy:create'
+}
 
 
-@click.group()
+@click.group(cls=LazyGroup, lazy_commands=sub_commands)
 def create():
   """
   Create a SweetTea resource.
@@ -19,6 +20,3 @@ def create():
   # Must be logged in to perform any create commands.
   auth_required()
   pass
-
-
-[create.add_command(c) for c in sub_commands]
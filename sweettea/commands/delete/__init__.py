@@ -1,12 +1,14 @@
 import click
 from sweettea.utils.auth import auth_required
+from sweettea.utils.lazy_group import LazyGroup
 
-sub_commands = [
+# Map of sub-command name --> import path of that sub-command.
+sub_commands = {
 
-]
+}
 
 
-@click.group()
+@click.group(cls=LazyGroup, lazy_commands=sub_commands)
 def delete():
   """
   Delete a SweetTea resource.
@@ -18,6 +20,3 @@ def delete():
   # Must be logged in to perform any delete commands.
   auth_required()
   pass
-
-
-[delete.add_command(c) for c in sub_commands]
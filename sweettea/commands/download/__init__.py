@@ -1,15 +1,22 @@
 import click
+from sweettea.utils.auth import auth_required
+from sweettea.utils.lazy_group import LazyGroup
 
+# Map of sub-command name --> import path of that sub-command.
+sub_commands = {
+  'model': 'sweettea.resources.model:download'
+}
 
-@click.group()
+
+@click.group(cls=LazyGroup, lazy_commands=sub_commands)
 def download():
   """
   Download a SweetTea resource.
 
   Currently supported resources:
 
-  * ...
+  * model
   """
+  # Must be logged in to perform any download commands.
+  auth_required()
   pass
-
-# download.add_command(...)
\ No newline at end of file
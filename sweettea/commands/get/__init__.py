@@ -1,13 +1,14 @@
 import click
-from sweettea.resources import project
 from sweettea.utils.auth import auth_required
+from sweettea.utils.lazy_group import LazyGroup
 
-sub_commands = [
-  project.get
-]
+# Map of sub-command name --> import path of that sub-command.
+sub_commands = {
+  'project': 'sweettea.resources.project:get'
+}
 
 
-@click.group()
+@click.group(cls=LazyGroup, lazy_commands=sub_commands)
 def get():
   """
   Get a SweetTea resource.
@@ -19,6 +20,3 @@ def get():
   # Must be logged in to perform any get commands.
   auth_required()
   pass
-
-
-[get.add_command(c) for c in sub_commands]
@@ -7,4 +7,4 @@ def help():
   Display global CLI help message
   """
   from sweettea.main import cli
-  cli('--help')
\ No newline at end of file
+  cli(['--help'])
\ No newline at end of file
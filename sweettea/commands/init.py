@@ -1,11 +1,7 @@
 import click
 from sweettea import log
 from sweettea.definitions import *
-from sweettea.utils import project_config
-from sweettea.utils.api import api
 from sweettea.utils.auth import auth_required
-from sweettea.utils.payload_util import project_payload
-from sweettea.utils.project_config.helpers import write_placeholders
 
 
 @click.command()
@@ -21,6 +17,12 @@ def init():
 
   Ex: $ st init
   """
+  # Deferred so that listing/running other commands doesn't pay for these imports.
+  from sweettea.utils import project_config
+  from sweettea.utils.api import api
+  from sweettea.utils.payload_util import project_payload
+  from sweettea.utils.project_config.helpers import write_placeholders
+
   # Must already be logged in to perform this command.
   auth_required()
 
@@ -2,7 +2,6 @@ import click
 from sweettea import log
 from sweettea.definitions import auth_header_name
 from sweettea.utils import auth
-from sweettea.utils.api import api
 
 
 @click.command()
@@ -17,6 +16,9 @@ def login(email, password):
 
   Ex: $ st login
   """
+  # Deferred so that listing/running other commands doesn't pay for these imports.
+  from sweettea.utils.api import api
+
   log('Enter your SweetTea credentials:')
 
   # Prompt user for username unless already provided.
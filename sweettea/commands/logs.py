@@ -1,47 +1,146 @@
 import click
 from sweettea import log
-from sweettea.utils import gitconfig
-from sweettea.utils.api import api
 from sweettea.utils.auth import auth_required
 
 
 @click.command()
 @click.option('--follow', '-f', is_flag=True)
-def logs(follow):
+@click.option('--tail', '-n', type=int)
+@click.option('--since')
+@click.option('--grep')
+@click.option('--local', is_flag=True)
+def logs(follow, tail, since, grep, local):
   """
   Show logs from the latest train job.
 
   Includes logs from preprocessing, training, and testing steps.
 
   If the --follow (-f) option is provided, the logs will be streamed
-  and followed in real-time.
+  and followed in real-time (reconnecting, without losing or repeating
+  lines, if the connection drops).
 
-  Ex: tensorci logs -f
+  --tail (-n) shows only the last N lines, --since only lines from a
+  timestamp (e.g. 2018-06-01T12:00:00Z) or duration ago (e.g. 15m, 1h30m, 2d)
+  onwards, and --grep only lines matching a regular expression.
+
+  Logs received are also kept in a compressed local archive. With --local,
+  that archive is searched instead, without going to the API.
+
+  Ex: tensorci logs -f --since 1h --grep 'loss|error'
+
+  Ex: tensorci logs --local --since 2d --grep Traceback
   """
-  # Must already be logged in to perform this command.
-  auth_required()
+  # Deferred so that listing/running other commands doesn't pay for these imports.
+  from sweettea.utils import gitconfig
+  from sweettea.utils.api import api
+  from sweettea.utils.log_archive import TRAIN_JOB_PARAM, latest_log_archive, open_log_archive, train_job_id
+  from sweettea.utils.log_filter import LogFilter, applied_filters, parse_since
+  from sweettea.utils.log_stream import log_offset
+
+  # Must already be logged in to perform this command (unless only searching local logs).
+  if not local:
+    auth_required()
+
+  # Validate the filters before making any requests.
+  try:
+    log_filter = LogFilter(since=parse_since(since) if since is not None else None, pattern=grep, tail=tail)
+  except ValueError as e:
+    log(str(e))
+    exit(1)
 
   # Find this git project's remote url namespace from inside .git/config
   git_repo_nsp = gitconfig.get_remote_nsp()
 
+  if local:
+    if follow:
+      log('--local can\'t be combined with --follow.')
+      exit(1)
+
+    # Search the logs archived on this machine, without the API.
+    archive = latest_log_archive(git_repo_nsp)
+
+    if not archive:
+      log('No logs archived locally for this project yet -- '
+          'they\'re kept as "st logs" and "st train" receive them.')
+      exit(1)
+
+    write_lines(archive.search(log_filter))
+    return
+
   # Built the payload.
   payload = {
     'project_nsp': git_repo_nsp,
     'follow': str(follow).lower()  # 'true' or 'false' --> will be converted into query param anyways
   }
 
+  # Ask the API to do the filtering, so only matching lines are sent. A followed log
+  # is grep'ed here instead, so that its lines can be counted to resume from -- unless
+  # it's also tailed, as only the API can find the last matching lines.
+  payload.update(log_filter.query_params(exclude=('grep',) if follow and tail is None else ()))
+
   try:
     # Get the logs for this deployment.
-    resp = api.get('/train_job/logs', payload=payload, stream=follow)
+    resp = api.get('/train_job/logs', payload=payload, stream=True)
   except KeyboardInterrupt:
     return
 
+  # Do whatever filtering the API didn't do itself.
+  applied = applied_filters(resp.headers)
+  log_filter = log_filter.without(applied)
+
+  # Lines of a log the API grep'ed aren't a contiguous run of it, so they can't be
+  # counted to resume from, or placed in the local archive (kept for --local).
+  contiguous = 'grep' not in applied
+  archive = open_log_archive(git_repo_nsp, resp.headers) if contiguous else None
+
   if follow:
-    # Streaming log response
-    resp.log_stream()
-  else:
-    # JSON dump of logs
-    logs = resp.json.get('logs')
-
-    if logs:
-      log('\n'.join(logs))
\ No newline at end of file
+    job = train_job_id(resp.headers)
+
+    def resume(offset):
+      # Pick this job's log back up at the first line not yet received (which replaces --tail and --since).
+      resume_payload = {k: v for k, v in payload.items() if k not in ('tail', 'since')}
+      resume_payload.update({'offset': offset, TRAIN_JOB_PARAM: job})
+
+      return api.get('/train_job/logs', payload=resume_payload, stream=True,
+                     log_on_error=False, exit_on_error=False, raise_errors=True)
+
+    # Streaming log response (the end of a followed log isn't known, so --tail is left to the API).
+    # Without the job's id, a reconnect could pick up another job's log, so it isn't resumed.
+    resp.log_stream(line_filter=log_filter.filter if log_filter.active else None,
+                    resume=resume if contiguous and job else None,
+                    archive=archive)
+    return
+
+  # JSON dump of logs, parsed a line at a time as it's read.
+  lines = resp.iter_items('logs')
+
+  try:
+    if archive:
+      lines = archive.tee(lines, log_offset(resp.headers))
+
+    write_lines(log_filter.apply(lines))
+  finally:
+    if archive:
+      archive.close()
+
+
+def write_lines(lines, batch_size=1000):
+  """
+  Write lines to stdout in batches.
+
+  :param lines: Lines to write
+    :type: iterable(str)
+  :param int batch_size: Lines per write
+  """
+  from itertools import islice
+  from sweettea.utils.log_stream import LineWriter
+
+  lines = iter(lines)
+  out = LineWriter(click.get_text_stream('stdout'))
+  batch = list(islice(lines, batch_size))
+
+  while batch:
+    out.write(batch)
+    batch = list(islice(lines, batch_size))
+
+  out.flush()
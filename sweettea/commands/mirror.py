@@ -0,0 +1,34 @@
+import click
+from sweettea import log
+from sweettea.config import config
+
+
+@click.command()
+@click.option('--host', default='0.0.0.0')
+@click.option('--port', '-p', type=int, default=8700)
+@click.option('--store', '-d', required=True)
+@click.option('--upstream', default=config.API_URL)
+@click.option('--ttl', type=int, default=60)
+@click.option('--max-size-mb', type=int, default=100 * 1024)
+def mirror(host, port, store, upstream, ttl, max_size_mb):
+  """
+  Run a caching mirror of model downloads for the local network.
+
+  Models (and the manifests, recipes and blobs of --sync and --cdc downloads) are
+  fetched from the SweetTea API (--upstream) once, kept in --store and served from
+  there, range requests included. Concurrent downloads of the same model share one
+  upstream fetch. A stored model is only served to a machine the API accepted for it
+  within the last --ttl seconds, and is revalidated with the API otherwise. Least
+  recently used models are evicted once --store holds more than --max-size-mb (0 for
+  no limit).
+
+  Point other machines at it by setting MIRROR_URL (e.g. http://mirror-host:8700).
+
+  Ex: $ st mirror --store /var/cache/st-mirror
+  """
+  # Deferred so that listing/running other commands doesn't pay for these imports.
+  from sweettea.utils.mirror import ModelMirror
+
+  log('Mirroring model downloads from {} on port {} (store: {}).'.format(upstream, port, store))
+
+  ModelMirror(upstream, store, ttl=ttl, max_size=max_size_mb * 1024 * 1024 or None).serve(host, port)
@@ -1,10 +1,7 @@
 import click
 import json
 from sweettea.definitions import default_model_name
-from sweettea.utils.api import api
 from sweettea.utils.auth import auth_required
-from sweettea.utils.env_util import parse_cmd_envs
-from sweettea.utils.payload_util import project_payload
 
 
 @click.command()
@@ -28,6 +25,13 @@ def train(model, sha, env_file, env):
 
   Ex: $ st train --model my-model
   """
+  # Deferred so that listing/running other commands doesn't pay for these imports.
+  from sweettea.utils.api import api
+  from sweettea.utils.env_util import parse_cmd_envs
+  from sweettea.utils.gitconfig import get_remote_nsp
+  from sweettea.utils.log_archive import TRAIN_JOB_PARAM, open_log_archive, train_job_id
+  from sweettea.utils.payload_util import project_payload
+
   # Must already be logged in to perform this command.
   auth_required()
 
@@ -47,5 +51,18 @@ def train(model, sha, env_file, env):
   except KeyboardInterrupt:
     return
 
-  # Stream the response logs.
-  resp.log_stream()
+  job = train_job_id(resp.headers)
+
+  def resume(offset):
+    # If the connection drops, carry on following this train job's logs from where it left off.
+    return api.get('/train_job/logs',
+                   payload=project_payload({'follow': 'true', 'offset': offset, TRAIN_JOB_PARAM: job},
+                                           key='project_nsp'),
+                   stream=True,
+                   log_on_error=False,
+                   exit_on_error=False,
+                   raise_errors=True)
+
+  # Stream the response logs, keeping them in the local archive (for 'st logs --local').
+  # Without the job's id, a reconnect could pick up another job's log, so it isn't resumed.
+  resp.log_stream(resume=resume if job else None, archive=open_log_archive(get_remote_nsp(), resp.headers))
@@ -1,13 +1,14 @@
 import click
-from sweettea.resources import model
 from sweettea.utils.auth import auth_required
+from sweettea.utils.lazy_group import LazyGroup
 
-sub_commands = [
-  model.upload,
-]
+# Map of sub-command name --> import path of that sub-command.
+sub_commands = {
+  'model': 'sweettea.resources.model:upload'
+}
 
 
-@click.group()
+@click.group(cls=LazyGroup, lazy_commands=sub_commands)
 def upload():
   """
   Upload a SweetTea resource.
@@ -19,5 +20,3 @@ def upload():
   # Must be logged in to perform any upload commands.
   auth_required()
   pass
-
-[upload.add_command(c) for c in sub_commands]
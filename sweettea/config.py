@@ -10,5 +10,11 @@ class Config:
     self.DOMAIN = os.environ.get('DOMAIN', 'api.sweettea.io')
     self.API_VERSION = os.environ.get('API_VERSION', 'v1')
     self.API_URL = os.environ.get('API_URL', 'https://{}/{}'.format(self.DOMAIN, self.API_VERSION))
+    self.HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 16))
+    self.HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 2))
+    self.MODEL_CACHE_DIR = os.environ.get('MODEL_CACHE_DIR', os.path.join(
+      os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'sweettea', 'models'))
+    self.MIRROR_URL = os.environ.get('MIRROR_URL')  # model downloads go through this 'st mirror' if set
+    self.MODEL_CACHE_MAX_MB = int(os.environ.get('MODEL_CACHE_MAX_MB', 20 * 1024))  # 0 disables the cache
 
 config = Config()
\ No newline at end of file
@@ -24,4 +24,19 @@ default_archive_fmt = 'zip'
 
 tmp_model_archive_path = os.path.join(st_tmp_dir, 'model.{}'.format(default_archive_fmt))
 
+# Archive format that can be extracted as it downloads (sent if the API supports it).
+streaming_archive_fmt = 'tar'
+
+upload_state_dir = os.path.join(st_tmp_dir, 'uploads')
+
+manifest_state_dir = os.path.join(st_tmp_dir, 'manifests')
+
+chunk_index_path = os.path.join(st_tmp_dir, 'chunks', 'index.json')
+
+log_archive_dir = os.path.join(st_tmp_dir, 'logs')
+
+default_part_size = 8 * 1024 * 1024
+
+part_digest_header_name = 'Sweet-Tea-Part-Digest'
+
 default_mime_type = 'text/plain'
@@ -1,15 +1,13 @@
 import click
 from sweettea.commands import all_cmds
+from sweettea.utils.lazy_group import LazyGroup
 
 # Allow '-h' to be an alias of '--help'
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
 
-# 'st' entrypoint
-@click.group(context_settings=CONTEXT_SETTINGS)
+# 'st' entrypoint -- all commands are attached lazily so that running one
+# command doesn't import the dependencies of every other command.
+@click.group(cls=LazyGroup, lazy_commands=all_cmds, context_settings=CONTEXT_SETTINGS)
 def cli():
   pass
-
-
-# Attach all commands to the CLI
-[cli.add_command(cmd) for cmd in all_cmds]
\ No newline at end of file
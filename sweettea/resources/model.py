@@ -1,10 +1,18 @@
 import click
+import os
 from sweettea import log
-from sweettea.definitions import default_model_name
-from sweettea.utils.api import api
+from sweettea.config import config
+from sweettea.definitions import default_model_name, default_part_size
+from sweettea.utils.api import api, download_api
+from sweettea.utils.file_utils import get_dir_size
+from sweettea.utils.file_utils.cdc import CdcFileDownloader, CdcFileUploader
+from sweettea.utils.file_utils.chunked_uploader import ChunkedFileUploader
 from sweettea.utils.file_utils.file_downloader import FileDownloader
 from sweettea.utils.file_utils.file_uploader import FileUploader
-from sweettea.utils.model_util import get_upload_ready_model_path
+from sweettea.utils.file_utils.manifest_sync import ManifestSyncDownloader, ManifestSyncUploader
+from sweettea.utils.file_utils.model_cache import ModelCache
+from sweettea.utils.file_utils.zip_writer import DEFAULT_COMPRESSION_LEVEL
+from sweettea.utils.model_util import get_archive_digest, get_model_ignore_rules, get_upload_ready_model_path
 from sweettea.utils.payload_util import project_payload
 
 MODEL_CMD = 'model'
@@ -13,25 +21,209 @@ MODEL_CMD = 'model'
 @click.command(name=MODEL_CMD)
 @click.option('--name', '-n', default=default_model_name)
 @click.option('--path', '-i', required=True)
-def upload(name, path):
-  FileUploader(api).upload(
-    '/model',
-    get_upload_ready_model_path(path),
-    payload=project_payload({'name': name}),
-    completion_msg='\nUploading model...'
-  )
+@click.option('--chunked', is_flag=True)
+@click.option('--part-size', type=int, default=default_part_size // (1024 * 1024))
+@click.option('--parallel', '-j', type=int, default=1)
+@click.option('--stream', is_flag=True)
+@click.option('--compression-level', type=click.IntRange(0, 9), default=DEFAULT_COMPRESSION_LEVEL)
+@click.option('--sync', is_flag=True)
+@click.option('--cdc', is_flag=True)
+@click.option('--hash-contents', is_flag=True)
+@click.option('--reproducible', is_flag=True)
+@click.option('--dry-run', is_flag=True)
+@click.option('--scan-workers', type=click.IntRange(0, 64), default=0)
+def upload(name, path, chunked, part_size, parallel, stream, compression_level, sync, cdc, hash_contents,
+           reproducible, dry_run, scan_workers):
+  """
+  Upload a model file or directory.
+
+  If --chunked is provided, the model is uploaded in parts of --part-size MiB
+  (default 8). An interrupted chunked upload resumes from the last uploaded part
+  when the same command is run again.
+
+  If --parallel (-j) N is greater than 1, N parts are uploaded at once (implies --chunked).
+
+  If --stream is provided and the model is a directory, it's zipped straight into
+  the upload request instead of to a temporary archive first. Streamed uploads
+  can't be chunked.
+
+  Directories are compressed on all CPU cores at --compression-level (0-9, default 6);
+  files that are already compressed are stored as-is. If the directory hasn't changed
+  since it was last zipped (same paths, sizes and mtimes -- plus contents, with
+  --hash-contents), the existing archive is reused.
+
+  Paths inside a model directory matching the gitignore-style patterns in its .stignore
+  file, or in training.model.ignore of the project config, are left out.
+  Pass --dry-run to see what would be uploaded without uploading it.
+
+  On network filesystems, --scan-workers N stats (and starts reading) files on N threads
+  while a directory is scanned, instead of one round trip at a time.
+
+  If --reproducible is provided, directories are zipped in sorted order with fixed
+  timestamps and permissions, so identical trees always produce identical archives.
+
+  If --sync is provided and the model is a directory, only the files the API doesn't
+  already have are uploaded (by comparing a manifest of file digests), --parallel at once.
+
+  If --cdc is provided and the model is a single file, it's split into content-defined
+  chunks and only the chunks the API doesn't already have (e.g. from a previous version
+  of the same checkpoint) are uploaded, --parallel at once.
+
+  Ex: $ st upload model --name my-model --path path/to/model --chunked
+  """
+  if not os.path.exists(path):
+    log('No model file or directory found at "{}".'.format(path))
+    exit(1)
+
+  ignore = get_model_ignore_rules(path) if os.path.isdir(path) else None
+
+  if dry_run:
+    log_upload_size(path, ignore)
+    return
+
+  if cdc and os.path.isfile(path):
+    if chunked or stream:
+      log('--cdc can\'t be combined with --chunked or --stream.')
+      exit(1)
+
+    uploader = CdcFileUploader(api, parallel=parallel) if parallel > 1 else CdcFileUploader(api)
+
+    if uploader.upload('/model', path, payload=project_payload({'name': name}), completion_msg='\nUploading model...'):
+      log('Successfully uploaded model.')
+      return
+
+    log('The API doesn\'t support chunked file syncs -- uploading the whole model instead.')
+
+  if sync and os.path.isdir(path):
+    if chunked or stream:
+      log('--sync can\'t be combined with --chunked or --stream.')
+      exit(1)
+
+    uploader = ManifestSyncUploader(api, parallel=parallel) if parallel > 1 else ManifestSyncUploader(api)
+
+    if uploader.upload('/model', path, payload=project_payload({'name': name}), completion_msg='\nUploading model...',
+                       ignore=ignore):
+      log('Successfully uploaded model.')
+      return
+
+    log('The API doesn\'t support manifest syncs -- uploading the whole model instead.')
+
+  if stream and os.path.isdir(path):
+    if chunked or parallel > 1:
+      log('--stream can\'t be combined with --chunked or --parallel.')
+      exit(1)
+
+    FileUploader(api).upload_dir_stream(
+      '/model',
+      path,
+      payload=project_payload({'name': name}),
+      completion_msg='\nUploading model...',
+      compression_level=compression_level,
+      reproducible=reproducible,
+      ignore=ignore,
+      scan_workers=scan_workers
+    )
+
+    log('Successfully uploaded model.')
+    return
+
+  upload_path = get_upload_ready_model_path(path, compression_level=compression_level, hash_contents=hash_contents,
+                                            reproducible=reproducible, ignore=ignore, scan_workers=scan_workers)
+
+  if chunked or parallel > 1:
+    # Resume by the archive's digest, so re-zipping an unchanged directory (--reproducible) doesn't start over.
+    ChunkedFileUploader(api, part_size=part_size * 1024 * 1024, parallel=parallel).upload(
+      '/model',
+      upload_path,
+      payload=project_payload({'name': name}),
+      completion_msg='\nUploading model...',
+      digest=get_archive_digest(upload_path)
+    )
+  else:
+    FileUploader(api).upload(
+      '/model',
+      upload_path,
+      payload=project_payload({'name': name}),
+      completion_msg='\nUploading model...'
+    )
 
   log('Successfully uploaded model.')
 
 
+def log_upload_size(path, ignore):
+  """Report how much of a model would be uploaded."""
+  if not os.path.isdir(path):
+    log('Would upload "{}" ({:,} bytes).'.format(path, os.path.getsize(path)))
+    return
+
+  total = get_dir_size(path)
+  included = get_dir_size(path, ignore=ignore)
+
+  log('Would upload {:,} of {:,} bytes in "{}" ({:,} bytes excluded).'.format(included, total, path, total - included))
+
+
 @click.command(name=MODEL_CMD)
 @click.option('--name', '-n', default=default_model_name)
 @click.option('--path', '-o', required=True)
-def download(name, path):
-  FileDownloader(api).download(
+@click.option('--segments', '-s', type=click.IntRange(1, 32), default=1)
+@click.option('--stream', is_flag=True)
+@click.option('--no-cache', is_flag=True)
+@click.option('--sync', is_flag=True)
+@click.option('--cdc', is_flag=True)
+def download(name, path, segments, stream, no_cache, sync, cdc):
+  """
+  Download a model file or directory.
+
+  If --segments N is greater than 1 and the API supports range requests, the model
+  is fetched as N byte ranges at once, which helps when a single connection can't
+  saturate the link. Interrupted downloads resume when the same command is run again.
+
+  If --stream is provided and the model is a directory, it's extracted into --path
+  while it downloads instead of being saved as an archive and extracted afterwards.
+  Streamed downloads can't be segmented.
+
+  Downloaded models are kept in a local cache (MODEL_CACHE_DIR, capped at MODEL_CACHE_MAX_MB),
+  and later downloads of the same model are linked from it if the API confirms it's still
+  current. Pass --no-cache to bypass it.
+
+  If --sync is provided and --path is an existing model directory, only the files
+  that changed since it was downloaded are fetched.
+
+  If --cdc is provided and the model is a single file uploaded with --cdc, only the
+  chunks that aren't already in local files (e.g. the previous version) are fetched.
+
+  If MIRROR_URL is set, the model (--sync and --cdc downloads included) is downloaded
+  through that 'st mirror' instead of straight from the API.
+
+  Ex: $ st download model --name my-model --path path/to/model --segments 4
+  """
+  if stream and segments > 1:
+    log('--stream can\'t be combined with --segments.')
+    exit(1)
+
+  if no_cache or not config.MODEL_CACHE_MAX_MB:
+    cache = None
+  else:
+    cache = ModelCache(config.MODEL_CACHE_DIR, config.MODEL_CACHE_MAX_MB * 1024 * 1024)
+
+  if sync and cdc:
+    log('--sync can\'t be combined with --cdc.')
+    exit(1)
+
+  if sync:
+    downloader = ManifestSyncDownloader(download_api)
+  elif cdc:
+    downloader = CdcFileDownloader(download_api)
+  else:
+    downloader = FileDownloader(download_api)
+
+  downloader.download(
     '/model',
     path,
-    payload=project_payload({'model': name})
+    payload=project_payload({'model': name}),
+    segments=segments,
+    stream_extract=stream,
+    cache=cache
   )
 
   log('\nSaved model at "{}".'.format(path))
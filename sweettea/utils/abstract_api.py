@@ -1,6 +1,19 @@
+import click
 import requests
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
 from sweettea import log
-from sweettea.utils.type_util import to_str
+from sweettea.utils.json_stream import JsonItemStream
+from sweettea.utils.log_stream import LineWriter, backoff_delay, iter_line_batches, log_offset
+
+# Errors reading a streamed body that mean the connection dropped.
+STREAM_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                 ProtocolError, ReadTimeoutError)
 
 
 class AbstractApi(object):
@@ -18,6 +31,12 @@ class AbstractApi(object):
     - Base headers (used on all requests)
     - Request-specific headers (can overwrite base headers)
     - Auth headers (can either be static or read a token from a provided function)
+    - Connection pool sizing (all requests share one pooled, keep-alive 'requests.Session')
+    - Cursor-paginated listings (see 'paginate')
+
+  Instances are safe to share across threads -- headers are built fresh for each
+  request and the underlying connection pool hands out one connection per request.
+  Call 'close' (or use the client as a context manager) to release pooled connections.
 
   Basic usage:
     api_client = AbstractApi(base_url='https://myurl.com/api',
@@ -31,22 +50,87 @@ class AbstractApi(object):
     resp.json           # => {'key': 'parsed json response'}
     resp.headers        # {'My-Response-Header': 'some value'}
     resp.response_obj   # 'requests.models.Response' class instance
+
+  Or with an explicit lifecycle:
+
+    with AbstractApi(base_url='https://myurl.com/api', pool_maxsize=16) as api_client:
+      api_client.get('/my-route')
   """
 
   def __init__(self, base_url=None, base_headers=None, auth_header_name=None,
-               auth_header_val=None, auth_header_val_getter=None):
+               auth_header_val=None, auth_header_val_getter=None, pool_connections=10,
+               pool_maxsize=10, pool_block=False, max_retries=0, tcp_keepalive=True):
     """
     :param str base_url: Base url of the API you wish to hit
     :param dict base_headers: Headers to send with every request
     :param str auth_header_name: Name of authorization header
     :param str auth_header_val: Value of authorization header (overwritten by auth_header_val_getter)
     :param function auth_header_val_getter: Function that returns the value of the authorization header
+    :param int pool_connections: Number of per-host connection pools to cache
+    :param int pool_maxsize: Max number of connections kept alive per host
+    :param bool pool_block: Whether to block (rather than open a throwaway connection) when a host's pool is exhausted
+    :param int max_retries: Number of retries on failed connection attempts
+    :param bool tcp_keepalive: Whether to enable TCP keep-alive probes on pooled sockets
     """
     self.base_url = base_url.rstrip('/')
     self.base_headers = base_headers or {}
     self.auth_header_name = auth_header_name
     self.auth_header_val = auth_header_val
     self.auth_header_val_getter = auth_header_val_getter
+    self.pool_connections = pool_connections
+    self.pool_maxsize = pool_maxsize
+    self.pool_block = pool_block
+    self.max_retries = max_retries
+    self.tcp_keepalive = tcp_keepalive
+    self._session = None
+    self._session_lock = threading.Lock()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  @property
+  def session(self):
+    """
+    Pooled session shared by all requests made through this client.
+    Created on first use (and re-created if used again after 'close').
+
+    :rtype: requests.Session
+    """
+    if self._session is None:
+      with self._session_lock:
+        if self._session is None:
+          self._session = self._create_session()
+
+    return self._session
+
+  def close(self):
+    """Close the pooled session, releasing all of its kept-alive connections."""
+    with self._session_lock:
+      session, self._session = self._session, None
+
+    if session:
+      session.close()
+
+  def _create_session(self):
+    """
+    Create a new session with a connection pool sized per this client's config.
+
+    :rtype: requests.Session
+    """
+    adapter = PooledHTTPAdapter(pool_connections=self.pool_connections,
+                                pool_maxsize=self.pool_maxsize,
+                                pool_block=self.pool_block,
+                                max_retries=self.max_retries,
+                                tcp_keepalive=self.tcp_keepalive)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
 
   def get(self, route, **kwargs):
     """
@@ -96,8 +180,79 @@ class AbstractApi(object):
     """
     return self.make_request('delete', route, **kwargs)
 
+  def paginate(self, route, items_path, payload=None, cursor_param='cursor', cursor_field='next_cursor',
+               cursor_header='X-Next-Cursor', prefetch=True, **kwargs):
+    """
+    Iterate over the items of every page of a cursor-paginated GET route.
+
+    Each page is streamed and its items parsed as they arrive (see
+    AbstractApiResponse.iter_items), so the first item is available right away and
+    only the item being parsed is held in memory. The next page's cursor is read
+    from the 'cursor_header' response header or, failing that, the page's top-level
+    'cursor_field' member. With 'prefetch', the next page is requested on a
+    background thread as soon as its cursor is known, while this page is still
+    being consumed.
+
+      for job in api.paginate('/train_jobs', 'train_jobs', payload={'limit': 100}):
+        print(job['id'])
+
+    :param str route: Route to hit on top of 'self.base_url'
+    :param str items_path: Dot-separated keys leading to each page's array of items
+    :param dict payload: Query params sent with every page
+    :param str cursor_param: Query param to send the next page's cursor as
+    :param str cursor_field: Top-level member of a page holding the next page's cursor
+    :param str cursor_header: Response header holding the next page's cursor
+    :param bool prefetch: Whether to request the next page while the current one is consumed
+    ** See 'self.make_request' for other accepted kwargs params **
+
+    :return: Generator of items
+    """
+    payload = payload or {}
+
+    def fetch_page(cursor):
+      page_payload = dict(payload, **{cursor_param: cursor}) if cursor else payload
+      return self.get(route, payload=page_payload, stream=True, **kwargs)
+
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    resp, next_page = fetch_page(None), None
+
+    try:
+      while resp and resp.ok:
+        items = resp.iter_items(items_path)
+        cursor = resp.headers.get(cursor_header)
+
+        if executor and cursor:
+          next_page = executor.submit(fetch_page, cursor)
+
+        for item in items:
+          # A cursor ahead of the items in the body is known by the first item.
+          if executor and not next_page and items.fields.get(cursor_field):
+            cursor = items.fields[cursor_field]
+            next_page = executor.submit(fetch_page, cursor)
+
+          yield item
+
+        cursor = cursor or items.fields.get(cursor_field)
+        resp.close()
+
+        if next_page:
+          resp, next_page = next_page.result(), None
+        else:
+          resp = fetch_page(cursor) if cursor else None
+    finally:
+      if resp:
+        resp.close()
+
+      if executor:
+        # Close a prefetched page that won't be read.
+        if next_page and not next_page.cancel() and not next_page.exception():
+          next_page.result().close()
+
+        executor.shutdown(wait=False)
+
   def make_request(self, method, route, payload=None, headers=None, stream=False,
-                   mp_upload_monitor=None, log_on_error=True, exit_on_error=True):
+                   mp_upload_monitor=None, data=None, timeout=None, log_on_error=True,
+                   exit_on_error=True, raise_errors=False):
     """
     Actually perform the API call.
 
@@ -106,7 +261,8 @@ class AbstractApi(object):
     :param str route:
       API route to hit on top of self.base_url
     :param dict payload:
-      Payload to provide with request. For GET and DELETE requests, these are converted into query params.
+      Payload to provide with request. For GET and DELETE requests, or when a raw 'data' body is
+      provided, these are converted into query params.
     :param dict headers:
       Request-specific headers. Will overwrite any self.base_headers with the same key.
     :param bool stream:
@@ -114,25 +270,34 @@ class AbstractApi(object):
     :param mp_upload_monitor:
       Multipart encoder monitor for form-uploaded data
       :type: requests_toolbelt.multipart.encoder.MultipartEncoderMonitor
+    :param data:
+      Raw request body (bytes, file-like object or generator of bytes)
+    :param timeout:
+      Seconds to wait for the server -- either a float or a (connect, read) tuple (default: no timeout)
     :param bool log_on_error:
       Whether to log an error message if the request fails
     :param bool exit_on_error:
       Whether to exit if the request fails
+    :param bool raise_errors:
+      Whether to raise connection-level errors (rather than logging them and exiting),
+      for callers that retry requests themselves
     :return: an API response object
     :rtype: AbstractApiResponse
     """
-    # Get the proper method to call on the 'requests' object (get, post, put, or delete).
-    request = getattr(requests, method)
-
     # Build up kwargs to pass to the requests method call.
     request_kwargs = {
       'headers': self.build_request_headers(headers=headers),
-      'stream': stream
+      'stream': stream,
+      'timeout': timeout
     }
 
     if method in ('get', 'delete'):
       # Set the payload as query params for GET and DELETE requests
       request_kwargs['params'] = payload or {}
+    elif data is not None:
+      # Send raw bodies as-is, moving the payload into query params
+      request_kwargs['data'] = data
+      request_kwargs['params'] = payload or {}
     elif mp_upload_monitor:
       # If multipart encoder monitor is provided, assign that to the data kwarg
       request_kwargs['data'] = mp_upload_monitor
@@ -142,11 +307,14 @@ class AbstractApi(object):
 
     try:
       # Make the request
-      response = request(self.base_url + route, **request_kwargs)
+      response = self.session.request(method.upper(), self.base_url + route, **request_kwargs)
     except KeyboardInterrupt:
       # Allow the user to kill it if taking too long
       exit(0)
     except BaseException as e:
+      if raise_errors:
+        raise
+
       log('Unknown Error while making request: {}'.format(e))
       exit(1)
 
@@ -159,12 +327,13 @@ class AbstractApi(object):
 
     return api_resp
 
-  def build_request_headers(self, headers={}):
+  def build_request_headers(self, headers=None):
     """
     Build up headers for a request.
+    Always returns a new dict -- self.base_headers is never modified.
 
     Order in which headers are constructed:
-      (1) Start as self.base_headers
+      (1) Start as a copy of self.base_headers
       (2) Add key-val pairs from headers param
       (3) Add auth header
 
@@ -174,13 +343,12 @@ class AbstractApi(object):
     :return: All headers for this request
     :rtype: dict
     """
-    # Start with base headers
-    all_headers = self.base_headers
+    # Start with a copy of the base headers
+    all_headers = dict(self.base_headers)
 
     if headers:
       # Add request-specific headers if they exist
-      for k, v in headers.items():
-        all_headers[k] = headers[k]
+      all_headers.update(headers)
 
     # Return early if no authorization header
     if not self.auth_header_name:
@@ -195,12 +363,41 @@ class AbstractApi(object):
     return all_headers
 
 
+class PooledHTTPAdapter(HTTPAdapter):
+  """
+  HTTPAdapter that optionally enables TCP keep-alive probes on its pooled sockets,
+  so idle connections kept around for reuse aren't silently dropped by middleboxes.
+  """
+
+  def __init__(self, tcp_keepalive=True, **kwargs):
+    self.tcp_keepalive = tcp_keepalive
+    super(PooledHTTPAdapter, self).__init__(**kwargs)
+
+  def init_poolmanager(self, *args, **kwargs):
+    if self.tcp_keepalive:
+      kwargs['socket_options'] = self._keepalive_socket_options()
+
+    super(PooledHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+
+  @staticmethod
+  def _keepalive_socket_options(idle=60, interval=10, count=6):
+    options = list(HTTPConnection.default_socket_options)
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+
+    # Tune probe timing where the platform supports it (Linux).
+    for name, val in (('TCP_KEEPIDLE', idle), ('TCP_KEEPINTVL', interval), ('TCP_KEEPCNT', count)):
+      if hasattr(socket, name):
+        options.append((socket.IPPROTO_TCP, getattr(socket, name), val))
+
+    return options
+
+
 class AbstractApiResponse(object):
   """
   Interface to an API response from AbstractApi.
 
   Will attempt to parse a JSON response upon initialization, and will
-  raise an ApiException if the status code doesn't equal 200 or 201.
+  raise an ApiException if the status code isn't 200, 201 or 206.
   """
 
   def __init__(self, response_obj, stream=False, mp_upload=False,
@@ -226,7 +423,7 @@ class AbstractApiResponse(object):
 
     self.headers = response_obj.headers
     self.status = response_obj.status_code
-    self.ok = self.status in (200, 201)
+    self.ok = self.status in (200, 201, 206)
 
     # Don't parse json for successful streaming or multi-part requests.
     if self.ok and (self.stream or self.mp_upload):
@@ -253,6 +450,36 @@ class AbstractApiResponse(object):
     except:
       return {}
 
+  def iter_items(self, path=None, chunk_size=64 * 1024):
+    """
+    Iterate over the items of a JSON array in the response body.
+
+    For a streaming request, the body is parsed incrementally as it's read, one item
+    at a time, and the body's other top-level members end up in the returned
+    iterable's 'fields' (see json_stream.JsonItemStream). Otherwise, the items come
+    from the already-parsed 'self.json'.
+
+    :param str path: Dot-separated keys leading to the array (e.g. 'logs'; None for a top-level array)
+    :param int chunk_size: Max bytes to read from the response at a time (default=64KiB)
+    :return: Iterable of items
+    """
+    if self.json is not None:
+      value = self.json
+
+      for key in path.split('.') if path else []:
+        value = value.get(key) if isinstance(value, dict) else None
+
+      return value if isinstance(value, list) else []
+
+    # Decompress (if needed) while reading the raw stream.
+    self.response_obj.raw.decode_content = True
+
+    return JsonItemStream(self.response_obj.raw, path=path, read_size=chunk_size)
+
+  def close(self):
+    """Release the response's connection back to the pool (discarding any unread body)."""
+    self.response_obj.close()
+
   def log_error(self):
     """
     Log the error parsed from the JSON body.
@@ -288,25 +515,124 @@ class AbstractApiResponse(object):
 
     log(err_msg)
 
-  def log_stream(self, chunk_size=10, lines_to_ignore=('...',)):
+  def log_stream(self, chunk_size=64 * 1024, lines_to_ignore=('...',), flush_interval=0.1,
+                 line_filter=None, resume=None, max_reconnects=10, archive=None):
     """
     Log the streaming response by parsing and iterating over lines of the response.
 
-    :param int chunk_size: Chunk size to parse response with (default=10)
+    The body is read in large reads and split into lines a read at a time (see
+    log_stream.iter_line_batches), and lines are written to stdout in batches,
+    flushed at least every 'flush_interval' seconds -- and immediately whenever
+    the stream goes quiet -- so a fast stream doesn't cost a write per line.
+
+    If the connection drops and 'resume' is provided, following picks back up
+    where it left off: the API gives the offset in the log of the stream's first
+    line (see log_stream.LOG_OFFSET_HEADER), each line received moves it along,
+    and 'resume' is called with the offset of the first line not yet received to
+    open a new stream -- retrying with exponential backoff (and jitter) up to
+    'max_reconnects' times in a row -- so no line is lost or shown twice.
+
+    :param int chunk_size: Max bytes to read from the response at a time (default=64KiB)
     :param tuple(str) lines_to_ignore: Tuple of log messages to ignore.
+    :param float flush_interval: Max seconds to hold written lines before flushing them
+    :param line_filter: Function taking each batch of lines and returning the ones to log
+      :type: callable(list(str)) -> list(str)
+    :param resume: Function making a streaming request for the log from a line offset onwards
+      :type: callable(int) -> AbstractApiResponse
+    :param int max_reconnects: Max consecutive failed attempts to reconnect before giving up
+    :param archive: Local archive to keep every line received in (needs the stream's offset; closed when done)
+      :type: sweettea.utils.log_archive.LogArchive
+
+    Only a dropped connection (see STREAM_ERRORS) is reconnected from. Stdout being
+    closed (e.g. piped into 'head') stops following, and errors filtering or
+    archiving lines are raised.
     """
     if not self.stream:
       return
 
-    try:
-      for line in self.response_obj.iter_lines(chunk_size=chunk_size):
-        line = to_str(line)
-
-        if not line or line in lines_to_ignore:
-          continue
+    ignore = frozenset(lines_to_ignore)
+    out = LineWriter(click.get_text_stream('stdout'), flush_interval=flush_interval)
+    resp, failures = self, 0
 
-        log(line)
+    try:
+      while resp:
+        offset = log_offset(resp.headers)
+
+        # Count lines exactly as the API sent them when they may need resuming from (or archiving).
+        newline = '\n' if (resume or archive) and offset is not None else None
+
+        # Decompress (if needed) while reading the raw stream.
+        resp.response_obj.raw.decode_content = True
+        batches = iter_line_batches(resp.response_obj.raw, read_size=chunk_size, newline=newline)
+
+        while True:
+          try:
+            batch = next(batches, None)
+          except STREAM_ERRORS as e:
+            error = e
+            break
+
+          if batch is None:
+            return
+
+          received, drained = batch
+          lines = [line for line in received if line and line not in ignore]
+
+          if line_filter:
+            lines = line_filter(lines)
+
+          out.write(lines, flush=drained)
+
+          # Lines only count as received once they've been written.
+          if newline and received:
+            if archive:
+              archive.append(offset, received)
+
+            offset += len(received)
+            failures = 0
+
+        resp.close()
+        out.flush()
+
+        if not (newline and resume):
+          log('Error while parsing logs: {}'.format(error))
+          return
+
+        resp = None
+
+        # Reconnect from the first line not yet received, backing off while attempts fail.
+        while not resp:
+          if failures >= max_reconnects:
+            log('Error while following logs (gave up after {} attempts to reconnect): {}'.format(failures, error))
+            return
+
+          time.sleep(backoff_delay(failures))
+          failures += 1
+
+          try:
+            resp = resume(offset)
+          except requests.exceptions.RequestException as e:
+            error = e
+            continue
+
+          if not resp.ok:
+            status = resp.status
+            error = 'status={}'.format(status)
+            resp.close()
+            resp = None
+
+            # The API won't have the log on a retry either (e.g. the train job is gone).
+            if 400 <= status < 500 and status != 429:
+              log('Error while following logs (can\'t reconnect): {}'.format(error))
+              return
+    except BrokenPipeError:
+      # Whatever was reading the output is gone (e.g. 'st logs -f | head') -- nothing more to do.
+      out = None
     except KeyboardInterrupt:
       exit(0)
-    except BaseException as e:
-      log('Error while parsing logs: {}'.format(e))
+    finally:
+      if out:
+        out.flush()
+
+      if archive:
+        archive.close()
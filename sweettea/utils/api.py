@@ -1,6 +1,7 @@
 """
 SweetTea API client
 """
+import atexit
 from sweettea.config import config
 from sweettea.definitions import auth_header_name
 from sweettea.utils.abstract_api import AbstractApi
@@ -9,4 +10,20 @@ from sweettea.utils.auth import get_password
 # Configure SweetTea API client.
 api = AbstractApi(base_url=config.API_URL,
                   auth_header_name=auth_header_name,
-                  auth_header_val_getter=get_password)
+                  auth_header_val_getter=get_password,
+                  pool_maxsize=config.HTTP_POOL_MAXSIZE,
+                  max_retries=config.HTTP_MAX_RETRIES)
+
+# Model downloads go through a LAN mirror ('st mirror') when one is configured.
+if config.MIRROR_URL:
+  download_api = AbstractApi(base_url=config.MIRROR_URL,
+                             auth_header_name=auth_header_name,
+                             auth_header_val_getter=get_password,
+                             pool_maxsize=config.HTTP_POOL_MAXSIZE,
+                             max_retries=config.HTTP_MAX_RETRIES)
+else:
+  download_api = api
+
+# Release pooled connections when the CLI exits.
+atexit.register(api.close)
+atexit.register(download_api.close)
@@ -1,16 +1,44 @@
+import ctypes
+import hashlib
 import os
 import json
 import mimetypes
 import shutil
+import stat as stat_mod
+import sys
+import tarfile
+import tempfile
+import threading
 import yaml
 import zipfile
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
 from sweettea import log
 from sweettea.definitions import default_mime_type
+from sweettea.utils.file_utils.scanner import scan_tree
+from sweettea.utils.file_utils.zip_writer import DEFAULT_BLOCK_SIZE, DEFAULT_COMPRESSION_LEVEL, ZipWriter, write_members
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
 
 JSON_EXT = 'json'
 YAML_EXT = 'yaml'
 ENV_EXT = 'env'
 
+# renameat2(2) arguments.
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+
+# ioctl(2) request to reflink one file into another (Linux).
+FICLONE = 0x40049409
+
+# Umask at import (before any worker threads exist), for platforms without /proc --
+# reading it means setting it, so it's set straight back.
+IMPORT_UMASK = os.umask(0o022)
+os.umask(IMPORT_UMASK)
+
 
 def is_json_file(path):
   return path.endswith('.{}'.format(JSON_EXT))
@@ -72,7 +100,103 @@ def upsert_parent_dirs(filepath):
         pass
 
 
-def zip_dir(src_dir, dest_zip_file_path):
+_positional_io_lock = threading.Lock()
+
+
+def pread(f, length, offset):
+  """
+  Read up to 'length' bytes at 'offset' of an open file without moving its shared position,
+  so that several threads can read different parts of the same file at once.
+
+  :param f: File object opened in binary read mode
+  :param int length: Number of bytes to read
+  :param int offset: Position in file to read from
+  :return: Bytes read
+  :rtype: bytes
+  """
+  if hasattr(os, 'pread'):
+    chunks = []
+
+    # pread may return short reads for very large lengths, so keep reading until done or EOF.
+    while length > 0:
+      chunk = os.pread(f.fileno(), length, offset)
+
+      if not chunk:
+        break
+
+      chunks.append(chunk)
+      length -= len(chunk)
+      offset += len(chunk)
+
+    return chunks[0] if len(chunks) == 1 else b''.join(chunks)
+
+  # Platforms without pread (Windows) fall back to a serialized seek + read.
+  with _positional_io_lock:
+    f.seek(offset)
+    return f.read(length)
+
+
+def pwrite(f, data, offset):
+  """
+  Write bytes at 'offset' of an open file without moving its shared position,
+  so that several threads can write different parts of the same file at once.
+
+  :param f: File object opened in binary write mode
+  :param data: Bytes (or memoryview) to write
+  :param int offset: Position in file to write at
+  """
+  if hasattr(os, 'pwrite'):
+    view = memoryview(data)
+
+    while view:
+      written = os.pwrite(f.fileno(), view, offset)
+      view = view[written:]
+      offset += written
+
+    return
+
+  # Platforms without pwrite (Windows) fall back to a serialized seek + write.
+  with _positional_io_lock:
+    f.seek(offset)
+    f.write(data)
+    f.flush()
+
+
+def preallocate(f, size):
+  """
+  Size an open file to 'size' bytes up front, reserving its disk blocks where the platform allows
+  (so a full disk fails fast and the file is laid out contiguously).
+
+  :param f: File object opened in binary write mode
+  :param int size: Size of file (in bytes)
+  """
+  f.truncate(size)
+
+  if hasattr(os, 'posix_fallocate') and size:
+    try:
+      os.posix_fallocate(f.fileno(), 0, size)
+    except OSError:
+      # Not supported by every filesystem -- the truncate above is enough.
+      pass
+
+
+def zip_dir(src_dir, dest_zip_file_path, compression_level=DEFAULT_COMPRESSION_LEVEL, workers=None,
+            reproducible=False, ignore=None, scan_workers=0):
+  """
+  Zip a directory, compressing its files on a pool of threads.
+
+  :param str src_dir: Directory to zip
+  :param str dest_zip_file_path: Path to write the archive to
+  :param int compression_level: zlib compression level 0-9 (0 stores files uncompressed)
+  :param int workers: Number of compression threads (default: number of CPUs)
+  :param bool reproducible: Whether to normalize timestamps and permissions, so that identical
+    trees produce byte-identical archives (see zip_writer)
+  :param ignore: Exclusion rules for paths that shouldn't be zipped
+    :type: sweettea.utils.file_utils.ignore.IgnoreRules
+  :param int scan_workers: Number of threads to stat and read ahead files with while scanning (see walk_zip_members)
+  :return: Hex sha256 digest of the archive
+  :rtype: str
+  """
   path = src_dir.rstrip('/') + '/'
 
   # Ensure path exists.
@@ -83,40 +207,484 @@ def zip_dir(src_dir, dest_zip_file_path):
   # Upsert parent directories of destination zip path.
   os.makedirs(os.path.dirname(dest_zip_file_path), exist_ok=True)
 
-  # Create new zip file.
-  zf = zipfile.ZipFile(dest_zip_file_path, 'w', zipfile.ZIP_DEFLATED)
+  # Write to a temp file and move it into place, so an interrupted run never leaves a partial archive behind.
+  tmp_path = dest_zip_file_path + '.tmp'
 
   try:
-    # Walk over all tree contents of path
-    contents = os.walk(path)
+    with open(tmp_path, 'wb') as f:
+      out = DigestWriter(f)
+      writer = ZipWriter(out)
+
+      # For each file and sub-dir inside source directory, write it into the zip file.
+      members = walk_zip_members(path, ignore=ignore, scan_workers=scan_workers)
+
+      for _ in write_members(writer, members, compression_level=compression_level, workers=workers,
+                             reproducible=reproducible):
+        pass
+
+      writer.close()
 
-    # For each file and sub-dir inside source directory, write it into the zip file.
-    for root, dirs, files in contents:
-      for dir_name in dirs:
-        dir_path = os.path.join(root, dir_name)
-        zf.write(dir_path, dir_path.replace(path, '', 1))
+    os.replace(tmp_path, dest_zip_file_path)
 
-      for file_name in files:
-        file_path = os.path.join(root, file_name)
-        zf.write(file_path, file_path.replace(path, '', 1))
+    return out.hexdigest()
 
   except BaseException as e:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+
     # Exit anytime an error occurs.
     log('Error occurred while zipping directory: {}'.format(e))
     exit(1)
-  finally:
-    # Always close zipfile.
-    zf.close()
 
 
-def extract_zip(archive_path, destination_dir_path):
-  # Upsert parent directory of extracted destination path.
-  upsert_parent_dirs(destination_dir_path.rstrip('/'))
+def iter_zip_dir(src_dir, compression_level=DEFAULT_COMPRESSION_LEVEL, workers=None, on_read=None,
+                 reproducible=False, ignore=None, scan_workers=0):
+  """
+  Zip a directory on the fly, yielding the archive's bytes as they're compressed
+  instead of writing the archive to disk first.
+
+  The archive is written with data descriptors (sizes/CRCs trail each member),
+  which is the standard zip layout for unseekable output, so it's a normal zip file.
+
+  :param str src_dir: Directory to zip
+  :param int compression_level: zlib compression level 0-9 (0 stores files uncompressed)
+  :param int workers: Number of compression threads (default: number of CPUs)
+  :param function on_read: Called with the number of source bytes consumed, for progress display
+  :param bool reproducible: Whether to normalize timestamps and permissions (see zip_dir)
+  :param ignore: Exclusion rules for paths that shouldn't be zipped (see zip_dir)
+  :param int scan_workers: Number of threads to stat and read ahead files with while scanning (see walk_zip_members)
+  :return: Generator of zip archive bytes
+  """
+  path = src_dir.rstrip('/') + '/'
+
+  # Ensure path exists.
+  if not os.path.exists(path):
+    log('No directory found at {}'.format(path))
+    exit(1)
+
+  buf = ZipStreamBuffer()
+  writer = ZipWriter(buf)
+
+  members = walk_zip_members(path, ignore=ignore, scan_workers=scan_workers)
+
+  for _ in write_members(writer, members, compression_level=compression_level, workers=workers, on_read=on_read,
+                         reproducible=reproducible):
+    # Never yield empty chunks -- an empty chunk would end a chunked request body early.
+    if buf.chunks:
+      yield buf.drain()
 
-  # Remove the entire destination dir if it already exists.
-  if os.path.exists(destination_dir_path) and os.path.isdir(destination_dir_path):
-    shutil.rmtree(destination_dir_path)
+  # Closing the archive writes the central directory.
+  writer.close()
+  yield buf.drain()
 
-  # Extract archive into desired destination.
+
+def walk_zip_members(path, ignore=None, scan_workers=0):
+  """
+  Walk a directory, producing the (path, arcname, stat_result) members to zip,
+  with arcnames relative to the directory, in a stable (sorted, depth-first) order.
+  Only files and empty directories are produced -- other directories are implied
+  by their contents.
+
+  Directories excluded by 'ignore' are pruned without being descended into.
+  With 'scan_workers', members are stat'ed and read ahead on that many threads
+  (see scanner.scan_tree), which pays off on network filesystems.
+  """
+  return scan_tree(path, ignore=ignore, workers=scan_workers, read_ahead=DEFAULT_BLOCK_SIZE if scan_workers else 0)
+
+
+def dir_fingerprint(src_dir, hash_contents=False, ignore=None, scan_workers=0):
+  """
+  Fingerprint a directory by the path, type, size and mtime of everything in it
+  (and optionally the sha256 of each file's contents, for trees whose mtimes can't
+  be trusted), so an unchanged tree can be recognized without re-reading it.
+
+  :param str src_dir: Directory to fingerprint
+  :param bool hash_contents: Whether to also hash every file's contents
+  :param ignore: Exclusion rules for paths to leave out (see zip_dir)
+  :param int scan_workers: Number of threads to stat files with while scanning (see walk_zip_members)
+  :return: Hex sha256 fingerprint
+  :rtype: str
+  """
+  path = src_dir.rstrip('/') + '/'
+  h = hashlib.sha256()
+
+  for member_path, arcname, st in walk_zip_members(path, ignore=ignore, scan_workers=scan_workers):
+    is_dir = stat_mod.S_ISDIR(st.st_mode)
+    entry = [arcname, is_dir, st.st_mode, 0 if is_dir else st.st_size, 0 if is_dir else st.st_mtime_ns]
+
+    if hash_contents and not is_dir:
+      entry.append(file_digest(member_path))
+
+    h.update(json.dumps(entry).encode('utf-8') + b'\n')
+
+  return h.hexdigest()
+
+
+def get_dir_size(path, ignore=None):
+  """
+  :param ignore: Exclusion rules for paths to leave out (see zip_dir)
+  :return: Total size of all files under a directory (in bytes)
+  :rtype: int
+  """
+  return sum(st.st_size for _, _, st in walk_zip_members(path.rstrip('/') + '/', ignore=ignore)
+             if not stat_mod.S_ISDIR(st.st_mode))
+
+
+def run_pool(workers, fn, items, on_done):
+  """
+  Call fn on every item from a pool of threads, calling on_done(item) from
+  this thread as each one finishes (the first failure is re-raised).
+
+  :param int workers: Number of threads
+  :param fn: Function to call with each item
+  :param items: Items to process
+  :param on_done: Function to call with each item once processed
+  """
+  executor = ThreadPoolExecutor(max_workers=max(1, workers))
+  futures = {executor.submit(fn, item): item for item in items}
+
+  try:
+    while futures:
+      done, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+      for future in done:
+        item = futures.pop(future)
+        future.result()
+        on_done(item)
+  except KeyboardInterrupt:
+    executor.shutdown(wait=False, cancel_futures=True)
+    log('\nTransfer interrupted.')
+    exit()
+  except BaseException:
+    executor.shutdown(wait=False, cancel_futures=True)
+    raise
+
+  executor.shutdown()
+
+
+def file_digest(path):
+  """
+  :return: Hex sha256 digest of a file's contents
+  :rtype: str
+  """
+  h = hashlib.sha256()
+
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(1024 * 1024), b''):
+      h.update(block)
+
+  return h.hexdigest()
+
+
+def clone_file(src_path, dest_path, hardlink=True):
+  """
+  Create 'dest_path' with the contents of 'src_path' as cheaply as the filesystem allows:
+  a copy-on-write reflink (Linux FICLONE), then a hardlink, then a plain copy.
+
+  :param str src_path: Existing file
+  :param str dest_path: Path to create (must not exist)
+  :param bool hardlink: Whether a hardlink will do -- not if either file may be edited
+    in place while the other must stay as it is (e.g. a cached object and its copy)
+  """
+  if fcntl and sys.platform.startswith('linux'):
+    with open(src_path, 'rb') as src, open(dest_path, 'wb') as dest:
+      try:
+        fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+        return
+      except OSError:
+        pass
+
+    os.remove(dest_path)
+
+  if hardlink:
+    try:
+      os.link(src_path, dest_path)
+      return
+    except OSError:
+      pass
+
+  shutil.copyfile(src_path, dest_path)
+
+
+def link_tree(src_dir, destination_dir_path, hardlink=True):
+  """
+  Recreate a directory tree at the given path with 'clone_file' copies of its files,
+  swapping it into place in one step (see 'staged_dir').
+
+  :param str src_dir: Directory to recreate
+  :param str destination_dir_path: Path to recreate it at
+  :param bool hardlink: Whether files may be hardlinked (see 'clone_file')
+  """
+  with staged_dir(destination_dir_path) as staging_path:
+    for root, dirs, files in os.walk(src_dir):
+      rel_root = os.path.relpath(root, src_dir)
+
+      for d in dirs:
+        os.makedirs(os.path.join(staging_path, rel_root, d), exist_ok=True)
+
+      for f in files:
+        clone_file(os.path.join(root, f), os.path.join(staging_path, rel_root, f), hardlink=hardlink)
+
+
+class ZipStreamBuffer(object):
+  """
+  Write-only, unseekable file-like object for an archive to be written into,
+  which a generator drains between writes.
+  """
+
+  def __init__(self):
+    self.chunks = []
+
+  def write(self, data):
+    self.chunks.append(bytes(data))
+    return len(data)
+
+  def flush(self):
+    pass
+
+  def drain(self):
+    data = b''.join(self.chunks)
+    self.chunks = []
+    return data
+
+
+class DigestWriter(object):
+  """Passes writes through to a file object, hashing them (sha256) along the way."""
+
+  def __init__(self, f):
+    self.f = f
+    self.digest = hashlib.sha256()
+
+  def write(self, data):
+    self.digest.update(data)
+    return self.f.write(data)
+
+  def flush(self):
+    self.f.flush()
+
+  def hexdigest(self):
+    return self.digest.hexdigest()
+
+
+def extract_zip(archive_path, destination_dir_path, workers=None):
+  """
+  Extract a zip archive as the given directory.
+
+  Members are decompressed by a pool of threads into a staging directory next to the
+  destination, which is then swapped into place in one step (see 'staged_dir'), so
+  the destination always holds either the complete old or the complete new contents.
+
+  :param str archive_path: Path of zip archive to extract
+  :param str destination_dir_path: Directory to extract the archive as
+  :param int workers: Number of threads to decompress with (defaults to the number of CPUs)
+  """
+  with zipfile.ZipFile(archive_path) as archive:
+    members = archive.infolist()
+
+  parent_dirs = {os.path.dirname(m.filename.rstrip('/')) for m in members}
+
+  # Split members into one batch per thread, balanced by uncompressed size (largest first).
+  batches = [[] for _ in range(max(1, min(workers or os.cpu_count() or 1, len(members))))]
+  batch_sizes = [0] * len(batches)
+
+  for member in sorted(members, key=lambda m: m.file_size, reverse=True):
+    i = batch_sizes.index(min(batch_sizes))
+    batches[i].append(member)
+    batch_sizes[i] += member.file_size
+
+  with staged_dir(destination_dir_path) as staging_path:
+    # Create parent directories up front, so threads extracting into the same directory don't race to create it.
+    for d in parent_dirs:
+      if d and is_safe_rel_path(d):
+        os.makedirs(os.path.join(staging_path, d), exist_ok=True)
+
+    if len(batches) == 1:
+      _extract_zip_members(archive_path, batches[0], staging_path)
+      return
+
+    with ThreadPoolExecutor(max_workers=len(batches)) as executor:
+      # Surface the first failure (if any) once all batches are done.
+      for future in [executor.submit(_extract_zip_members, archive_path, b, staging_path) for b in batches]:
+        future.result()
+
+
+def _extract_zip_members(archive_path, members, destination_dir_path):
+  # Each thread reads through its own handle, since a ZipFile's file position is shared state.
   with zipfile.ZipFile(archive_path) as archive:
-    archive.extractall(destination_dir_path)
+    for member in members:
+      if member.is_dir() or not is_safe_rel_path(member.filename):
+        # Let zipfile create directories / sanitize unusual names.
+        archive.extract(member, destination_dir_path)
+        continue
+
+      with archive.open(member) as src, open(os.path.join(destination_dir_path, member.filename), 'wb') as dest:
+        copy_sparse(src, dest)
+
+
+def copy_sparse(src, dest, block_size=1024 * 1024):
+  """
+  Copy a stream into a file, seeking over blocks that are entirely zeros instead of writing
+  them, so runs of zeros (unwritten regions of preallocated checkpoints, zero-initialized
+  tensors...) end up as holes that take no disk space on filesystems that support them.
+
+  :param src: Readable binary stream
+  :param dest: File opened for writing in binary mode (at position 0)
+  :param int block_size: Size of each read (and the granularity of holes)
+  """
+  zeros = bytes(block_size)
+  size = 0
+
+  while True:
+    block = src.read(block_size)
+
+    if not block:
+      break
+
+    if block == zeros[:len(block)]:
+      dest.seek(len(block), os.SEEK_CUR)
+    else:
+      dest.write(block)
+
+    size += len(block)
+
+  # Extend the file over a trailing hole.
+  dest.truncate(size)
+
+
+def extract_tar_stream(fileobj, destination_dir_path):
+  """
+  Extract a (possibly compressed) tar archive as it's read from an unseekable stream,
+  writing each member to disk as its bytes arrive.
+
+  Like 'extract_zip', the archive is extracted into a staging directory that's only
+  swapped into place once the whole archive has been extracted.
+
+  :param fileobj: File-like object to read the archive from (only 'read' is needed)
+  :param str destination_dir_path: Directory to extract the archive as
+  """
+  # Let tarfile reject unsafe members itself where it can (Python 3.8.17+/3.11.4+).
+  extract_kwargs = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+
+  with staged_dir(destination_dir_path) as staging_path:
+    with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+      for member in archive:
+        if not _is_safe_tar_member(member, staging_path):
+          raise tarfile.TarError('Refusing to extract unsafe archive member "{}".'.format(member.name))
+
+        archive.extract(member, staging_path, set_attrs=False, **extract_kwargs)
+
+
+@contextmanager
+def staged_dir(destination_dir_path):
+  """
+  Context manager yielding a new, empty staging directory next to the given destination,
+  which replaces the destination once the block completes without error (and is removed
+  otherwise).
+
+  The swap is a single atomic exchange of the two paths where the platform supports it
+  (Linux renameat2 with RENAME_EXCHANGE), or else two back-to-back renames. Either way,
+  processes that already have files of the old contents open can keep reading them,
+  as they're only unlinked (not rewritten) when the old tree is removed afterwards.
+
+  :param str destination_dir_path: Directory to populate
+  """
+  destination_dir_path = destination_dir_path.rstrip('/')
+  parent_dir, name = os.path.split(os.path.abspath(destination_dir_path))
+
+  # Upsert parent directory of destination path.
+  upsert_parent_dirs(destination_dir_path)
+
+  # Stage on the same filesystem as the destination, so that the swap is a rename.
+  staging_path = tempfile.mkdtemp(prefix='.{}.st-'.format(name), dir=parent_dir)
+
+  # mkdtemp creates the directory private (0700) -- give it the mode of the one it
+  # replaces, or the mode a new directory would have.
+  if os.path.isdir(destination_dir_path):
+    os.chmod(staging_path, stat_mod.S_IMODE(os.stat(destination_dir_path).st_mode))
+  else:
+    os.chmod(staging_path, 0o777 & ~_current_umask())
+
+  try:
+    yield staging_path
+  except BaseException:
+    shutil.rmtree(staging_path, ignore_errors=True)
+    raise
+
+  replace_dir(staging_path, destination_dir_path)
+
+
+def replace_dir(src_path, destination_path):
+  """
+  Move a directory into place at the given path, replacing whatever is there.
+
+  :param str src_path: Directory to move (must be on the same filesystem as the destination)
+  :param str destination_path: Path to move it to
+  """
+  if not os.path.lexists(destination_path):
+    os.rename(src_path, destination_path)
+    return
+
+  if _rename_exchange(src_path, destination_path):
+    # The old contents now live at the source path.
+    old_path = src_path
+  else:
+    old_path = src_path + '.old'
+    os.rename(destination_path, old_path)
+    os.rename(src_path, destination_path)
+
+  if os.path.isdir(old_path) and not os.path.islink(old_path):
+    shutil.rmtree(old_path, ignore_errors=True)
+  else:
+    os.remove(old_path)
+
+
+def _current_umask():
+  """
+  :return: The process's umask -- read from /proc where possible, as the only other
+    way to read it is to set it, which would briefly change it for every thread
+  :rtype: int
+  """
+  try:
+    with open('/proc/self/status') as f:
+      for line in f:
+        if line.startswith('Umask:'):
+          return int(line.split()[1], 8)
+  except (IOError, OSError, ValueError, IndexError):
+    pass
+
+  return IMPORT_UMASK
+
+
+def _rename_exchange(path_a, path_b):
+  """
+  Atomically swap two paths with renameat2(RENAME_EXCHANGE).
+
+  :return: Whether the swap happened (False if unsupported by the platform, libc or filesystem)
+  :rtype: bool
+  """
+  if not sys.platform.startswith('linux'):
+    return False
+
+  try:
+    renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+  except (AttributeError, OSError):
+    return False
+
+  return renameat2(AT_FDCWD, os.fsencode(path_a), AT_FDCWD, os.fsencode(path_b), RENAME_EXCHANGE) == 0
+
+
+def is_safe_rel_path(path):
+  """Whether a relative path (from an archive or manifest) stays inside the directory it's relative to."""
+  parts = path.replace('\\', '/').split('/')
+  return bool(path) and not os.path.isabs(path) and '..' not in parts and '' not in parts[:-1]
+
+
+def _is_safe_tar_member(member, destination_dir_path):
+  """Only plain files and dirs that land inside the destination dir are extracted."""
+  if not (member.isfile() or member.isdir()):
+    return False
+
+  root = os.path.realpath(destination_dir_path)
+  path = os.path.realpath(os.path.join(root, member.name))
+
+  return path == root or path.startswith(root + os.sep)
@@ -0,0 +1,413 @@
+import hashlib
+import json
+import os
+import threading
+from clint.textui.progress import Bar as ProgressBar
+from sweettea import log
+from sweettea.definitions import chunk_index_path, part_digest_header_name
+from sweettea.utils.file_utils import get_file_ext, preallocate, pread, pwrite, run_pool, upsert_parent_dirs
+from sweettea.utils.file_utils.file_downloader import FileDownloader
+from sweettea.utils.file_utils.file_uploader import FileUploader
+
+DEFAULT_MIN_CHUNK_SIZE = 256 * 1024
+DEFAULT_AVG_CHUNK_SIZE = 1024 * 1024
+DEFAULT_MAX_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Gear table: one pseudo-random 64-bit value per byte value (fixed, so both sides cut identically).
+GEAR = [int.from_bytes(hashlib.sha256(b'sweettea-gear' + bytes([i])).digest()[:8], 'big') for i in range(256)]
+GEAR_WINDOW = 64
+MASK64 = (1 << 64) - 1
+
+# Bytes whose gear value has its low two bits clear (~1 in 4) count as "anchor" bytes. Runs of
+# ANCHOR_LEN of them are found with C-speed bytes.translate/bytes.find, and only there is the
+# gear hash evaluated -- see 'find_cut_points'.
+ANCHOR_TABLE = bytes(1 if GEAR[i] & 0x3 == 0 else 0 for i in range(256))
+ANCHOR_LEN = 6
+ANCHOR = b'\x01' * ANCHOR_LEN
+ANCHOR_BITS = 2 * ANCHOR_LEN
+
+
+def gear_hash(window):
+  """
+  :return: Gear hash of the last GEAR_WINDOW bytes of 'window' -- the same value a byte-by-byte
+    rolling gear hash (h = (h << 1) + GEAR[b]) has at that position, as older bytes shift out
+  :rtype: int
+  """
+  h = 0
+
+  for b in window[-GEAR_WINDOW:]:
+    h = ((h << 1) + GEAR[b]) & MASK64
+
+  return h
+
+
+def find_cut_points(data, min_size=DEFAULT_MIN_CHUNK_SIZE, avg_size=DEFAULT_AVG_CHUNK_SIZE,
+                    max_size=DEFAULT_MAX_CHUNK_SIZE, final=True):
+  """
+  Content-defined chunk boundaries of a buffer.
+
+  A position is a boundary if the gear hash of the 64 bytes before it has its top bits clear,
+  as in FastCDC. Evaluating a rolling hash byte by byte is far too slow in pure Python though,
+  so positions are first narrowed down to those preceded by a run of anchor bytes (a property
+  of the same 64-byte window, found at C speed), and the gear test supplies the remaining
+  bits of selectivity. Boundaries only depend on nearby content, so inserting or removing bytes
+  only changes the chunks around the edit.
+
+  :param data: Buffer to chunk
+  :param int min_size: Smallest chunk to cut (except the final one)
+  :param int avg_size: Target average chunk size (a power of 2)
+  :param int max_size: Largest chunk to cut
+  :param bool final: Whether the buffer ends the file (otherwise trailing bytes are left uncut)
+  :return: End offsets of each chunk
+  :rtype: list(int)
+  """
+  classes = data.translate(ANCHOR_TABLE)
+  gear_mask = ~(MASK64 >> max(0, avg_size.bit_length() - 1 - ANCHOR_BITS)) & MASK64
+  cuts = []
+  start = 0
+
+  while True:
+    limit = min(start + max_size, len(data))
+    pos = start + min_size - ANCHOR_LEN
+    cut = None
+
+    while True:
+      pos = classes.find(ANCHOR, pos, limit)
+
+      if pos < 0:
+        break
+
+      end = pos + ANCHOR_LEN
+
+      if not gear_hash(data[max(0, end - GEAR_WINDOW):end]) & gear_mask:
+        cut = end
+        break
+
+      pos += 1
+
+    if cut is None:
+      if start + max_size <= len(data):
+        cut = start + max_size
+      elif final and start < len(data):
+        cut = len(data)
+      else:
+        return cuts
+
+    cuts.append(cut)
+    start = cut
+
+
+def iter_chunks(f, min_size=DEFAULT_MIN_CHUNK_SIZE, avg_size=DEFAULT_AVG_CHUNK_SIZE,
+                max_size=DEFAULT_MAX_CHUNK_SIZE, buffer_size=32 * 1024 * 1024):
+  """
+  Split a file into content-defined chunks.
+
+  :param f: File object opened in binary read mode
+  :return: Generator of (offset, chunk bytes)
+  """
+  offset = 0
+  pending = b''
+
+  while True:
+    block = f.read(buffer_size)
+    data = pending + block if pending else block
+    final = not block
+    start = 0
+
+    for cut in find_cut_points(data, min_size, avg_size, max_size, final=final):
+      yield offset, data[start:cut]
+      offset += cut - start
+      start = cut
+
+    if final:
+      return
+
+    pending = data[start:]
+
+
+def chunk_file(path, **kwargs):
+  """
+  :return: (digest, offset, length) of each content-defined chunk of a file
+  :rtype: list(tuple)
+  """
+  with open(path, 'rb') as f:
+    return [(hashlib.sha256(chunk).hexdigest(), offset, len(chunk)) for offset, chunk in iter_chunks(f, **kwargs)]
+
+
+class ChunkIndex(object):
+  """
+  Local record of which chunks the files we've uploaded or downloaded are made of,
+  so a file doesn't need rechunking while unchanged, and chunks of previous versions
+  can be read from disk instead of being downloaded again.
+
+  Entries are keyed by absolute path and only trusted while the file's size and mtime
+  match what was recorded.
+  """
+
+  def __init__(self, path=chunk_index_path):
+    self.path = path
+    self.lock = threading.Lock()
+
+    try:
+      with open(path) as f:
+        self.files = json.load(f)
+    except (IOError, OSError, ValueError):
+      self.files = {}
+
+  def chunks_of(self, path):
+    """
+    :return: Chunks of a file if it's unchanged since it was indexed
+    :rtype: list(tuple) or None
+    """
+    entry = self.files.get(os.path.abspath(path))
+
+    if not entry or not os.path.exists(path):
+      return None
+
+    stat = os.stat(path)
+
+    if entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+      return None
+
+    return [tuple(c) for c in entry['chunks']]
+
+  def record(self, path, chunks):
+    stat = os.stat(path)
+
+    with self.lock:
+      self.files[os.path.abspath(path)] = {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'chunks': [list(c) for c in chunks]
+      }
+
+      # Forget files that have since been deleted.
+      self.files = {p: e for p, e in self.files.items() if os.path.exists(p)}
+
+      upsert_parent_dirs(self.path)
+      tmp_path = self.path + '.tmp'
+
+      with open(tmp_path, 'w') as f:
+        json.dump(self.files, f)
+
+      os.replace(tmp_path, self.path)
+
+  def locate(self):
+    """
+    :return: Map of chunk digest --> (path, offset, length) for every chunk of an unchanged indexed file
+    :rtype: dict
+    """
+    found = {}
+
+    for path in list(self.files):
+      for digest, offset, length in self.chunks_of(path) or []:
+        found.setdefault(digest, (path, offset, length))
+
+    return found
+
+  def chunk_file(self, path):
+    """Chunks of a file, reusing its indexed chunks if it's unchanged."""
+    chunks = self.chunks_of(path)
+
+    if chunks is None:
+      chunks = chunk_file(path)
+      self.record(path, chunks)
+
+    return chunks
+
+
+class CdcFileUploader(FileUploader):
+  """
+  Uploads a file as content-defined chunks, sending only the chunks the API doesn't
+  already have -- so a new version of a large checkpoint where only some regions
+  changed (or bytes were inserted) costs roughly the size of the changes.
+
+  Protocol (all routes relative to the api_route passed to 'upload'; the blob routes
+  are shared with manifest syncs):
+
+    POST {route}/manifest/missing  Which of these digests are missing? -> {"missing": ["<digest>", ...]}
+    PUT  {route}/blobs             Upload one chunk (raw body, 'digest' query param + Sweet-Tea-Part-Digest header)
+    POST {route}/recipe            Assemble a file from its chunks ({"chunks": [{"digest", "size"}], ...}) -> 201
+
+  """
+
+  def __init__(self, api, parallel=4, index=None, **kwargs):
+    """
+    :param api: API client to upload through
+      :type: sweettea.utils.abstract_api.AbstractApi
+    :param int parallel: Number of chunks to upload concurrently
+    :param ChunkIndex index: Local chunk index (defaults to the shared one)
+    """
+    super(CdcFileUploader, self).__init__(api, **kwargs)
+    self.parallel = max(1, parallel)
+    self.index = index or ChunkIndex()
+
+  def upload(self, api_route, file_path, name=None, payload=None, completion_msg=None):
+    """
+    Upload a file's new chunks and its recipe.
+
+    :param str api_route: Base route of the chunk protocol
+    :param str file_path: File to upload
+    :param str name: Name to give the uploaded model
+    :param dict payload: Extra info sent with the recipe
+    :param str completion_msg: Log to display when the upload completes
+    :return: Whether the API supports chunk uploads (nothing is uploaded if not)
+    :rtype: bool
+    """
+    payload = dict(payload or {})
+    payload.setdefault('name', name or self.default_name)
+    completion_msg = completion_msg or self.default_completion_msg
+
+    chunks = self.index.chunk_file(file_path)
+
+    resp = self.api.post(api_route + '/manifest/missing',
+                         payload=dict(payload, files=[{'digest': d, 'size': n} for d, _, n in chunks]),
+                         log_on_error=False,
+                         exit_on_error=False)
+
+    if resp.status == 404:
+      return False
+
+    if not resp.ok:
+      resp.log_error()
+      exit(1)
+
+    missing = set(resp.json.get('missing') or [])
+    pending = {}
+
+    for chunk in chunks:
+      if chunk[0] in missing:
+        pending.setdefault(chunk[0], chunk)
+
+    total = sum(n for _, _, n in pending.values())
+    log('Uploading {} of {} chunks ({} bytes).'.format(len(pending), len(chunks), total))
+
+    bar = ProgressBar(expected_size=total or 1, filled_char='=')
+    progress = {'bytes': 0}
+
+    def on_done(chunk):
+      progress['bytes'] += chunk[2]
+      bar.show(progress['bytes'])
+
+    with open(file_path, 'rb') as f:
+      run_pool(self.parallel, lambda chunk: self._upload_chunk(api_route, f, *chunk), pending.values(), on_done)
+
+    # Have the API assemble the file from its chunks.
+    self.api.post(api_route + '/recipe', payload=dict(payload, **{
+      'ext': get_file_ext(file_path),
+      'size': sum(n for _, _, n in chunks),
+      'chunks': [{'digest': d, 'size': n} for d, _, n in chunks]
+    }))
+
+    if completion_msg:
+      log(completion_msg)
+
+    return True
+
+  def _upload_chunk(self, api_route, f, digest, offset, length):
+    self.api.put(api_route + '/blobs',
+                 payload={'digest': digest},
+                 headers={'Content-Type': 'application/octet-stream', part_digest_header_name: digest},
+                 data=pread(f, length, offset))
+
+
+class CdcFileDownloader(FileDownloader):
+  """
+  Downloads a file by its chunk recipe, reading chunks that local files (previous
+  versions, other checkouts -- anything in the chunk index) already contain from
+  disk, and fetching only the rest. Falls back to a regular download if the API
+  has no recipe for the file.
+
+    GET {route}/recipe  Chunks of the file -> {"ext", "size", "chunks": [{"digest", "size"}]}
+    GET {route}/blobs   Contents of one chunk (by 'digest' query param)
+
+  """
+
+  def __init__(self, api, parallel=4, index=None, **kwargs):
+    """
+    :param api: API client to download through
+      :type: sweettea.utils.abstract_api.AbstractApi
+    :param int parallel: Number of chunks to download concurrently
+    :param ChunkIndex index: Local chunk index (defaults to the shared one)
+    """
+    super(CdcFileDownloader, self).__init__(api, **kwargs)
+    self.parallel = max(1, parallel)
+    self.index = index or ChunkIndex()
+
+  def download(self, api_route, dest_path, payload=None, **kwargs):
+    """
+    Download a file by its chunks, falling back to a regular download
+    (see FileDownloader.download) if the API has no recipe for it.
+    """
+    payload = payload or {}
+
+    resp = self.api.get(api_route + '/recipe', payload=payload, log_on_error=False, exit_on_error=False)
+
+    if resp.status == 404:
+      return super(CdcFileDownloader, self).download(api_route, dest_path, payload=payload, **kwargs)
+
+    if not resp.ok:
+      resp.log_error()
+      exit(1)
+
+    recipe = resp.json
+    save_to, _ = self._calc_final_dest(dest_path, recipe.get('ext'), False, False, self.default_name)
+
+    # Lay out the chunks, and find which ones are already on disk somewhere.
+    chunks, offset = [], 0
+
+    for c in recipe['chunks']:
+      chunks.append((c['digest'], offset, c['size']))
+      offset += c['size']
+
+    local = self.index.locate()
+    fetch = [c for c in chunks if c[0] not in local]
+
+    total = sum(n for _, _, n in fetch)
+    log('Downloading {} of {} chunks ({} bytes).'.format(len(fetch), len(chunks), total))
+
+    bar = ProgressBar(expected_size=total or 1, filled_char='=')
+    progress = {'bytes': 0}
+
+    def on_done(chunk):
+      if chunk[0] not in local:
+        progress['bytes'] += chunk[2]
+        bar.show(progress['bytes'])
+
+    upsert_parent_dirs(save_to)
+    part_path = save_to + '.part'
+
+    with open(part_path, 'wb') as f:
+      preallocate(f, offset)
+      run_pool(self.parallel, lambda chunk: self._write_chunk(api_route, payload, f, chunk, local), chunks, on_done)
+
+    os.replace(part_path, save_to)
+    self.index.record(save_to, chunks)
+
+    return save_to
+
+  def _write_chunk(self, api_route, payload, f, chunk, local):
+    digest, offset, length = chunk
+    data = None
+
+    if digest in local:
+      src_path, src_offset, _ = local[digest]
+
+      try:
+        with open(src_path, 'rb') as src:
+          data = pread(src, length, src_offset)
+      except (IOError, OSError):
+        data = None
+
+      # The source may have changed since it was indexed -- only trust what still matches.
+      if data is not None and hashlib.sha256(data).hexdigest() != digest:
+        data = None
+
+    if data is None:
+      resp = self.api.get(api_route + '/blobs', payload=dict(payload, digest=digest))
+      data = resp.response_obj.content
+
+      if hashlib.sha256(data).hexdigest() != digest:
+        raise IOError('chunk {} doesn\'t match its digest'.format(digest))
+
+    pwrite(f, data, offset)
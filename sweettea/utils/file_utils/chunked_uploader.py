@@ -0,0 +1,332 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from clint.textui.progress import Bar as ProgressBar
+from sweettea import log
+from sweettea.definitions import default_part_size, part_digest_header_name, upload_state_dir
+from sweettea.utils.file_utils import get_file_ext, pread, upsert_parent_dirs
+from sweettea.utils.file_utils.file_uploader import FileUploader
+
+
+class ChunkedFileUploader(FileUploader):
+  """
+  Uploads a file as a series of fixed-size parts so that an interrupted upload
+  can pick up from the last part the API acknowledged, rather than from zero.
+
+  Part protocol (all routes relative to the api_route passed to 'upload'):
+
+    POST {route}/uploads          Start an upload      -> {"uploadId": "..."}
+    GET  {route}/uploads/parts    List acked parts     -> {"parts": [{"index": 0, "digest": "..."}]}
+    PUT  {route}/uploads/part     Upload one part (raw body, with uploadId/index/offset query params
+                                  and a sha256 digest of the body in the Sweet-Tea-Part-Digest header)
+    POST {route}/uploads/complete Assemble the parts   -> 201
+
+  Progress is persisted to a local state file after every acknowledged part,
+  so re-running the same upload after a crash or Ctrl-C resumes it.
+
+  Parts are uploaded concurrently by a pool of 'parallel' workers, each reading
+  its part with a positional read (so memory stays around parallel x part_size)
+  and retrying it independently of the others.
+
+  Basic usage:
+
+    ChunkedFileUploader(api).upload('/model', path_to_file, payload={'name': 'my-model'})
+
+  """
+
+  def __init__(self, api, part_size=default_part_size, state_dir=upload_state_dir, parallel=1,
+               part_retries=4, part_timeout=(10, 300), **kwargs):
+    """
+    :param api: API client to upload through
+      :type: sweettea.utils.abstract_api.AbstractApi
+    :param int part_size: Size of each uploaded part (in bytes)
+    :param str state_dir: Directory in which upload state files are kept
+    :param int parallel: Number of parts to upload concurrently
+    :param int part_retries: Number of times to retry a failed part before giving up
+    :param tuple part_timeout: (connect, read) timeout for each part request, so a stalled part gets retried
+    """
+    super(ChunkedFileUploader, self).__init__(api, **kwargs)
+    self.part_size = part_size
+    self.state_dir = state_dir
+    self.parallel = max(1, parallel)
+    self.part_retries = part_retries
+    self.part_timeout = part_timeout
+
+  def upload(self, api_route, file_path, name=None, payload=None, completion_msg=None, resume=True, digest=None):
+    """
+    Upload a file in parts, resuming a previous attempt at the same upload if one exists.
+
+    :param str api_route: Base route of the part protocol
+    :param str file_path: Path of file to upload
+    :param str name: Name to give the uploaded file (extension is appended)
+    :param dict payload: Extra info sent when starting the upload
+    :param str completion_msg: Log to display when the upload completes
+    :param bool resume: Whether to resume a previous attempt (if found) rather than start over
+    :param str digest: sha256 of the file, if already known -- identifies the file version to resume
+      by its contents rather than its mtime (e.g. so a rebuilt but identical archive still resumes)
+    """
+    name = name or self.default_name
+    payload = payload or {}
+    completion_msg = completion_msg or self.default_completion_msg
+
+    # Get file extension from path.
+    file_ext = get_file_ext(file_path)
+
+    # Append extension to name if extension exists.
+    if file_ext:
+      name = name + '.' + file_ext
+
+    size = os.path.getsize(file_path)
+    parts = self.split_parts(size)
+
+    # Find (or start) the upload this file belongs to.
+    state = self._resume_or_start(api_route, file_path, name, file_ext, size, payload, resume, digest)
+
+    bar = ProgressBar(expected_size=size or 1, filled_char='=')
+    bar.show(state.acked_bytes(parts))
+
+    # Skip parts the API already has.
+    pending = [p for p in parts if p[0] not in state.acked]
+
+    with open(file_path, 'rb') as f:
+      failed = self._upload_parts(api_route, state, f, pending, lambda: bar.show(state.acked_bytes(parts)))
+
+    if failed:
+      log('\nFailed to upload {} part(s) ({}) -- re-run the same command to resume the upload.'.format(
+        len(failed), failed[0]))
+      exit(1)
+
+    # Ask the API to assemble all parts into the final file.
+    self.api.post(api_route + '/uploads/complete', payload={
+      'uploadId': state.upload_id,
+      'parts': [state.acked[index] for index, _, _ in parts]
+    })
+
+    # Upload is done -- nothing left to resume.
+    state.delete()
+
+    if completion_msg:
+      log(completion_msg)
+
+  def split_parts(self, size):
+    """
+    Split a file of the given size into parts.
+
+    :param int size: Total file size (in bytes)
+    :return: (index, offset, length) of each part
+    :rtype: list(tuple)
+    """
+    # Empty files are still uploaded as a single (empty) part.
+    if size == 0:
+      return [(0, 0, 0)]
+
+    return [(i, offset, min(self.part_size, size - offset))
+            for i, offset in enumerate(range(0, size, self.part_size))]
+
+  def _upload_parts(self, api_route, state, f, parts, on_progress):
+    """
+    Upload parts from a pool of workers, reporting progress from this thread as each part lands.
+
+    :return: Errors of the parts that failed even after retrying
+    :rtype: list(PartUploadError)
+    """
+    failed = []
+    executor = ThreadPoolExecutor(max_workers=self.parallel)
+    futures = {executor.submit(self._upload_part, api_route, state, f, *part): part for part in parts}
+
+    try:
+      while futures:
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+        for future in done:
+          futures.pop(future)
+
+          if future.exception():
+            failed.append(future.exception())
+
+        on_progress()
+    except KeyboardInterrupt:
+      # Drop queued parts -- acknowledged ones are already saved for resuming.
+      executor.shutdown(wait=False, cancel_futures=True)
+      log('\nUpload paused -- re-run the same command to resume it.')
+      exit()
+
+    executor.shutdown()
+
+    return failed
+
+  def _upload_part(self, api_route, state, f, index, offset, length):
+    """Read and upload a single part, retrying with exponential backoff if it fails."""
+    data = pread(f, length, offset)
+    digest = hashlib.sha256(data).hexdigest()
+
+    for attempt in range(self.part_retries + 1):
+      try:
+        resp = self.api.put(api_route + '/uploads/part',
+                            payload={'uploadId': state.upload_id, 'index': index, 'offset': offset},
+                            headers={'Content-Type': 'application/octet-stream', part_digest_header_name: digest},
+                            data=data,
+                            timeout=self.part_timeout,
+                            log_on_error=False,
+                            exit_on_error=False,
+                            raise_errors=True)
+      except Exception as e:
+        error = e
+      else:
+        if resp.ok:
+          # Persist progress as soon as the API acknowledges the part.
+          state.ack(index, digest)
+          return
+
+        error = 'status={}'.format(resp.status)
+
+      if attempt < self.part_retries:
+        time.sleep(min(2 ** attempt, 30))
+
+    raise PartUploadError('Part {} failed after {} attempts: {}'.format(index, self.part_retries + 1, error))
+
+  def _resume_or_start(self, api_route, file_path, name, file_ext, size, payload, resume, digest):
+    key = self._upload_key(api_route, file_path, name, payload, digest)
+    state = UploadState.load(self.state_dir, key)
+
+    if state and resume and state.part_size == self.part_size and state.size == size:
+      # Only trust parts that both we and the API agree were uploaded.
+      acked = self._server_acked_parts(api_route, state.upload_id)
+
+      if acked is not None:
+        state.acked = {i: d for i, d in state.acked.items() if acked.get(i) == d}
+        state.save()
+        return state
+
+    # Start a brand new upload.
+    resp = self.api.post(api_route + '/uploads', payload=dict(payload, **{
+      'name': payload.get('name', name),
+      'fileName': name,
+      'ext': file_ext,
+      'size': size,
+      'partSize': self.part_size
+    }))
+
+    state = UploadState(os.path.join(self.state_dir, key + '.json'),
+                        upload_id=resp.json['uploadId'],
+                        part_size=self.part_size,
+                        size=size)
+    state.save()
+
+    return state
+
+  def _server_acked_parts(self, api_route, upload_id):
+    """
+    :return: Map of part index --> digest the API has acknowledged, or None if the upload is unknown to it
+    :rtype: dict or None
+    """
+    resp = self.api.get(api_route + '/uploads/parts',
+                        payload={'uploadId': upload_id},
+                        log_on_error=False,
+                        exit_on_error=False)
+
+    if not resp.ok:
+      return None
+
+    return {p['index']: p['digest'] for p in resp.json.get('parts') or []}
+
+  @staticmethod
+  def _upload_key(api_route, file_path, name, payload, digest=None):
+    """Key identifying an upload of this exact file version to this exact destination."""
+    stat = os.stat(file_path)
+
+    ident = json.dumps({
+      'route': api_route,
+      'path': os.path.abspath(file_path),
+      'size': stat.st_size,
+      # A known digest pins down the version by contents, otherwise the mtime stands in for it.
+      'version': digest or stat.st_mtime_ns,
+      'name': name,
+      'payload': payload
+    }, sort_keys=True, default=str)
+
+    return hashlib.sha1(ident.encode('utf-8')).hexdigest()
+
+
+class PartUploadError(Exception):
+  pass
+
+
+class UploadState(object):
+  """
+  Local record of a chunked upload's progress, persisted as JSON.
+
+  Basic usage:
+
+    state = UploadState.load(state_dir, key)
+    state.ack(part_index, part_digest)  # writes to disk immediately
+
+  """
+
+  def __init__(self, path, upload_id=None, part_size=None, size=None, acked=None):
+    """
+    :param str path: Path of the state file
+    :param str upload_id: ID the API assigned to the upload
+    :param int part_size: Size of each part (in bytes)
+    :param int size: Total size of file being uploaded (in bytes)
+    :param dict acked: Map of part index --> digest of every acknowledged part
+    """
+    self.path = path
+    self.upload_id = upload_id
+    self.part_size = part_size
+    self.size = size
+    self.acked = acked or {}
+    self._lock = threading.Lock()
+
+  @classmethod
+  def load(cls, state_dir, key):
+    """
+    :return: Saved state for the given upload key, if any
+    :rtype: UploadState or None
+    """
+    path = os.path.join(state_dir, key + '.json')
+
+    try:
+      with open(path) as f:
+        data = json.load(f)
+    except (IOError, OSError, ValueError):
+      return None
+
+    return cls(path,
+               upload_id=data.get('uploadId'),
+               part_size=data.get('partSize'),
+               size=data.get('size'),
+               acked={int(i): d for i, d in (data.get('acked') or {}).items()})
+
+  def ack(self, index, digest):
+    """Record an acknowledged part and persist immediately (safe to call from several threads)."""
+    with self._lock:
+      self.acked[index] = digest
+      self.save()
+
+  def acked_bytes(self, parts):
+    acked = set(self.acked)
+    return sum(length for index, _, length in parts if index in acked)
+
+  def save(self):
+    """Atomically write state to disk, so a crash mid-write never corrupts it."""
+    upsert_parent_dirs(self.path)
+
+    tmp_path = self.path + '.tmp'
+
+    with open(tmp_path, 'w') as f:
+      json.dump({
+        'uploadId': self.upload_id,
+        'partSize': self.part_size,
+        'size': self.size,
+        'acked': {str(i): d for i, d in self.acked.items()}
+      }, f)
+
+    os.replace(tmp_path, self.path)
+
+  def delete(self):
+    if os.path.exists(self.path):
+      os.remove(self.path)
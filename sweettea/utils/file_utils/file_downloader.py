@@ -1,18 +1,32 @@
+import hashlib
+import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from clint.textui.progress import Bar as ProgressBar
 from sweettea import log
-from sweettea.definitions import default_archive_fmt, tmp_model_archive_path
-from sweettea.utils.file_utils import get_file_ext, upsert_parent_dirs, extract_zip
+from sweettea.definitions import default_archive_fmt, streaming_archive_fmt, tmp_model_archive_path
+from sweettea.utils.file_utils import (get_file_ext, upsert_parent_dirs, extract_zip, extract_tar_stream, clone_file,
+                                      file_digest, preallocate, pwrite)
+
+# Model bodies are read with their sizes checked against Content-Length (and files
+# preallocated and resumed by byte offset), which only hold for unencoded bodies.
+IDENTITY_ENCODING = {'Accept-Encoding': 'identity'}
 
 
 class FileDownloader(object):
 
-  def __init__(self, api, default_name='file', default_file_type_header='Sweet-Tea-File-Type'):
+  def __init__(self, api, default_name='file', default_file_type_header='Sweet-Tea-File-Type', retries=5,
+               min_segment_size=4 * 1024 * 1024):
     self.api = api
     self.default_name = default_name
     self.default_file_type_header = default_file_type_header
+    self.retries = retries
+    self.min_segment_size = min_segment_size
 
-  def download(self, api_route, dest_path, payload=None, file_type_header=None, extract_archives=True):
+  def download(self, api_route, dest_path, payload=None, file_type_header=None, extract_archives=True, segments=1,
+               stream_extract=False, cache=None):
     """
     Download a file from the SweetTea API
 
@@ -29,17 +43,70 @@ class FileDownloader(object):
       - Destination path is a directory and (the fetched file is an archive but extract_archives is false) or
         (the fetched file is not an archive):
         --> the file will be saved inside of the destination directory
+
+    Files are first downloaded to a '.part' file next to the save path. If the download is
+    interrupted, it's retried (and a later run of the same download is resumed) with a Range
+    request for the remaining bytes, as long as the API's validators (ETag / Last-Modified)
+    show that the remote file hasn't changed in the meantime.
+
+    If segments > 1 and the API advertises range support, the file is split into that many
+    byte ranges which are fetched concurrently into a preallocated '.part' file (see
+    '_download_segmented'). Otherwise it's fetched as a single stream.
+
+    If stream_extract is true and the destination is a directory, the API is asked (via the
+    file type header) for a tar archive instead, whose members are extracted as its bytes
+    arrive -- no archive is written to disk. APIs that don't support this keep sending a zip,
+    which is then downloaded and extracted as usual.
+
+    If a cache is provided and holds a version of this download, the request is made
+    conditional on it -- when the API answers 304 Not Modified, the cached version is
+    linked into place instead. Fresh downloads are added to the cache.
+
+    :param cache: Local model cache to serve from / add to
+      :type: sweettea.utils.file_utils.model_cache.ModelCache
     """
     resp = None
     payload = payload or {}
     file_type_header = file_type_header or self.default_file_type_header
+    default_file_name = payload.get('name') or self.default_name
+    headers = dict(IDENTITY_ENCODING)
+
+    # Ask for an archive format that can be extracted on the fly.
+    if stream_extract and extract_archives and self._analyze_destination(dest_path)[1]:
+      headers[file_type_header] = streaming_archive_fmt
+
+    cache_key = cache.key(api_route, payload) if cache else None
+    cached = self._usable_cached_ref(cache, cache_key, dest_path, extract_archives)
+
+    # Only have the API send the file if it differs from the cached version.
+    if cached:
+      headers.update(cache.conditional_headers(cached))
 
     try:
       # Fetch the file from the API.
-      resp = self.api.get(api_route, payload=payload, stream=True)
+      resp = self.api.get(api_route, payload=payload, headers=headers, stream=True,
+                          log_on_error=False, exit_on_error=False)
     except KeyboardInterrupt:
       exit()
 
+    if cached and resp.status == 304:
+      resp.response_obj.close()
+      return self._place_cached(cache, cached, dest_path, extract_archives, default_file_name)
+
+    if not resp.ok:
+      resp.log_error()
+      exit(1)
+
+    if file_type_header in headers and resp.headers.get(file_type_header) == streaming_archive_fmt:
+      extract_to = cache.staging_path('tree') if cache else dest_path
+      digest = self._extract_while_downloading(extract_to, api_route, payload,
+                                               {file_type_header: streaming_archive_fmt}, resp)
+
+      if cache:
+        cache.place(cache.put(cache_key, extract_to, 'tree', streaming_archive_fmt, resp.headers, digest), dest_path)
+
+      return dest_path
+
     # Extract further info about the downloaded file.
     file_ext, file_is_archive = self._analyze_response_file(resp, file_type_header)
 
@@ -49,33 +116,337 @@ class FileDownloader(object):
       file_ext,
       file_is_archive,
       extract_archives,
-      payload.get('name') or self.default_name
+      default_file_name
     )
 
-    # Stream file to save path.
-    self._stream_to_path(save_to, resp.response_obj, int(resp.headers.get('Content-Length')))
+    # Stream file to save path, resuming any previous partial download of it.
+    if segments > 1 and self._supports_segments(resp.headers, segments):
+      self._download_segmented(save_to, api_route, payload, resp, segments)
+    else:
+      self._download_to_path(save_to, api_route, payload, resp)
 
     # If no archive extraction needed, just return the path at which the file was saved.
     if not extract_to:
+      if cache:
+        cache_copy = cache.staging_path('file')
+        clone_file(save_to, cache_copy, hardlink=False)
+        cache.put(cache_key, cache_copy, 'file', file_ext, resp.headers)
+
       return save_to
 
-    # Extract archive to final destination.
-    extract_zip(save_to, extract_to)
+    if not cache:
+      # Extract archive to final destination.
+      extract_zip(save_to, extract_to)
+      return extract_to
+
+    # Extract archive into the cache (unless identical contents are already there), then link it into place.
+    digest = file_digest(save_to)
+    tree_path = cache.staging_path('tree')
+
+    if not os.path.exists(cache.object_path(digest)):
+      extract_zip(save_to, tree_path)
+
+    cache.place(cache.put(cache_key, tree_path, 'tree', file_ext, resp.headers, digest), extract_to)
 
     return extract_to
 
-  def _stream_to_path(self, path, stream, expected_size):
+  def _usable_cached_ref(self, cache, key, dest_path, extract_archives):
+    """
+    :return: The cached version of a download, if there is one in the form this download needs
+      (an extracted tree when downloading an archive into a directory, a file otherwise)
+    :rtype: dict or None
+    """
+    ref = cache.lookup(key) if cache else None
+
+    if not ref:
+      return None
+
+    wants_tree = (extract_archives and self._analyze_destination(dest_path)[1] and
+                  ref['ext'] in (default_archive_fmt, streaming_archive_fmt))
+
+    return ref if ref['kind'] == ('tree' if wants_tree else 'file') else None
+
+  def _place_cached(self, cache, ref, dest_path, extract_archives, default_file_name):
+    """Put the cached version of a download where the download would have been saved."""
+    save_to, extract_to = self._calc_final_dest(
+      dest_path,
+      ref['ext'],
+      ref['kind'] == 'tree',
+      extract_archives,
+      default_file_name
+    )
+
+    cache.place(ref, extract_to or save_to)
+
+    return extract_to or save_to
+
+  def _download_to_path(self, path, api_route, payload, resp):
+    """
+    Stream a file to the given path via a '.part' file, retrying with Range requests on failure.
+
+    :param str path: Final path to save the file at
+    :param str api_route: Route the file was fetched from
+    :param dict payload: Payload the file was fetched with
+    :param AbstractApiResponse resp: Response of the initial (non-range) request
+    """
     # Ensure all parent dirs of desired save path exist.
     upsert_parent_dirs(path)
 
-    try:
-      ProgressDownloadStream(stream=stream, expected_size=expected_size).stream_to_file(path)
-    except KeyboardInterrupt:
-      exit()
-    except BaseException as e:
-      log('\nError downloading file to path "{}" with error: {}.'.format(path, e))
+    part = PartialDownload(path, ident={'route': api_route, 'payload': payload})
+
+    # Pick up where a previous run left off if the remote file is unchanged.
+    offset = part.resumable_offset(resp.headers)
+
+    for attempt in range(self.retries + 1):
+      try:
+        if offset:
+          if resp:
+            resp.response_obj.close()
+
+          resp, offset = self._fetch_range(api_route, payload, part, offset)
+        elif not resp:
+          resp = self.api.get(api_route, payload=payload, headers=IDENTITY_ENCODING, stream=True, raise_errors=True)
+
+        part.begin(resp.headers, offset)
+
+        ProgressDownloadStream(stream=resp.response_obj,
+                               expected_size=part.size,
+                               offset=offset).stream_to_file(part.path)
+
+        if part.size is not None and os.path.getsize(part.path) != part.size:
+          raise IOError('connection closed after {} of {} bytes'.format(os.path.getsize(part.path), part.size))
+
+        break
+      except KeyboardInterrupt:
+        log('\nDownload paused -- re-run the same command to resume it.')
+        exit()
+      except Exception as e:
+        if attempt == self.retries:
+          log('\nError downloading file to path "{}" with error: {}.'.format(path, e))
+          exit(1)
+
+        time.sleep(min(2 ** attempt, 30))
+
+      # Retry from the bytes already on disk if possible, otherwise from scratch.
+      offset = part.resumable_offset()
+      resp = None
+
+    part.finish()
+
+  def _extract_while_downloading(self, path, api_route, payload, headers, resp):
+    """
+    Extract a streamed tar archive into the given directory as it downloads,
+    starting over (with a fresh request) if the connection drops.
+
+    :param str path: Directory to extract the archive as
+    :param str api_route: Route the archive was fetched from
+    :param dict payload: Payload the archive was fetched with
+    :param dict headers: Headers the archive was fetched with
+    :param AbstractApiResponse resp: Response of the initial request
+    :return: sha256 digest of the archive
+    :rtype: str
+    """
+    for attempt in range(self.retries + 1):
+      try:
+        if not resp:
+          resp = self.api.get(api_route, payload=payload, headers=headers, stream=True, raise_errors=True)
+
+        length = resp.headers.get('Content-Length')
+        reader = ProgressReader(resp.response_obj.raw, int(length) if length is not None else None)
+
+        extract_tar_stream(reader, path)
+        reader.finish()
+        return reader.digest.hexdigest()
+      except KeyboardInterrupt:
+        exit()
+      except Exception as e:
+        if attempt == self.retries:
+          log('\nError extracting archive to path "{}" with error: {}.'.format(path, e))
+          exit(1)
+
+        time.sleep(min(2 ** attempt, 30))
+
+      resp = None
+
+  def _supports_segments(self, headers, segments):
+    """Whether a response advertises range support and is big enough to be worth splitting."""
+    length = headers.get('Content-Length')
+
+    return (headers.get('Accept-Ranges') == 'bytes' and
+            length is not None and
+            int(length) >= segments * self.min_segment_size and
+            any(_validators(headers)))
+
+  def _download_segmented(self, path, api_route, payload, resp, segments):
+    """
+    Fetch a file as 'segments' concurrent byte ranges, written with positional writes
+    into a '.part' file preallocated to the full size.
+
+    Each segment is retried independently from the last byte it wrote. How far each
+    segment got is recorded with the partial download, so a later run of the same
+    download only fetches the bytes that are still missing.
+
+    :param str path: Final path to save the file at
+    :param str api_route: Route the file was fetched from
+    :param dict payload: Payload the file was fetched with
+    :param AbstractApiResponse resp: Response of the initial (non-range) request
+    :param int segments: Number of concurrent byte ranges
+    """
+    # Ensure all parent dirs of desired save path exist.
+    upsert_parent_dirs(path)
+
+    part = PartialDownload(path, ident={'route': api_route, 'payload': payload})
+    size = int(resp.headers.get('Content-Length'))
+    layout = split_ranges(size, segments)
+
+    # Reuse what a previous run fetched if the remote file is unchanged.
+    positions = part.segment_positions(resp.headers, layout)
+
+    if not positions:
+      part.discard()
+      positions = [start for start, _ in layout]
+
+    part.begin(resp.headers, 0, segments=layout, positions=positions)
+
+    progress = SegmentProgress(sum(pos - start for pos, (start, _) in zip(positions, layout)))
+    bar = ProgressBar(expected_size=size or 1, filled_char='=')
+    pending = [i for i, (pos, (_, end)) in enumerate(zip(positions, layout)) if pos <= end]
+    interrupted = False
+
+    # The initial response is already sending the file from its start -- let it feed the
+    # first segment (when that's still to fetch from the start) rather than refetching it.
+    if not (pending and pending[0] == 0 and positions[0] == 0):
+      resp.response_obj.close()
+      resp = None
+
+    with open(part.path, 'r+b' if os.path.exists(part.path) else 'wb') as f:
+      if os.path.getsize(part.path) != size:
+        preallocate(f, size)
+
+      executor = ThreadPoolExecutor(max_workers=len(pending) or 1)
+      futures = [executor.submit(self._fetch_segment, api_route, payload, part, f, i, progress,
+                                 resp if i == 0 else None)
+                 for i in pending]
+
+      try:
+        # Redraw the aggregated progress bar from this thread while the segments download.
+        while True:
+          finished, running = wait(futures, timeout=0.2)
+          bar.show(progress.bytes)
+
+          if not running:
+            break
+      except KeyboardInterrupt:
+        # Tell the workers to stop, and wait for them before the file is closed under their writes.
+        progress.cancel()
+        interrupted = True
+
+      executor.shutdown(wait=True, cancel_futures=True)
+
+    # In case the first segment was cancelled before it started reading the initial response.
+    if resp:
+      resp.response_obj.close()
+
+    if interrupted:
+      log('\nDownload paused -- re-run the same command to resume it.')
       exit()
 
+    errors = [fut.exception() for fut in futures if fut.exception()]
+
+    if errors:
+      log('\nError downloading file to path "{}" with error: {}.'.format(path, errors[0]))
+      exit(1)
+
+    part.finish()
+
+  def _fetch_segment(self, api_route, payload, part, f, index, progress, resp=None):
+    """
+    Fetch one byte range into its place in the '.part' file, retrying from where it left off.
+
+    :param AbstractApiResponse resp: Response already sending the file from the segment's
+      position (i.e. the initial one, for the first segment) to read before making any request
+    """
+    start, end = part.meta['segments'][index]
+    pos = part.meta['positions'][index]
+
+    for attempt in range(self.retries + 1):
+      try:
+        if not resp:
+          resp = self.api.get(api_route,
+                              payload=payload,
+                              headers=_range_headers(part, pos, end),
+                              stream=True,
+                              log_on_error=False,
+                              exit_on_error=False,
+                              raise_errors=True)
+
+          if resp.status != 206 or parse_content_range(resp.headers.get('Content-Range'))[0] != pos:
+            raise RemoteFileChanged('Remote file changed or stopped honoring ranges mid-download.')
+
+        for chunk in resp.response_obj.iter_content(chunk_size=256 * 1024):
+          if progress.cancelled:
+            return
+
+          # A response for more than the segment (the initial one) is cut off at its end.
+          chunk = chunk[:end + 1 - pos]
+          pwrite(f, chunk, pos)
+          pos += len(chunk)
+          progress.add(len(chunk))
+
+          if pos > end:
+            break
+
+        if pos != end + 1:
+          raise IOError('connection closed after {} of {} bytes'.format(pos - start, end - start + 1))
+
+        return
+      except RemoteFileChanged:
+        raise
+      except Exception:
+        if attempt == self.retries or progress.cancelled:
+          raise
+
+        progress.sleep(min(2 ** attempt, 30))
+
+        if progress.cancelled:
+          return
+      finally:
+        if resp:
+          resp.response_obj.close()
+          resp = None
+
+        # Record how far this segment got, for this run's retries and later runs alike.
+        part.advance_segment(index, pos)
+
+  def _fetch_range(self, api_route, payload, part, offset):
+    """
+    Request the rest of a file from the given offset, conditional on it being unchanged.
+
+    :return: The response, and the offset its body starts at (0 if the API sent the whole file instead)
+    :rtype: tuple(AbstractApiResponse, int)
+    """
+    resp = self.api.get(api_route,
+                        payload=payload,
+                        headers=_range_headers(part, offset),
+                        stream=True,
+                        log_on_error=False,
+                        exit_on_error=False,
+                        raise_errors=True)
+
+    # Server honored the range -- append to what we have.
+    if resp.status == 206 and parse_content_range(resp.headers.get('Content-Range'))[0] == offset:
+      return resp, offset
+
+    # Full file sent instead (remote changed, or ranges unsupported) -- start over with it.
+    if resp.status == 200:
+      return resp, 0
+
+    # Anything else (e.g. 416) -- discard the partial file and make a plain request.
+    resp.response_obj.close()
+    part.discard()
+
+    return self.api.get(api_route, payload=payload, headers=IDENTITY_ENCODING, stream=True), 0
+
   def _calc_final_dest(self, dest_path, actual_ext, is_archive, extract_archives, default_file_name):
     # Extract further info about the desired destination path.
     dest_ext, dest_is_dir = self._analyze_destination(dest_path)
@@ -117,6 +488,12 @@ class ProgressDownloadStream(object):
   Progress bar buffer class that can monitor a file download by displaying
   progress to the user while also writing to the desired file.
 
+  The body is read straight into one reusable buffer (no per-chunk bytes objects on
+  our side), in chunks that grow while the connection keeps up and shrink when it
+  stalls, so a fast local link moves a few MiB per iteration while a slow one still
+  gets regular progress updates. The progress bar is redrawn on a timer rather than
+  per chunk, and the file is preallocated when its size is known.
+
   Basic usage:
 
     download_stream = ProgressDownloadStream(stream=api_response_obj,
@@ -126,7 +503,16 @@ class ProgressDownloadStream(object):
 
   """
 
-  def __init__(self, stream=None, expected_size=None, chunk_size=512):
+  min_chunk_size = 64 * 1024
+  max_chunk_size = 4 * 1024 * 1024
+
+  # Aim for reads that take about this long (seconds) when adapting the chunk size.
+  target_read_time = 0.05
+
+  # Minimum interval (seconds) between progress bar redraws.
+  refresh_interval = 0.1
+
+  def __init__(self, stream=None, expected_size=None, chunk_size=None, offset=0):
     """
     :param stream:
       Streaming API response object returned by the 'requests' library
@@ -134,12 +520,16 @@ class ProgressDownloadStream(object):
     :param int expected_size:
       Total size of file being downloaded (in bytes)
     :param int chunk_size:
-      Chunk size to use when iterating over streamed response content
+      Fixed chunk size to read the streamed response with (adaptive if not provided)
+    :param int offset:
+      Number of bytes of the file already on disk -- the stream holds the bytes after them
     """
     self.stream = stream
-    self.prog_bar = ProgressBar(expected_size=expected_size, filled_char='=')
-    self.progress = 0
+    self.expected_size = expected_size
+    self.prog_bar = ProgressBar(expected_size=expected_size or 1, filled_char='=')
+    self.progress = offset
     self.chunk_size = chunk_size
+    self.offset = offset
 
   def stream_to_file(self, path):
     """
@@ -147,13 +537,309 @@ class ProgressDownloadStream(object):
 
     :param str path: Desired file path
     """
-    # Using default state of files being overwritten for now
-    if os.path.exists(path):
+    if self.offset:
+      # Resuming -- drop anything past the offset and write after it.
+      os.truncate(path, self.offset)
+    elif os.path.exists(path):
+      # Otherwise the file is overwritten.
       os.remove(path)
 
-    # Stream downloaded contents to file and show progress
-    with open(path, 'wb') as f:
-      for chunk in self.stream.iter_content(chunk_size=self.chunk_size):
-        f.write(chunk)
-        self.progress += int(len(chunk))
-        self.prog_bar.show(self.progress)
\ No newline at end of file
+    with open(path, 'r+b' if self.offset else 'wb') as f:
+      if self.expected_size:
+        preallocate(f, self.expected_size)
+
+      f.seek(self.offset)
+
+      try:
+        self._copy_stream(f)
+      finally:
+        # Never leave preallocated-but-unwritten bytes behind, so the file's size on
+        # disk always says how much of it can be resumed from.
+        f.truncate(self.progress)
+
+    self.prog_bar.show(self.progress)
+
+  def _copy_stream(self, f):
+    buf = memoryview(bytearray(self.chunk_size or self.max_chunk_size))
+    chunk_size = self.chunk_size or self.min_chunk_size
+    last_refresh = 0
+
+    # Read the raw body (asked for unencoded -- see IDENTITY_ENCODING -- but undo any
+    # Content-Encoding a server sends regardless, like iter_content would).
+    readinto = self.stream.raw.readinto
+    self.stream.raw.decode_content = True
+
+    while True:
+      started = time.monotonic()
+      n = readinto(buf[:chunk_size])
+
+      if not n:
+        break
+
+      f.write(buf[:n])
+      self.progress += n
+
+      now = time.monotonic()
+
+      # Grow chunks while reads complete quickly, shrink them if they stall.
+      if not self.chunk_size:
+        elapsed = now - started
+
+        if elapsed < self.target_read_time / 2 and chunk_size < self.max_chunk_size:
+          chunk_size *= 2
+        elif elapsed > self.target_read_time * 2 and chunk_size > self.min_chunk_size:
+          chunk_size //= 2
+
+      if now - last_refresh >= self.refresh_interval:
+        self.prog_bar.show(self.progress)
+        last_refresh = now
+
+
+class ProgressReader(object):
+  """
+  Read-only file-like wrapper around a streamed response body that
+  displays download progress (and hashes the body) as its bytes are consumed.
+  """
+
+  # Minimum interval (seconds) between progress bar redraws.
+  refresh_interval = 0.1
+
+  def __init__(self, raw, expected_size=None):
+    """
+    :param raw: Raw body of a streaming response (urllib3.HTTPResponse)
+    :param int expected_size: Total size of the body (in bytes)
+    """
+    self.raw = raw
+    self.raw.decode_content = True
+    self.expected_size = expected_size
+    self.prog_bar = ProgressBar(expected_size=expected_size or 1, filled_char='=')
+    self.progress = 0
+    self.last_refresh = 0
+    self.digest = hashlib.sha256()
+
+  def read(self, size=-1):
+    data = self.raw.read(None if size is None or size < 0 else size)
+    self.progress += len(data)
+    self.digest.update(data)
+
+    # Fail (rather than signal a clean EOF) if the body ended early.
+    if not data and size != 0 and self.expected_size is not None and self.progress != self.expected_size:
+      raise IOError('connection closed after {} of {} bytes'.format(self.progress, self.expected_size))
+
+    now = time.monotonic()
+
+    if now - self.last_refresh >= self.refresh_interval:
+      self.prog_bar.show(self.progress)
+      self.last_refresh = now
+
+    return data
+
+  def finish(self):
+    """Drain whatever follows the archive's end marker (padding), checking the whole body arrived."""
+    while self.read(64 * 1024):
+      pass
+
+    self.prog_bar.show(self.progress)
+
+
+class PartialDownload(object):
+  """
+  A download in progress, kept at '<path>.part' alongside a '<path>.part.json' file that records
+  which request it belongs to and the remote file's validators, so it can be safely resumed.
+  """
+
+  def __init__(self, path, ident=None):
+    """
+    :param str path: Final path of the downloaded file
+    :param dict ident: Identifies what's being downloaded (route, payload, ...)
+    """
+    self.final_path = path
+    self.path = path + '.part'
+    self.meta_path = self.path + '.json'
+    self.ident = json.loads(json.dumps(ident or {}, sort_keys=True, default=str))
+    self.meta = self._load_meta()
+    self.size = self.meta.get('size')
+    self._lock = threading.Lock()
+
+  @property
+  def validator(self):
+    """Strong ETag if the API provided one, otherwise Last-Modified."""
+    return self.meta.get('etag') or self.meta.get('last_modified')
+
+  def resumable_offset(self, headers=None):
+    """
+    :param headers: Headers of a fresh response for the same file -- if provided, its validators must match ours
+    :return: Number of bytes on disk that can be resumed from (0 if the download must start over)
+    :rtype: int
+    """
+    if not self.validator or self.meta.get('ident') != self.ident or not os.path.exists(self.path):
+      return 0
+
+    # Segmented downloads are preallocated, so their size on disk says nothing about progress.
+    if self.meta.get('segments'):
+      return 0
+
+    if headers is not None:
+      etag, last_modified = _validators(headers)
+
+      if (etag or last_modified) != self.validator or headers.get('Accept-Ranges') != 'bytes':
+        return 0
+
+    offset = os.path.getsize(self.path)
+
+    return offset if self.size is None or offset < self.size else 0
+
+  def segment_positions(self, headers, layout):
+    """
+    :param headers: Headers of a fresh response for the same file
+    :param list layout: (start, end) segments the file is about to be split into
+    :return: Next byte to fetch for each segment of a previous segmented run, if its file and layout match
+    :rtype: list(int) or None
+    """
+    etag, last_modified = _validators(headers)
+
+    if (not self.validator or self.meta.get('ident') != self.ident or not os.path.exists(self.path) or
+        (etag or last_modified) != self.validator or
+        [tuple(seg) for seg in self.meta.get('segments') or []] != layout):
+      return None
+
+    return self.meta.get('positions')
+
+  def advance_segment(self, index, pos):
+    """Record the next byte to fetch for a segment (safe to call from several threads)."""
+    with self._lock:
+      if self.meta['positions'][index] != pos:
+        self.meta['positions'][index] = pos
+        self._save_meta()
+
+  def begin(self, headers, offset, segments=None, positions=None):
+    """Record the validators and total size of the file about to be streamed into the '.part' file."""
+    etag, last_modified = _validators(headers)
+
+    if offset:
+      self.size = parse_content_range(headers.get('Content-Range'))[1]
+    else:
+      length = headers.get('Content-Length')
+      self.size = int(length) if length is not None else None
+
+    self.meta = {
+      'ident': self.ident,
+      'etag': etag,
+      'last_modified': last_modified,
+      'size': self.size
+    }
+
+    if segments:
+      self.meta['segments'] = [list(seg) for seg in segments]
+      self.meta['positions'] = list(positions)
+
+    self._save_meta()
+
+  def finish(self):
+    """Move the completed '.part' file into place."""
+    os.replace(self.path, self.final_path)
+    self._remove_meta()
+
+  def discard(self):
+    if os.path.exists(self.path):
+      os.remove(self.path)
+
+    self._remove_meta()
+
+  def _save_meta(self):
+    tmp_path = self.meta_path + '.tmp'
+
+    with open(tmp_path, 'w') as f:
+      json.dump(self.meta, f)
+
+    os.replace(tmp_path, self.meta_path)
+
+  def _load_meta(self):
+    try:
+      with open(self.meta_path) as f:
+        return json.load(f)
+    except (IOError, OSError, ValueError):
+      return {}
+
+  def _remove_meta(self):
+    self.meta = {}
+
+    if os.path.exists(self.meta_path):
+      os.remove(self.meta_path)
+
+
+class SegmentProgress(object):
+  """Byte counter shared by segment workers (plus a flag telling them to stop)."""
+
+  def __init__(self, initial=0):
+    self.bytes = initial
+    self._cancelled = threading.Event()
+    self._lock = threading.Lock()
+
+  @property
+  def cancelled(self):
+    return self._cancelled.is_set()
+
+  def cancel(self):
+    self._cancelled.set()
+
+  def sleep(self, seconds):
+    """Sleep between retries, waking early if cancelled."""
+    self._cancelled.wait(seconds)
+
+  def add(self, n):
+    with self._lock:
+      self.bytes += n
+
+
+class RemoteFileChanged(Exception):
+  pass
+
+
+def split_ranges(size, count):
+  """
+  Split 'size' bytes into 'count' contiguous, inclusive (start, end) byte ranges.
+
+  :rtype: list(tuple)
+  """
+  count = max(1, min(count, size))
+  step = size // count
+
+  return [(i * step, size - 1 if i == count - 1 else (i + 1) * step - 1) for i in range(count)]
+
+
+def _range_headers(part, start, end=''):
+  """
+  :return: Headers requesting bytes 'start' to 'end' (default=the end) of the file a part file is of
+  :rtype: dict
+  """
+  return dict(IDENTITY_ENCODING, **{'Range': 'bytes={}-{}'.format(start, end), 'If-Range': part.validator})
+
+
+def _validators(headers):
+  """
+  :return: (strong ETag, Last-Modified) of a response -- weak ETags can't be used with If-Range
+  :rtype: tuple
+  """
+  etag = headers.get('ETag')
+
+  if etag and etag.startswith('W/'):
+    etag = None
+
+  return etag, headers.get('Last-Modified')
+
+
+def parse_content_range(value):
+  """
+  Parse a 'Content-Range: bytes start-end/total' header.
+
+  :return: (start, total) -- either may be None if missing or unknown
+  :rtype: tuple
+  """
+  try:
+    unit, spec = value.split(' ', 1)
+    byte_range, total = spec.split('/', 1)
+    start = int(byte_range.split('-', 1)[0])
+    return start, None if total == '*' else int(total)
+  except (AttributeError, ValueError):
+    return None, None
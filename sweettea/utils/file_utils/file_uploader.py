@@ -1,7 +1,10 @@
+import uuid
 from clint.textui.progress import Bar as ProgressBar
 from requests_toolbelt.multipart.encoder import MultipartEncoder, MultipartEncoderMonitor
 from sweettea import log
-from sweettea.utils.file_utils import get_file_ext, get_mime_type
+from sweettea.definitions import default_archive_fmt
+from sweettea.utils.file_utils import get_dir_size, get_file_ext, get_mime_type, iter_zip_dir
+from sweettea.utils.file_utils.zip_writer import DEFAULT_COMPRESSION_LEVEL
 
 
 class FileUploader(object):
@@ -23,7 +26,8 @@ class FileUploader(object):
       name = name + '.' + file_ext
 
     # Add file info to payload.
-    payload['file'] = (name, open(file_path, 'rb'), get_mime_type(file_path))
+    f = open(file_path, 'rb')
+    payload['file'] = (name, f, get_mime_type(file_path))
     payload['ext'] = file_ext
 
     # Create a multipart encoder.
@@ -42,6 +46,55 @@ class FileUploader(object):
                     mp_upload_monitor=monitor)
     except KeyboardInterrupt:
       exit()
+    finally:
+      f.close()
+
+  def upload_dir_stream(self, api_route, dir_path, name=None, payload=None, completion_msg=None,
+                        compression_level=DEFAULT_COMPRESSION_LEVEL, reproducible=False, ignore=None, scan_workers=0):
+    """
+    Zip a directory straight into the request body of a multipart upload.
+
+    Compression and network transfer overlap, and no temporary archive is ever
+    written to disk. The request is the same multipart form that 'upload' sends
+    (a zip file under the 'file' field), just sent with chunked transfer encoding.
+
+    :param str api_route: Route to upload to
+    :param str dir_path: Directory to zip and upload
+    :param str name: Name to give the uploaded archive (extension is appended)
+    :param dict payload: Extra form fields to send
+    :param str completion_msg: Log to display when the upload completes
+    :param int compression_level: zlib compression level 0-9
+    :param bool reproducible: Whether to zip the directory reproducibly (see zip_dir)
+    :param ignore: Exclusion rules for paths that shouldn't be uploaded (see zip_dir)
+    :param int scan_workers: Number of threads to stat and read ahead files with while scanning (see zip_dir)
+    """
+    name = (name or self.default_name) + '.' + default_archive_fmt
+    payload = dict(payload or {}, ext=default_archive_fmt)
+    completion_msg = completion_msg or self.default_completion_msg
+
+    # Progress is measured in source bytes compressed, since the archive size isn't known up front.
+    bar = ProgressBar(expected_size=get_dir_size(dir_path, ignore=ignore) or 1, filled_char='=')
+    progress = {'read': 0}
+
+    def on_read(n):
+      progress['read'] += n
+      bar.show(progress['read'])
+
+    boundary = uuid.uuid4().hex
+
+    body = iter_multipart(boundary, payload, 'file', name, 'application/zip',
+                          iter_zip_dir(dir_path, compression_level=compression_level, on_read=on_read,
+                                       reproducible=reproducible, ignore=ignore, scan_workers=scan_workers))
+
+    try:
+      self.api.post(api_route,
+                    headers={'Content-Type': 'multipart/form-data; boundary={}'.format(boundary)},
+                    data=body)
+    except KeyboardInterrupt:
+      exit()
+
+    if completion_msg:
+      log(completion_msg)
 
   def _progress_display_cb(self, encoder, completion_msg=None):
     """
@@ -79,3 +132,28 @@ class FileUploader(object):
         bar.show(monitor.bytes_read)
 
     return callback
+
+
+def iter_multipart(boundary, fields, file_field, file_name, content_type, file_chunks):
+  """
+  Generate a multipart/form-data body whose file part is streamed from a generator.
+
+  :param str boundary: Multipart boundary
+  :param dict fields: Plain form fields
+  :param str file_field: Form field name of the file
+  :param str file_name: File name to report for the file
+  :param str content_type: Content type of the file
+  :param file_chunks: Generator of the file's bytes
+  :return: Generator of the request body's bytes
+  """
+  for key, val in fields.items():
+    yield ('--{}\r\nContent-Disposition: form-data; name="{}"\r\n\r\n{}\r\n'
+           .format(boundary, key, val)).encode('utf-8')
+
+  yield ('--{}\r\nContent-Disposition: form-data; name="{}"; filename="{}"\r\nContent-Type: {}\r\n\r\n'
+         .format(boundary, file_field, file_name, content_type)).encode('utf-8')
+
+  for chunk in file_chunks:
+    yield chunk
+
+  yield '\r\n--{}--\r\n'.format(boundary).encode('utf-8')
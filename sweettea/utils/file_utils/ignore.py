@@ -0,0 +1,147 @@
+import os
+import re
+
+# Name of the file of exclusion patterns read from the root of a model directory.
+IGNORE_FILE_NAME = '.stignore'
+
+
+class IgnoreRules(object):
+  """
+  Gitignore-style exclusion patterns for packaging a model directory.
+
+  Supported syntax (as in .gitignore):
+
+    # comment       Blank lines and lines starting with '#' are skipped
+    *.pyc           Matches at any depth ('*' and '?' don't match '/', '[a-z]' classes work)
+    /checkpoints    A leading or inner '/' anchors the pattern to the model directory
+    runs/           A trailing '/' only matches directories
+    **/events.*     '**' matches any number of directories
+    !keep.pt        A leading '!' re-includes a path excluded by an earlier pattern
+
+  The last matching pattern wins. Excluding a directory excludes everything under
+  it (walkers prune it without descending), so its contents can't be re-included.
+
+  Basic usage:
+
+    rules = IgnoreRules(['optimizer/', '*.tfevents.*'])
+    rules.is_ignored('optimizer', is_dir=True)  # True
+
+  """
+
+  def __init__(self, patterns=()):
+    """
+    :param patterns: Lines of gitignore-style patterns
+    """
+    self.rules = [rule for rule in (_compile(line) for line in patterns) if rule]
+
+  def __bool__(self):
+    return bool(self.rules)
+
+  def is_ignored(self, rel_path, is_dir=False):
+    """
+    :param str rel_path: Path relative to the model directory ('/'-separated)
+    :param bool is_dir: Whether the path is a directory
+    :return: Whether the path is excluded
+    :rtype: bool
+    """
+    ignored = False
+
+    for regex, negate, dir_only in self.rules:
+      if dir_only and not is_dir:
+        continue
+
+      if regex.match(rel_path):
+        ignored = not negate
+
+    return ignored
+
+
+def load_ignore_rules(dir_path, extra_patterns=None):
+  """
+  Collect the exclusion rules for packaging a model directory: 'extra_patterns'
+  (e.g. from the project config) followed by the directory's own .stignore file,
+  which can override them. The .stignore file itself is always excluded.
+
+  :param str dir_path: Model directory
+  :param list extra_patterns: Patterns to apply before the .stignore file's
+  :rtype: IgnoreRules
+  """
+  patterns = ['/' + IGNORE_FILE_NAME] + list(extra_patterns or [])
+  ignore_file_path = os.path.join(dir_path, IGNORE_FILE_NAME)
+
+  if os.path.isfile(ignore_file_path):
+    with open(ignore_file_path) as f:
+      patterns += f.read().splitlines()
+
+  return IgnoreRules(patterns)
+
+
+def _compile(line):
+  """:return: (regex, negate, dir_only) for a pattern line, or None if it has no pattern"""
+  line = line.rstrip('\n').rstrip()
+
+  if not line or line.startswith('#'):
+    return None
+
+  negate = line.startswith('!')
+
+  if negate or line.startswith('\\'):
+    line = line[1:]
+
+  dir_only = line.endswith('/')
+  line = line.rstrip('/')
+
+  if not line:
+    return None
+
+  anchored = '/' in line
+  line = line.lstrip('/')
+
+  prefix = '' if anchored else '(?:.*/)?'
+
+  return re.compile('^' + prefix + _translate(line) + '$', re.DOTALL), negate, dir_only
+
+
+def _translate(pattern):
+  """Translate a gitignore glob (without leading/trailing slashes) into a regex."""
+  out = []
+  i, n = 0, len(pattern)
+
+  while i < n:
+    c = pattern[i]
+
+    if pattern.startswith('**/', i) and (i == 0 or pattern[i - 1] == '/'):
+      out.append('(?:.*/)?')
+      i += 3
+    elif pattern.startswith('**', i) and i + 2 == n and (i == 0 or pattern[i - 1] == '/'):
+      out.append('.*')
+      i += 2
+    elif c == '*':
+      out.append('[^/]*')
+      i += 1
+    elif c == '?':
+      out.append('[^/]')
+      i += 1
+    elif c == '[':
+      end = pattern.find(']', i + 2 if pattern.startswith('[!', i) or pattern.startswith('[^', i) else i + 1)
+
+      if end < 0:
+        out.append(re.escape(c))
+        i += 1
+        continue
+
+      body = pattern[i + 1:end]
+
+      if body.startswith('!'):
+        body = '^' + body[1:]
+
+      out.append('[' + body.replace('\\', '\\\\') + ']')
+      i = end + 1
+    elif c == '\\' and i + 1 < n:
+      out.append(re.escape(pattern[i + 1]))
+      i += 2
+    else:
+      out.append(re.escape(c))
+      i += 1
+
+  return ''.join(out)
@@ -0,0 +1,284 @@
+import hashlib
+import json
+import os
+import stat as stat_mod
+from clint.textui.progress import Bar as ProgressBar
+from sweettea import log
+from sweettea.definitions import manifest_state_dir, part_digest_header_name
+from sweettea.utils.file_utils import clone_file, file_digest, is_safe_rel_path, run_pool, staged_dir, upsert_parent_dirs
+from sweettea.utils.file_utils.file_downloader import FileDownloader
+from sweettea.utils.file_utils.file_uploader import FileUploader
+from sweettea.utils.file_utils.scanner import scan_tree
+
+
+class ManifestSyncUploader(FileUploader):
+  """
+  Uploads a directory as a manifest of its files (relative path, size and sha256 digest)
+  plus the contents of only those files the API doesn't already have, so re-uploading
+  a model where one shard changed only sends that shard.
+
+  Manifest protocol (all routes relative to the api_route passed to 'upload'):
+
+    POST {route}/manifest/missing  Which of these digests are missing?  -> {"missing": ["<digest>", ...]}
+    PUT  {route}/blobs             Upload one file's contents (raw body, with its digest in the
+                                   'digest' query param and the Sweet-Tea-Part-Digest header)
+    POST {route}/manifest          Assemble a new version of the model from a manifest -> 201
+
+  Basic usage:
+
+    ManifestSyncUploader(api).upload('/model', path_to_dir, payload={'name': 'my-model'})
+
+  """
+
+  def __init__(self, api, parallel=4, **kwargs):
+    """
+    :param api: API client to upload through
+      :type: sweettea.utils.abstract_api.AbstractApi
+    :param int parallel: Number of files to upload concurrently
+    """
+    super(ManifestSyncUploader, self).__init__(api, **kwargs)
+    self.parallel = max(1, parallel)
+
+  def upload(self, api_route, dir_path, name=None, payload=None, completion_msg=None, ignore=None):
+    """
+    Sync a directory up to the API.
+
+    :param str api_route: Base route of the manifest protocol
+    :param str dir_path: Directory to upload
+    :param str name: Name to give the uploaded model
+    :param dict payload: Extra info sent with the manifest
+    :param str completion_msg: Log to display when the upload completes
+    :param ignore: Exclusion rules for paths that shouldn't be uploaded
+      :type: sweettea.utils.file_utils.ignore.IgnoreRules
+    :return: Whether the API supports manifest uploads (nothing is uploaded if not)
+    :rtype: bool
+    """
+    payload = dict(payload or {})
+    payload.setdefault('name', name or self.default_name)
+    completion_msg = completion_msg or self.default_completion_msg
+
+    manifest = build_manifest(dir_path, ignore=ignore)
+
+    resp = self.api.post(api_route + '/manifest/missing',
+                         payload=dict(payload, files=manifest['files']),
+                         log_on_error=False,
+                         exit_on_error=False)
+
+    if resp.status == 404:
+      return False
+
+    if not resp.ok:
+      resp.log_error()
+      exit(1)
+
+    missing = set(resp.json.get('missing') or [])
+
+    # Upload each missing blob once, even if several files share its contents.
+    blobs = {}
+
+    for f in manifest['files']:
+      if f['digest'] in missing:
+        blobs.setdefault(f['digest'], f)
+
+    total = sum(f['size'] for f in blobs.values())
+    log('Uploading {} bytes of new contents for {} files.'.format(total, len(manifest['files'])))
+
+    bar = ProgressBar(expected_size=total or 1, filled_char='=')
+    progress = {'bytes': 0}
+
+    def on_done(f):
+      progress['bytes'] += f['size']
+      bar.show(progress['bytes'])
+
+    run_pool(self.parallel, lambda f: self._upload_blob(api_route, dir_path, f), blobs.values(), on_done)
+
+    # Have the API assemble the new version from the manifest.
+    self.api.post(api_route + '/manifest', payload=dict(payload, **manifest))
+
+    if completion_msg:
+      log(completion_msg)
+
+    return True
+
+  def _upload_blob(self, api_route, dir_path, f):
+    with open(os.path.join(dir_path, f['path']), 'rb') as body:
+      self.api.put(api_route + '/blobs',
+                   payload={'digest': f['digest']},
+                   headers={'Content-Type': 'application/octet-stream', part_digest_header_name: f['digest']},
+                   data=body)
+
+
+class ManifestSyncDownloader(FileDownloader):
+  """
+  Downloads a directory model by its manifest, fetching only the files whose contents
+  aren't already somewhere in the destination directory. Unchanged files are linked
+  (see 'clone_file') into a staging directory next to the destination, which is then
+  swapped into place.
+
+  Manifest protocol (all routes relative to the api_route passed to 'download'):
+
+    GET {route}/manifest  Manifest of the model's latest version -> {"files": [...], "dirs": [...]}
+    GET {route}/blobs     Contents of one file (by 'digest' query param)
+
+  """
+
+  def __init__(self, api, parallel=4, **kwargs):
+    """
+    :param api: API client to download through
+      :type: sweettea.utils.abstract_api.AbstractApi
+    :param int parallel: Number of files to download concurrently
+    """
+    super(ManifestSyncDownloader, self).__init__(api, **kwargs)
+    self.parallel = max(1, parallel)
+
+  def download(self, api_route, dest_path, payload=None, **kwargs):
+    """
+    Sync a directory model down from the API, falling back to a regular download
+    (see FileDownloader.download) if the API has no manifest for it.
+    """
+    payload = payload or {}
+
+    resp = self.api.get(api_route + '/manifest', payload=payload, log_on_error=False, exit_on_error=False)
+
+    if resp.status == 404 or not self._analyze_destination(dest_path)[1]:
+      return super(ManifestSyncDownloader, self).download(api_route, dest_path, payload=payload, **kwargs)
+
+    if not resp.ok:
+      resp.log_error()
+      exit(1)
+
+    manifest = resp.json
+
+    for path in [f['path'] for f in manifest['files']] + (manifest.get('dirs') or []):
+      if not is_safe_rel_path(path):
+        log('Refusing to download unsafe manifest path "{}".'.format(path))
+        exit(1)
+
+    local = build_manifest(dest_path) if os.path.isdir(dest_path) else {'files': []}
+
+    # Where in the existing directory each digest can be copied from.
+    have = {f['digest']: os.path.join(dest_path, f['path']) for f in local['files']}
+
+    fetch = {}
+
+    for f in manifest['files']:
+      if f['digest'] not in have:
+        fetch.setdefault(f['digest'], f)
+
+    total = sum(f['size'] for f in fetch.values())
+    log('Downloading {} bytes of new contents for {} files.'.format(total, len(manifest['files'])))
+
+    bar = ProgressBar(expected_size=total or 1, filled_char='=')
+    progress = {'bytes': 0}
+
+    def on_done(f):
+      progress['bytes'] += f['size']
+      bar.show(progress['bytes'])
+
+    with staged_dir(dest_path) as staging_path:
+      for d in manifest.get('dirs') or []:
+        os.makedirs(os.path.join(staging_path, d), exist_ok=True)
+
+      # Fetch changed files first (each to the first path that uses its contents)...
+      run_pool(self.parallel,
+                lambda f: self._download_blob(api_route, payload, f, os.path.join(staging_path, f['path'])),
+                fetch.values(),
+                on_done)
+
+      fetched = {digest: os.path.join(staging_path, f['path']) for digest, f in fetch.items()}
+
+      # ...then link every other file from wherever its contents already are.
+      for f in manifest['files']:
+        path = os.path.join(staging_path, f['path'])
+
+        if not os.path.exists(path):
+          upsert_parent_dirs(path)
+          clone_file(have.get(f['digest']) or fetched[f['digest']], path)
+
+    # Record the new tree's digests, so the next sync doesn't rehash it.
+    _save_digest_cache(dest_path, {f['path']: _digest_cache_entry(os.path.join(dest_path, f['path']), f['digest'])
+                                   for f in manifest['files']})
+
+    return dest_path
+
+  def _download_blob(self, api_route, payload, f, path):
+    upsert_parent_dirs(path)
+
+    resp = self.api.get(api_route + '/blobs', payload=dict(payload, digest=f['digest']), stream=True)
+    digest = hashlib.sha256()
+
+    resp.response_obj.raw.decode_content = True
+
+    with open(path, 'wb') as out:
+      for chunk in iter(lambda: resp.response_obj.raw.read(1024 * 1024), b''):
+        digest.update(chunk)
+        out.write(chunk)
+
+    if digest.hexdigest() != f['digest']:
+      raise IOError('contents of "{}" don\'t match its manifest digest'.format(f['path']))
+
+
+def build_manifest(dir_path, ignore=None):
+  """
+  List a directory's files with their sizes and sha256 digests (plus its empty dirs).
+
+  Digests are cached per directory under 'manifest_state_dir', keyed by each file's
+  size and mtime, so only new or modified files are hashed.
+
+  :param str dir_path: Directory to list
+  :param ignore: Exclusion rules for paths to leave out (excluded directories aren't descended into)
+  :return: {"files": [{"path", "size", "digest"}, ...], "dirs": [empty dir paths]}
+  :rtype: dict
+  """
+  cache = _load_digest_cache(dir_path)
+  files, dirs, new_cache = [], [], {}
+
+  # Same members (and ignore rules) as a zip of the directory, each stat'ed once.
+  for path, rel_path, st in scan_tree(dir_path.rstrip('/') + '/', ignore=ignore):
+    if stat_mod.S_ISDIR(st.st_mode):
+      dirs.append(rel_path)
+      continue
+
+    cached = cache.get(rel_path)
+
+    if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+      digest = cached[2]
+    else:
+      digest = file_digest(path)
+
+    new_cache[rel_path] = [st.st_size, st.st_mtime_ns, digest]
+    files.append({'path': rel_path, 'size': st.st_size, 'digest': digest})
+
+  _save_digest_cache(dir_path, new_cache)
+
+  return {'files': sorted(files, key=lambda f: f['path']), 'dirs': sorted(dirs)}
+
+
+def _digest_cache_path(dir_path):
+  return os.path.join(manifest_state_dir, hashlib.sha1(os.path.abspath(dir_path).encode('utf-8')).hexdigest() + '.json')
+
+
+def _digest_cache_entry(path, digest):
+  stat = os.stat(path)
+  return [stat.st_size, stat.st_mtime_ns, digest]
+
+
+def _load_digest_cache(dir_path):
+  """:return: Map of relative path --> [size, mtime_ns, digest] of a directory's files when last hashed"""
+  try:
+    with open(_digest_cache_path(dir_path)) as f:
+      return json.load(f)
+  except (IOError, OSError, ValueError):
+    return {}
+
+
+def _save_digest_cache(dir_path, cache):
+  cache_path = _digest_cache_path(dir_path)
+  upsert_parent_dirs(cache_path)
+
+  tmp_path = cache_path + '.tmp'
+
+  with open(tmp_path, 'w') as f:
+    json.dump(cache, f)
+
+  os.replace(tmp_path, cache_path)
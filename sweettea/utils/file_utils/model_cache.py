@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from sweettea.utils.file_utils import clone_file, file_digest, get_dir_size, link_tree, upsert_parent_dirs
+
+try:
+  import fcntl
+except ImportError:
+  # No cross-process locking on platforms without fcntl (Windows).
+  fcntl = None
+
+
+class ModelCache(object):
+  """
+  Content-addressed local cache of downloaded models, shared by every checkout on a machine.
+
+  Layout (inside 'cache_dir'):
+
+    objects/<sha256>   A downloaded file, or the extracted tree of a downloaded archive,
+                       named by the digest of the bytes the API sent
+    index.json         Which object each download (project + model name, i.e. API route +
+                       payload) last resolved to, with its validators, plus the size and
+                       last use time of every object
+    lock               Held while the index is read or written, so concurrent 'st'
+                       processes don't clobber each other's updates
+
+  Before downloading, the API is asked whether the cached version is still current
+  (If-None-Match / If-Modified-Since -> 304). Objects are then placed at the destination
+  as reflinks where the filesystem supports them, and copies otherwise -- never hardlinks,
+  which would let an in-place edit of the destination change the cached object.
+
+  Objects are evicted least-recently-used first once the cache outgrows 'max_size'.
+  Evicting an object never affects destinations it was linked into.
+
+  Basic usage:
+
+    FileDownloader(api).download('/model', dest_path, payload=payload, cache=ModelCache(cache_dir))
+
+  """
+
+  def __init__(self, cache_dir, max_size):
+    """
+    :param str cache_dir: Directory to keep the cache in
+    :param int max_size: Size (in bytes) past which least recently used objects are evicted
+    """
+    self.cache_dir = cache_dir
+    self.max_size = max_size
+    self.objects_dir = os.path.join(cache_dir, 'objects')
+    self.index_path = os.path.join(cache_dir, 'index.json')
+    self.lock_path = os.path.join(cache_dir, 'lock')
+
+  def lookup(self, key):
+    """
+    :param str key: Key of a download (see 'key')
+    :return: Cached ref for the download ({digest, kind, ext, etag, last_modified}), if its object is still cached
+    :rtype: dict or None
+    """
+    with self._index() as index:
+      ref = index['refs'].get(key)
+
+      if not ref or ref['digest'] not in index['objects'] or not os.path.exists(self.object_path(ref['digest'])):
+        return None
+
+      return ref
+
+  def put(self, key, src_path, kind, ext, headers, digest=None):
+    """
+    Move a downloaded file (kind='file') or extracted archive tree (kind='tree') into the cache,
+    and record it as the current version of the given download.
+
+    :param str key: Key of the download (see 'key')
+    :param str src_path: Downloaded file / extracted tree -- moved into the cache, so it must be on its filesystem
+    :param str kind: 'file' or 'tree'
+    :param str ext: File type the API sent
+    :param headers: Headers of the response it was downloaded with (for validators)
+    :param str digest: sha256 of the downloaded bytes (computed from the file if not provided)
+    :return: Ref to the cached object (as 'lookup' would return it)
+    :rtype: dict
+    """
+    digest = digest or file_digest(src_path)
+    obj_path = self.object_path(digest)
+
+    with self._index() as index:
+      if os.path.exists(obj_path):
+        # Same content as something already cached (e.g. another project's model).
+        _remove(src_path)
+      else:
+        os.rename(src_path, obj_path)
+
+      index['objects'][digest] = {'size': _disk_size(obj_path), 'kind': kind, 'last_used': time.time()}
+
+      ref = index['refs'][key] = {
+        'digest': digest,
+        'kind': kind,
+        'ext': ext,
+        'etag': _strong_etag(headers.get('ETag')),
+        'last_modified': headers.get('Last-Modified')
+      }
+
+      self._evict(index, keep=digest)
+
+    return ref
+
+  def place(self, ref, dest_path):
+    """
+    Put a cached object at the given path (replacing whatever's there), and mark it as recently used.
+
+    :param dict ref: Ref returned by 'lookup'
+    :param str dest_path: Path to place the file / tree at
+    """
+    obj_path = self.object_path(ref['digest'])
+
+    if ref['kind'] == 'tree':
+      link_tree(obj_path, dest_path, hardlink=False)
+    else:
+      upsert_parent_dirs(dest_path)
+      tmp_path = dest_path + '.st-tmp'
+      _remove(tmp_path)
+      clone_file(obj_path, tmp_path, hardlink=False)
+      os.replace(tmp_path, dest_path)
+
+    with self._index() as index:
+      if ref['digest'] in index['objects']:
+        index['objects'][ref['digest']]['last_used'] = time.time()
+
+  def object_path(self, digest):
+    return os.path.join(self.objects_dir, digest)
+
+  def staging_path(self, name):
+    """:return: Path inside the cache to download/extract into, so objects can be moved in with a rename."""
+    path = os.path.join(self.cache_dir, 'tmp', '{}-{}'.format(os.getpid(), name))
+    upsert_parent_dirs(path)
+    _remove(path)
+    return path
+
+  @staticmethod
+  def key(api_route, payload):
+    """:return: Key identifying a download by what it was requested with (project, model name, ...)"""
+    ident = json.dumps({'route': api_route, 'payload': payload}, sort_keys=True, default=str)
+    return hashlib.sha1(ident.encode('utf-8')).hexdigest()
+
+  @staticmethod
+  def conditional_headers(ref):
+    """:return: Headers asking the API to only send the download if it changed since 'ref' was cached"""
+    headers = {}
+
+    if ref.get('etag'):
+      headers['If-None-Match'] = ref['etag']
+
+    if ref.get('last_modified'):
+      headers['If-Modified-Since'] = ref['last_modified']
+
+    return headers
+
+  def _evict(self, index, keep=None):
+    """Remove least recently used objects until the cache fits within max_size."""
+    total = sum(obj['size'] for obj in index['objects'].values())
+
+    for digest, obj in sorted(index['objects'].items(), key=lambda item: item[1]['last_used']):
+      if total <= self.max_size:
+        break
+
+      if digest == keep:
+        continue
+
+      _remove(self.object_path(digest))
+      del index['objects'][digest]
+      total -= obj['size']
+
+    # Drop refs to evicted objects.
+    index['refs'] = {k: ref for k, ref in index['refs'].items() if ref['digest'] in index['objects']}
+
+  @contextmanager
+  def _index(self):
+    """Yield the index under the cache lock, writing it back afterwards."""
+    os.makedirs(self.objects_dir, exist_ok=True)
+
+    with open(self.lock_path, 'a') as lock:
+      if fcntl:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+      try:
+        with open(self.index_path) as f:
+          index = json.load(f)
+      except (IOError, OSError, ValueError):
+        index = {}
+
+      index.setdefault('objects', {})
+      index.setdefault('refs', {})
+
+      yield index
+
+      tmp_path = self.index_path + '.tmp'
+
+      with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+
+      os.replace(tmp_path, self.index_path)
+
+
+def _strong_etag(etag):
+  # Weak ETags can't vouch for byte-identical content.
+  return etag if etag and not etag.startswith('W/') else None
+
+
+def _disk_size(path):
+  return get_dir_size(path) if os.path.isdir(path) else os.path.getsize(path)
+
+
+def _remove(path):
+  if os.path.isdir(path) and not os.path.islink(path):
+    shutil.rmtree(path, ignore_errors=True)
+  elif os.path.lexists(path):
+    os.remove(path)
@@ -0,0 +1,445 @@
+"""
+Low-level zip archive writer, plus a pipeline that compresses archive members
+on a pool of threads.
+
+zipfile.ZipFile can only compress members one at a time on one core, and has no
+way to accept data that was already compressed elsewhere. ZipWriter writes the
+zip format directly so that compressed blocks produced by worker threads can be
+written into the archive in order.
+
+The output never needs to be seeked, so it can be a plain file or an unseekable
+stream. Deflated members are written with a trailing data descriptor (their CRC
+and sizes follow their data). Stored members and directories carry their CRC and
+sizes in the local header instead, since streaming readers (e.g. Java's
+ZipInputStream) can't find the end of stored data otherwise. Zip64 records are
+used whenever sizes, offsets or the entry count outgrow the classic format.
+
+In reproducible mode, members are written with a fixed timestamp and normalized
+permissions, so that (given members in a stable order) identical trees always
+produce byte-identical archives. Block splitting doesn't depend on the number of
+workers, so neither does the output.
+"""
+import os
+import stat as stat_mod
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+ZIP32_LIMIT = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+DEFAULT_COMPRESSION_LEVEL = 6
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+# Timestamp given to every member of a reproducible archive (the earliest a zip can express).
+REPRODUCIBLE_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# Deflate's window size -- each block is primed with this much of the previous block.
+DEFLATE_WINDOW = 32 * 1024
+
+# Extensions of formats that are already compressed, which are stored as-is.
+COMPRESSED_EXTS = {
+  '7z', 'avi', 'br', 'bz2', 'gif', 'gz', 'jpeg', 'jpg', 'lz4', 'lzma', 'mkv', 'mov', 'mp3', 'mp4',
+  'npz', 'parquet', 'png', 'rar', 'tgz', 'webm', 'webp', 'xz', 'zip', 'zst'
+}
+
+# Size of the sample used to probe a file's compressibility, and the ratio above which it's stored.
+PROBE_SIZE = 64 * 1024
+PROBE_MAX_RATIO = 0.95
+
+
+class ZipEntry(object):
+  """Bookkeeping for a single member written by ZipWriter (kept for the central directory, so kept small)."""
+  __slots__ = ('arcname', 'compress_type', 'date_time', 'mode', 'is_dir', 'zip64', 'header_offset',
+               'crc', 'compress_size', 'file_size', 'data_descriptor')
+
+  def __init__(self, arcname, compress_type, date_time, mode, is_dir, zip64, header_offset):
+    self.arcname = arcname
+    self.compress_type = compress_type
+    self.date_time = date_time
+    self.mode = mode
+    self.is_dir = is_dir
+    self.zip64 = zip64
+    self.header_offset = header_offset
+    self.crc = 0
+    self.compress_size = 0
+    self.file_size = 0
+    self.data_descriptor = True
+
+
+class ZipWriter(object):
+  """
+  Writes a zip archive to any object with a 'write' method.
+
+  Basic usage:
+
+    writer = ZipWriter(f)
+    entry = writer.start_member('path/in/archive', file_size, ZIP_DEFLATED, mode, date_time)
+    writer.write_member_data(entry, compressed_bytes)
+    writer.end_member(entry, crc, uncompressed_size)
+    writer.close()
+
+  """
+
+  def __init__(self, fp):
+    """
+    :param fp: Writable, binary file-like object (needn't be seekable)
+    """
+    self.fp = fp
+    self.offset = 0
+    self.entries = []
+
+  def _write(self, data):
+    self.fp.write(data)
+    self.offset += len(data)
+
+  def add_dir(self, arcname, mode=0o40755, date_time=None):
+    """Add an explicit directory entry."""
+    arcname = arcname.rstrip('/') + '/'
+    entry = ZipEntry(arcname, ZIP_STORED, date_time or time.localtime()[:6], mode, True, False, self.offset)
+    entry.data_descriptor = False
+    self._write_local_header(entry)
+    self.entries.append(entry)
+
+  def start_member(self, arcname, file_size, compress_type, mode, date_time, crc=None):
+    """
+    Start a new file member by writing its local header.
+
+    Stored members whose CRC is given up front get it (and their exact size) in the
+    local header, and no data descriptor.
+
+    :param str arcname: Path of member inside archive
+    :param int file_size: Expected uncompressed size (used to decide up front whether Zip64 is needed)
+    :param int compress_type: ZIP_STORED or ZIP_DEFLATED
+    :param int mode: st_mode of the source file
+    :param tuple date_time: (year, month, day, hour, minute, second)
+    :param int crc: CRC-32 of the member's data, if known (ZIP_STORED only)
+    :rtype: ZipEntry
+    """
+    if crc is not None and compress_type != ZIP_STORED:
+      raise ValueError('Only stored members can have their CRC in the local header')
+
+    # Leave headroom for deflate's (tiny) worst-case expansion of incompressible data.
+    zip64 = file_size * 1.05 >= ZIP32_LIMIT
+
+    entry = ZipEntry(arcname, compress_type, date_time, mode, False, zip64, self.offset)
+
+    if crc is not None:
+      entry.crc = crc
+      entry.file_size = file_size
+      entry.data_descriptor = False
+
+    self._write_local_header(entry)
+
+    return entry
+
+  def write_member_data(self, entry, data):
+    """Write (already compressed) data for the member currently being written."""
+    self._write(data)
+    entry.compress_size += len(data)
+
+  def end_member(self, entry, crc, file_size):
+    """Finish the member currently being written by writing its data descriptor (if it has one)."""
+    if not entry.data_descriptor:
+      # The local header already promised this CRC and size.
+      if (crc, file_size, entry.compress_size) != (entry.crc, entry.file_size, entry.file_size):
+        raise ValueError('"{}" changed while being archived'.format(entry.arcname))
+
+      self.entries.append(entry)
+      return
+
+    entry.crc = crc
+    entry.file_size = file_size
+
+    if not entry.zip64 and max(entry.compress_size, entry.file_size) >= ZIP32_LIMIT:
+      raise ValueError('"{}" outgrew its size estimate and needs Zip64'.format(entry.arcname))
+
+    self._write_data_descriptor(entry)
+    self.entries.append(entry)
+
+  def close(self):
+    """Write the central directory (and Zip64 end records when needed)."""
+    cd_offset = self.offset
+
+    for entry in self.entries:
+      self._write_central_header(entry)
+
+    cd_size = self.offset - cd_offset
+    count = len(self.entries)
+
+    if count >= ZIP_MAX_ENTRIES or cd_offset >= ZIP32_LIMIT or cd_size >= ZIP32_LIMIT:
+      zip64_eocd_offset = self.offset
+
+      # Zip64 end of central directory record + locator.
+      self._write(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, cd_size, cd_offset))
+      self._write(struct.pack('<IIQI', 0x07064b50, 0, zip64_eocd_offset, 1))
+
+    self._write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0,
+                            min(count, ZIP_MAX_ENTRIES), min(count, ZIP_MAX_ENTRIES),
+                            min(cd_size, ZIP32_LIMIT), min(cd_offset, ZIP32_LIMIT), 0))
+
+    if hasattr(self.fp, 'flush'):
+      self.fp.flush()
+
+  # --- Record encoding ---
+
+  @staticmethod
+  def _encode_name(entry):
+    try:
+      return entry.arcname.encode('ascii'), 0
+    except UnicodeEncodeError:
+      return entry.arcname.encode('utf-8'), FLAG_UTF8
+
+  @staticmethod
+  def _dos_date_time(date_time):
+    year, month, day, hour, minute, second = date_time[:6]
+    year = min(max(year, 1980), 2107)
+    return ((year - 1980) << 9) | (month << 5) | day, (hour << 11) | (minute << 5) | (second // 2)
+
+  def _write_local_header(self, entry):
+    name, name_flag = self._encode_name(entry)
+    dos_date, dos_time = self._dos_date_time(entry.date_time)
+
+    if entry.data_descriptor:
+      # Sizes live in the data descriptor, so the header's are zero (or, with Zip64, just announce 8-byte sizes).
+      flags, crc, size = FLAG_DATA_DESCRIPTOR | name_flag, 0, 0
+    else:
+      # Stored data, so both sizes are the same.
+      flags, crc, size = name_flag, entry.crc, entry.file_size
+
+    if entry.zip64:
+      extra = struct.pack('<HHQQ', 0x0001, 16, size, size)
+      size_field = ZIP32_LIMIT
+    else:
+      extra = b''
+      size_field = size
+
+    self._write(struct.pack('<IHHHHHIIIHH', 0x04034b50, 45 if entry.zip64 else 20, flags,
+                            entry.compress_type, dos_time, dos_date, crc, size_field, size_field,
+                            len(name), len(extra)))
+    self._write(name)
+    self._write(extra)
+
+  def _write_data_descriptor(self, entry):
+    if entry.zip64:
+      self._write(struct.pack('<IIQQ', 0x08074b50, entry.crc, entry.compress_size, entry.file_size))
+    else:
+      self._write(struct.pack('<IIII', 0x08074b50, entry.crc, entry.compress_size, entry.file_size))
+
+  def _write_central_header(self, entry):
+    name, name_flag = self._encode_name(entry)
+    dos_date, dos_time = self._dos_date_time(entry.date_time)
+    flags = (FLAG_DATA_DESCRIPTOR if entry.data_descriptor else 0) | name_flag
+
+    file_size, compress_size, header_offset = entry.file_size, entry.compress_size, entry.header_offset
+    zip64_fields = []
+
+    # Sizes of Zip64 members always go in the extra field, to match their local header.
+    if entry.zip64 or file_size >= ZIP32_LIMIT:
+      zip64_fields.append(file_size)
+      file_size = ZIP32_LIMIT
+
+    if entry.zip64 or compress_size >= ZIP32_LIMIT:
+      zip64_fields.append(compress_size)
+      compress_size = ZIP32_LIMIT
+
+    if header_offset >= ZIP32_LIMIT:
+      zip64_fields.append(header_offset)
+      header_offset = ZIP32_LIMIT
+
+    if zip64_fields:
+      extra = struct.pack('<HH', 0x0001, 8 * len(zip64_fields)) + struct.pack('<' + 'Q' * len(zip64_fields), *zip64_fields)
+      version = 45
+    else:
+      extra = b''
+      version = 20
+
+    external_attr = (entry.mode & 0xFFFF) << 16
+
+    if entry.is_dir:
+      external_attr |= 0x10
+
+    self._write(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version, flags,
+                            entry.compress_type, dos_time, dos_date, entry.crc, compress_size, file_size,
+                            len(name), len(extra), 0, 0, 0, external_attr, header_offset))
+    self._write(name)
+    self._write(extra)
+
+
+def is_compressible(path, sample):
+  """
+  Guess whether a file is worth deflating, first by extension, then by
+  test-compressing a sample of its first block.
+
+  :param str path: Path of file
+  :param bytes sample: The file's first bytes
+  :rtype: bool
+  """
+  if path.rsplit('.', 1)[-1].lower() in COMPRESSED_EXTS:
+    return False
+
+  sample = sample[:PROBE_SIZE]
+
+  if not sample:
+    return True
+
+  return len(zlib.compress(sample, 1)) < len(sample) * PROBE_MAX_RATIO
+
+
+def _deflate_block(data, level, zdict, last):
+  """
+  Compress one block of a member into raw deflate data.
+
+  Blocks that aren't last end with a sync flush (byte-aligned, not final), so the
+  outputs of consecutive blocks concatenate into one valid deflate stream. Priming
+  each block with the tail of the previous one keeps the ratio close to that of a
+  single-threaded compressor.
+  """
+  if zdict:
+    c = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+  else:
+    c = zlib.compressobj(level, zlib.DEFLATED, -15)
+
+  return c.compress(data) + c.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def reproducible_mode(st_mode):
+  """
+  :return: Normalized st_mode for a reproducible archive -- 0755 for directories and
+    executables, 0644 for everything else
+  :rtype: int
+  """
+  if stat_mod.S_ISDIR(st_mode):
+    return stat_mod.S_IFDIR | 0o755
+
+  return stat_mod.S_IFREG | (0o755 if st_mode & 0o111 else 0o644)
+
+
+def write_members(writer, members, compression_level=DEFAULT_COMPRESSION_LEVEL, workers=None,
+                  block_size=DEFAULT_BLOCK_SIZE, on_read=None, reproducible=False):
+  """
+  Compress members on a pool of threads and write them into a ZipWriter in order.
+
+  Files are split into blocks that are deflated concurrently (within and across
+  files), with at most a few blocks per worker in flight, so memory stays bounded
+  no matter how large the files are. Already-compressed files are stored as-is.
+
+  This is a generator that yields after each write, so callers streaming the
+  archive can drain their output in between.
+
+  :param ZipWriter writer: Archive to write into
+  :param members: Iterable of (path, arcname, stat_result) -- directories are added as directory entries
+  :param int compression_level: zlib level 0-9 (0 stores every file)
+  :param int workers: Number of compression threads (default: number of CPUs)
+  :param int block_size: Size of each independently compressed block
+  :param function on_read: Called with the number of source bytes read, for progress display
+  :param bool reproducible: Whether to normalize timestamps and permissions (see module docs)
+  """
+  workers = workers or os.cpu_count() or 1
+  executor = ThreadPoolExecutor(max_workers=workers)
+  window = deque()
+
+  try:
+    for kind, member, payload in _read_jobs(members, compression_level, block_size, on_read, reproducible):
+      # Deflate blocks on the pool; everything else is already "done".
+      if kind == 'deflate':
+        future = executor.submit(_deflate_block, *payload)
+      else:
+        future = Future()
+        future.set_result(payload)
+
+      window.append((kind, member, future))
+
+      # Keep the number of in-flight blocks bounded.
+      while len(window) > workers * 4:
+        _write_job(writer, *window.popleft())
+        yield
+
+    while window:
+      _write_job(writer, *window.popleft())
+      yield
+  finally:
+    executor.shutdown(cancel_futures=True)
+
+
+def _write_job(writer, kind, member, future):
+  if kind == 'dir':
+    writer.add_dir(*future.result())
+  elif kind == 'start':
+    member['entry'] = writer.start_member(*future.result())
+  elif kind in ('deflate', 'store'):
+    writer.write_member_data(member['entry'], future.result())
+  elif kind == 'end':
+    writer.end_member(member['entry'], *future.result())
+
+
+def _read_jobs(members, compression_level, block_size, on_read, reproducible=False):
+  """
+  Read members in order, producing (kind, member, payload) jobs, where kind is one of
+  'dir', 'start', 'deflate', 'store' or 'end'. The CRC of each file is computed here,
+  in order, as its blocks are read. Stored files are read twice: once for the CRC
+  and size that go in their local header, then again to copy them.
+  """
+  for path, arcname, st in members:
+    if reproducible:
+      date_time, mode = REPRODUCIBLE_DATE_TIME, reproducible_mode(st.st_mode)
+    else:
+      date_time, mode = time.localtime(st.st_mtime)[:6], st.st_mode
+
+    if stat_mod.S_ISDIR(st.st_mode):
+      yield 'dir', None, (arcname, mode, date_time)
+      continue
+
+    with open(path, 'rb') as f:
+      block = f.read(block_size)
+      deflate = compression_level > 0 and is_compressible(path, block)
+
+      # Shared between this file's jobs -- 'entry' is filled in once its header is written.
+      member = {}
+
+      if deflate:
+        yield 'start', member, (arcname, st.st_size, ZIP_DEFLATED, mode, date_time)
+      else:
+        crc, size = zlib.crc32(block), len(block)
+
+        for chunk in iter(lambda: f.read(block_size), b''):
+          crc = zlib.crc32(chunk, crc)
+          size += len(chunk)
+
+        f.seek(len(block))
+
+        yield 'start', member, (arcname, size, ZIP_STORED, mode, date_time, crc)
+
+      crc, size, prev = 0, 0, None
+
+      while True:
+        next_block = f.read(block_size) if block else b''
+        last = not next_block
+
+        crc = zlib.crc32(block, crc)
+        size += len(block)
+
+        if on_read and block:
+          on_read(len(block))
+
+        if deflate:
+          zdict = prev[-DEFLATE_WINDOW:] if prev else None
+          yield 'deflate', member, (block, compression_level, zdict, last)
+        elif block:
+          yield 'store', member, block
+
+        if last:
+          break
+
+        prev, block = block, next_block
+
+      yield 'end', member, (crc, size)
@@ -0,0 +1,188 @@
+"""
+Incremental parsing of large JSON responses, one array item at a time
+"""
+import codecs
+import json
+
+WHITESPACE = ' \t\n\r'
+
+# Characters that can continue a number.
+NUMBER_CHARS = '0123456789.eE+-'
+
+
+class JsonItemStream(object):
+  """
+  Iterates over the items of an array inside a JSON document as the document is
+  read from a byte stream, so only the item being parsed (never the whole
+  document) is held in memory.
+
+  The array is found by following 'path', a dot-separated list of object keys
+  from the top of the document (e.g. 'logs' for {"logs": [...]}, or None for a
+  top-level array). No items are yielded if there's nothing (or null) at 'path'.
+
+  The document's other top-level members (e.g. a pagination cursor) are parsed
+  as they're passed and kept in 'fields' -- ones before the array are there by
+  the time its first item is yielded, and the rest once iteration finishes.
+
+    items = JsonItemStream(resp.raw, path='logs')
+
+    for line in items:
+      print(line)
+
+    items.fields  # {'next_cursor': '...'}
+  """
+
+  def __init__(self, raw, path=None, read_size=64 * 1024):
+    """
+    :param raw: Binary stream of the JSON document (e.g. a streamed response's urllib3 'raw')
+    :param str path: Dot-separated keys leading to the array (None for a top-level array)
+    :param int read_size: Max bytes per read
+    """
+    self.raw = raw
+    self.keys = path.split('.') if path else []
+    self.read_size = read_size
+    self.fields = {}
+    self._read = getattr(raw, 'read1', None) or raw.read
+    self._decoder = codecs.getincrementaldecoder('utf-8')()
+    self._json = json.JSONDecoder()
+    self._buf = ''
+    self._pos = 0
+    self._eof = False
+
+  def __iter__(self):
+    yield from self._iter_at(self.keys, top=True)
+
+    if self._peek():
+      self._error('Extra data')
+
+  def _iter_at(self, keys, top=False):
+    """
+    Yield the items of the array at 'keys' below the value starting at the current position,
+    consuming that whole value.
+    """
+    c = self._peek()
+
+    if not keys:
+      if c != '[':
+        # Nothing to iterate over (e.g. null).
+        self._value()
+        return
+
+      self._pos += 1
+
+      if self._peek() == ']':
+        self._pos += 1
+        return
+
+      while True:
+        yield self._value()
+
+        if not self._next_member(']'):
+          return
+
+    if c != '{':
+      self._value()
+      return
+
+    self._pos += 1
+
+    if self._peek() == '}':
+      self._pos += 1
+      return
+
+    found = False
+
+    while True:
+      key = self._value()
+
+      if not isinstance(key, str) or self._peek() != ':':
+        self._error('Expecting property name and \':\'')
+
+      self._pos += 1
+      self._peek()
+
+      if key == keys[0] and not found:
+        found = True
+        yield from self._iter_at(keys[1:])
+      elif top:
+        self.fields[key] = self._value()
+      else:
+        self._value()
+
+      if not self._next_member('}'):
+        return
+
+  def _next_member(self, closer):
+    """
+    Consume the ',' before the next member of an array or object, or its closing bracket.
+
+    :return: Whether there's another member
+    :rtype: bool
+    """
+    c = self._peek()
+    self._pos += 1
+
+    if c == ',':
+      self._peek()
+      return True
+
+    if c == closer:
+      return False
+
+    self._error('Expecting \',\' or \'{}\''.format(closer))
+
+  def _value(self):
+    """
+    Parse the JSON value starting at the current position.
+
+    Values are only accepted once something that can't continue them follows in
+    the buffer (or the stream has ended), so a number isn't cut short at the end
+    of a read.
+    """
+    while True:
+      try:
+        value, end = self._json.raw_decode(self._buf, self._pos)
+
+        if self._eof or (end < len(self._buf) and self._buf[end] not in NUMBER_CHARS):
+          self._pos = end
+          return value
+      except json.JSONDecodeError:
+        if self._eof:
+          raise
+
+      # Incomplete so far: read at least as much again as is buffered, so a large
+      # value is re-parsed a logarithmic (not linear) number of times.
+      self._fill(max(self.read_size, len(self._buf) - self._pos))
+
+  def _peek(self):
+    """
+    Skip whitespace, returning the next character ('' at the end of the document).
+    """
+    while True:
+      while self._pos < len(self._buf) and self._buf[self._pos] in WHITESPACE:
+        self._pos += 1
+
+      if self._pos < len(self._buf) or self._eof:
+        return self._buf[self._pos:self._pos + 1]
+
+      self._fill(1)
+
+  def _fill(self, min_chars):
+    # Drop what's been parsed already.
+    if self._pos:
+      self._buf = self._buf[self._pos:]
+      self._pos = 0
+
+    target = len(self._buf) + min_chars
+
+    while len(self._buf) < target and not self._eof:
+      data = self._read(self.read_size)
+
+      if data:
+        self._buf += self._decoder.decode(data)
+      else:
+        self._buf += self._decoder.decode(b'', final=True)
+        self._eof = True
+
+  def _error(self, msg):
+    raise json.JSONDecodeError(msg, self._buf, self._pos)
@@ -0,0 +1,57 @@
+"""
+Click group that defers importing its commands until they're actually used
+"""
+import click
+from importlib import import_module
+
+
+class LazyGroup(click.Group):
+  """
+  Click group whose commands are registered by import path rather than by object.
+
+  A command's module is only imported when that command is resolved (i.e. invoked,
+  or listed inside a help message), so running one command never pays the import
+  cost of all the others.
+
+  Basic usage:
+
+    @click.group(cls=LazyGroup, lazy_commands={'deploy': 'sweettea.resources.deploy:create'})
+    def create():
+      pass
+
+  """
+
+  def __init__(self, *args, **kwargs):
+    """
+    :param dict lazy_commands:
+      Map of command name --> 'module.path:attribute' import path of the command
+    """
+    self.lazy_commands = dict(kwargs.pop('lazy_commands', None) or {})
+    super(LazyGroup, self).__init__(*args, **kwargs)
+
+  def list_commands(self, ctx):
+    """List both eagerly-added and lazily-registered command names, sorted"""
+    return sorted(set(super(LazyGroup, self).list_commands(ctx)) | set(self.lazy_commands))
+
+  def get_command(self, ctx, cmd_name):
+    """Resolve a command by name, importing its module first if it was registered lazily"""
+    if cmd_name in self.lazy_commands and cmd_name not in self.commands:
+      self.add_command(self._load(cmd_name), name=cmd_name)
+
+    return super(LazyGroup, self).get_command(ctx, cmd_name)
+
+  def _load(self, cmd_name):
+    """
+    Import the command registered under the given name.
+
+    :param str cmd_name: Name of lazily-registered command
+    :return: The imported command
+    :rtype: click.Command
+    """
+    mod_path, attr = self.lazy_commands[cmd_name].split(':', 1)
+    cmd = getattr(import_module(mod_path), attr)
+
+    if not isinstance(cmd, click.Command):
+      raise TypeError('Lazy command "{}" resolved to a non-command object: {}'.format(cmd_name, cmd))
+
+    return cmd
@@ -0,0 +1,346 @@
+"""
+Local, indexed archive of train job logs, so past logs can be searched without the API.
+"""
+import gzip
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from sweettea.definitions import log_archive_dir
+from sweettea.utils.log_filter import LogFilter, format_timestamp, line_timestamp, parse_timestamp
+from sweettea.utils.log_stream import log_offset
+
+try:
+  import fcntl
+except ImportError:
+  # No cross-process locking on platforms without fcntl (Windows).
+  fcntl = None
+
+# Response header naming the train job a log belongs to.
+TRAIN_JOB_HEADER = 'X-Train-Job-Id'
+
+# Query param pinning a log request to one train job (rather than the project's latest).
+TRAIN_JOB_PARAM = 'train_job_id'
+
+
+class LogArchive(object):
+  """
+  Append-only archive of one train job's log, as gzip-compressed segment files.
+
+  Layout (inside 'path'):
+
+    <offset>.log.gz   A segment: lines from offset <offset> of the log onwards, one
+                      gzip member per flush (so appending never rewrites anything)
+    index.json        Each segment's first offset, line count, size in bytes, and the
+                      first and last timestamps of its lines
+    lock              Held by the (single) process writing to the archive
+
+  Lines are placed by their offset in the job's log (see log_stream.LOG_OFFSET_HEADER),
+  so lines that are already archived are skipped, and lines that don't follow on from
+  a segment (e.g. the start of a log fetched with --tail earlier) start a new one.
+  The index is only rewritten (atomically) after the segment data it describes is on
+  disk, and anything past a segment's indexed size is ignored, so a crash mid-write
+  never leaves the archive unreadable.
+
+  Searching (see 'search') skips segments entirely before --since, and decompresses
+  and filters the rest on a pool of threads.
+  """
+
+  def __init__(self, path, segment_lines=100000, flush_lines=10000):
+    """
+    :param str path: Directory of the archive
+    :param int segment_lines: Lines per segment before starting a new one
+    :param int flush_lines: Lines to buffer before compressing them onto the current segment
+    """
+    self.path = path
+    self.segment_lines = segment_lines
+    self.flush_lines = flush_lines
+    self.index_path = os.path.join(path, 'index.json')
+    self.segments = self._load_index()
+    self.buffer = []
+    self.buffer_offset = None
+    self.lock = None
+
+  def open_for_writing(self):
+    """
+    Take the archive's write lock.
+
+    :return: Whether the lock was taken (False if another process is writing to the archive)
+    :rtype: bool
+    """
+    os.makedirs(self.path, exist_ok=True)
+    self.lock = open(os.path.join(self.path, 'lock'), 'a')
+
+    if fcntl:
+      try:
+        fcntl.flock(self.lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except (IOError, OSError):
+        self.lock.close()
+        self.lock = None
+        return False
+
+    # Another process may have written since the index was loaded.
+    self.segments = self._load_index()
+    return True
+
+  def append(self, offset, lines):
+    """
+    Archive lines of the log.
+
+    :param int offset: Offset in the log of the first line
+    :param list(str) lines: Lines of the log
+    """
+    while lines:
+      # Skip lines that are already archived.
+      segment = self._segment_at(offset)
+
+      if segment:
+        skip = segment['offset'] + segment['count'] - offset
+        lines, offset = lines[skip:], offset + skip
+        continue
+
+      # Take lines up to the next archived ones.
+      next_offset = min((s['offset'] for s in self.segments if s['offset'] > offset), default=None)
+      take = len(lines) if next_offset is None else min(len(lines), next_offset - offset)
+
+      if self.buffer and self.buffer_offset + len(self.buffer) != offset:
+        self.flush()
+
+      if not self.buffer:
+        self.buffer_offset = offset
+
+      self.buffer.extend(lines[:take])
+      lines, offset = lines[take:], offset + take
+
+      if len(self.buffer) >= self.flush_lines:
+        self.flush()
+
+  def tee(self, lines, offset, batch_size=1000):
+    """
+    Archive lines of the log while passing them on.
+
+    :param lines: Lines of the log
+      :type: iterable(str)
+    :param int offset: Offset in the log of the first line
+    :param int batch_size: Lines to archive at a time
+    :return: Generator of the lines
+    """
+    batch = []
+
+    for line in lines:
+      batch.append(line)
+      yield line
+
+      if len(batch) >= batch_size:
+        self.append(offset, batch)
+        offset += len(batch)
+        batch = []
+
+    self.append(offset, batch)
+
+  def flush(self):
+    """Compress buffered lines onto the segment they follow on from (or a new one)."""
+    if not self.buffer:
+      return
+
+    lines, offset = self.buffer, self.buffer_offset
+    self.buffer, self.buffer_offset = [], None
+
+    # Carry on the segment the lines follow on from, unless it's full.
+    segment = next((s for s in self.segments if s['offset'] + s['count'] == offset), None)
+
+    if not segment or segment['count'] >= self.segment_lines:
+      segment = {'file': '{:012d}.log.gz'.format(offset), 'offset': offset, 'count': 0, 'size': 0,
+                 'first_ts': None, 'last_ts': None}
+      self.segments.append(segment)
+      self.segments.sort(key=lambda s: s['offset'])
+
+    data = gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'), mtime=0)
+    segment_path = os.path.join(self.path, segment['file'])
+
+    with open(segment_path, 'r+b' if os.path.exists(segment_path) else 'wb') as f:
+      # Drop anything a crashed writer left past the indexed size.
+      f.truncate(segment['size'])
+      f.seek(segment['size'])
+      f.write(data)
+
+    segment['size'] += len(data)
+    segment['count'] += len(lines)
+    segment['first_ts'] = segment['first_ts'] or _first_timestamp(lines)
+    segment['last_ts'] = _first_timestamp(reversed(lines)) or segment['last_ts']
+
+    self._save_index()
+
+  def close(self):
+    self.flush()
+
+    if self.lock:
+      self.lock.close()
+      self.lock = None
+
+  def search(self, log_filter, workers=None):
+    """
+    Search the archived log.
+
+    Segments whose lines all come before 'log_filter.since' are skipped, as are
+    segments before the last 'log_filter.tail' lines when that's the only filter.
+    The rest are decompressed and filtered on 'workers' threads (decompression
+    releases the GIL), a bounded number of segments ahead of the consumer.
+
+    :param log_filter: Filters to apply
+      :type: sweettea.utils.log_filter.LogFilter
+    :param int workers: Number of threads (default=number of CPUs)
+    :return: Generator of the matching lines, in order
+    """
+    segments = self.segments
+    since = log_filter.since
+
+    if since is not None:
+      segments = [s for s in segments if not s['last_ts'] or parse_timestamp(s['last_ts']) >= since]
+
+    if log_filter.tail is not None and since is None and log_filter.regex is None:
+      segments = _last_segments(segments, log_filter.tail)
+
+    workers = workers or os.cpu_count() or 1
+    matches = self._iter_matches(segments, since, log_filter.pattern, workers)
+
+    if log_filter.tail is None:
+      return matches
+
+    # Only ever holds the last 'tail' lines.
+    return iter(deque(matches, maxlen=log_filter.tail))
+
+  def _iter_matches(self, segments, since, pattern, workers):
+    executor = ThreadPoolExecutor(max_workers=workers)
+    window = deque()
+
+    try:
+      for segment in segments:
+        # Segments starting from 'since' onwards need no time filtering.
+        first_ts = segment['first_ts'] and parse_timestamp(segment['first_ts'])
+        segment_since = since if since is not None and (not first_ts or first_ts < since) else None
+
+        window.append(executor.submit(self._search_segment, segment, segment_since, pattern))
+
+        if len(window) > workers * 2:
+          yield from window.popleft().result()
+
+      while window:
+        yield from window.popleft().result()
+    finally:
+      executor.shutdown(cancel_futures=True)
+
+  def _search_segment(self, segment, since, pattern):
+    with open(os.path.join(self.path, segment['file']), 'rb') as f:
+      data = f.read(segment['size'])
+
+    lines = gzip.decompress(data).decode('utf-8', 'replace').split('\n')[:-1]
+    return LogFilter(since=since, pattern=pattern).filter(lines)
+
+  def _segment_at(self, offset):
+    for segment in self.segments:
+      if segment['offset'] <= offset < segment['offset'] + segment['count']:
+        return segment
+
+    return None
+
+  def _load_index(self):
+    try:
+      with open(self.index_path) as f:
+        return json.load(f).get('segments') or []
+    except (IOError, OSError, ValueError):
+      return []
+
+  def _save_index(self):
+    tmp_path = self.index_path + '.tmp'
+
+    with open(tmp_path, 'w') as f:
+      json.dump({'segments': self.segments}, f)
+
+    os.replace(tmp_path, self.index_path)
+
+
+def project_archive_dir(project_nsp):
+  """
+  :param str project_nsp: Project namespace (e.g. 'my-team/my-project')
+  :return: Directory holding the log archives of a project's train jobs
+  :rtype: str
+  """
+  return os.path.join(log_archive_dir, quote(project_nsp, safe=''))
+
+
+def open_log_archive(project_nsp, headers):
+  """
+  Open the archive to keep a log response's lines in, if they can be placed in it.
+
+  :param str project_nsp: Project namespace
+  :param dict headers: Response headers of the log
+  :return: Archive ready for writing, or None if the response has no log offset (e.g.
+    grep'ed by the API) or train job id, or another process is writing to the archive
+  :rtype: LogArchive
+  """
+  job = train_job_id(headers)
+
+  # Without a job id, lines can't be told apart from another job's at the same offsets.
+  if log_offset(headers) is None or not job:
+    return None
+
+  archive = LogArchive(os.path.join(project_archive_dir(project_nsp), quote(job, safe='')))
+
+  return archive if archive.open_for_writing() else None
+
+
+def train_job_id(headers):
+  """
+  :param dict headers: Response headers of a log
+  :return: Id of the train job the log belongs to (None if the API didn't say)
+  :rtype: str
+  """
+  return headers.get(TRAIN_JOB_HEADER) or None
+
+
+def latest_log_archive(project_nsp):
+  """
+  :param str project_nsp: Project namespace
+  :return: Archive of the project's most recently archived train job (None if there isn't one)
+  :rtype: LogArchive
+  """
+  project_dir = project_archive_dir(project_nsp)
+
+  try:
+    indexes = [os.path.join(project_dir, name, 'index.json') for name in os.listdir(project_dir)]
+  except (IOError, OSError):
+    return None
+
+  indexes = [path for path in indexes if os.path.exists(path)]
+
+  if not indexes:
+    return None
+
+  return LogArchive(os.path.dirname(max(indexes, key=os.path.getmtime)))
+
+
+def _first_timestamp(lines):
+  for line in lines:
+    ts = line_timestamp(line)
+
+    if ts is not None:
+      return format_timestamp(ts)
+
+  return None
+
+
+def _last_segments(segments, count):
+  """
+  :return: The fewest segments from the end that hold at least 'count' lines
+  """
+  total = 0
+
+  for i in range(len(segments) - 1, -1, -1):
+    total += segments[i]['count']
+
+    if total >= count:
+      return segments[i:]
+
+  return segments
@@ -0,0 +1,219 @@
+"""
+Filtering of train job logs by time (--since), content (--grep) and count (--tail).
+
+Filters are sent to the API as query params, and the API lists the ones it
+applied in its 'X-Log-Filters' response header. Whatever it didn't apply
+(e.g. an older API) is done here instead, a line at a time, so filtering never
+needs the whole log in memory.
+"""
+import re
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+# Response header listing the filters the API applied itself (comma-separated).
+APPLIED_FILTERS_HEADER = 'X-Log-Filters'
+
+# Seconds per unit of a --since duration (e.g. '90s', '15m', '1h30m', '2d').
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+DURATION_RE = re.compile(r'(?:\d+(?:\.\d+)?[smhdw])+')
+DURATION_PART_RE = re.compile(r'(\d+(?:\.\d+)?)([smhdw])')
+
+# ISO 8601 timestamp at the start of a log line (optionally in brackets).
+LINE_TIMESTAMP_RE = re.compile(r'\s*\[?(\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:[Zz]|[+-]\d{2}:?\d{2})?)')
+
+
+def parse_timestamp(value):
+  """
+  Parse an ISO 8601 date or timestamp, treating ones without a UTC offset as UTC.
+
+  :param str value: Timestamp (e.g. '2018-06-01', '2018-06-01T12:00:00Z', '2018-06-01 12:00:00.123+02:00')
+  :return: Timezone-aware datetime (None if 'value' isn't a timestamp)
+  :rtype: datetime.datetime
+  """
+  value = value.strip().replace(',', '.')
+
+  if value[-1:] in ('Z', 'z'):
+    value = value[:-1] + '+00:00'
+
+  # datetime only goes down to microseconds.
+  value = re.sub(r'(\.\d{6})\d+', r'\1', value)
+
+  try:
+    ts = datetime.fromisoformat(value)
+  except ValueError:
+    return None
+
+  return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def parse_since(value, now=None):
+  """
+  Parse a --since value: either a timestamp, or a duration counting back from now.
+
+  :param str value: Timestamp (see parse_timestamp) or duration (e.g. '90s', '15m', '1h30m', '2d', '1w')
+  :param datetime.datetime now: Time durations count back from (default=now)
+  :return: Timezone-aware datetime
+  :rtype: datetime.datetime
+  :raises ValueError: If 'value' is neither
+  """
+  value = value.strip()
+
+  if DURATION_RE.fullmatch(value):
+    seconds = sum(float(n) * DURATION_UNITS[unit] for n, unit in DURATION_PART_RE.findall(value))
+    return (now or datetime.now(timezone.utc)) - timedelta(seconds=seconds)
+
+  ts = parse_timestamp(value) if value else None
+
+  if not ts:
+    raise ValueError('Invalid --since value "{}": expected a timestamp (e.g. 2018-06-01T12:00:00Z) '
+                     'or a duration (e.g. 15m, 1h30m, 2d).'.format(value))
+
+  return ts
+
+
+def format_timestamp(ts):
+  """
+  :param datetime.datetime ts: Timezone-aware datetime
+  :return: UTC ISO 8601 timestamp (e.g. '2018-06-01T12:00:00.000000Z')
+  :rtype: str
+  """
+  return ts.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def line_timestamp(line):
+  """
+  :param str line: Log line
+  :return: Timestamp the line starts with (None if it doesn't start with one)
+  :rtype: datetime.datetime
+  """
+  match = LINE_TIMESTAMP_RE.match(line)
+  return parse_timestamp(match.group(1)) if match else None
+
+
+def applied_filters(headers):
+  """
+  :param dict headers: Response headers
+  :return: Names of the filters the API applied itself
+  :rtype: set(str)
+  """
+  value = headers.get(APPLIED_FILTERS_HEADER) or ''
+  return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class LogFilter(object):
+  """
+  Filters log lines to those from 'since' onwards that match 'pattern', keeping only the last 'tail'.
+
+  Logs are in time order, so lines are only checked for a timestamp until the
+  first one from 'since' onwards; lines without a timestamp of their own (e.g.
+  the rest of a traceback) go with the line before them. Matching by pattern is
+  a re.search of each line.
+  """
+
+  def __init__(self, since=None, pattern=None, tail=None):
+    """
+    :param datetime.datetime since: Earliest time to show lines from
+    :param str pattern: Regular expression lines must contain a match for
+    :param int tail: Number of lines to show from the end of the log
+    :raises ValueError: If 'pattern' isn't a valid regular expression, or 'tail' is negative
+    """
+    if tail is not None and tail < 0:
+      raise ValueError('Invalid --tail value {}: must be 0 or more.'.format(tail))
+
+    try:
+      self.regex = re.compile(pattern) if pattern is not None else None
+    except re.error as e:
+      raise ValueError('Invalid --grep pattern "{}": {}.'.format(pattern, e))
+
+    self.since = since
+    self.pattern = pattern
+    self.tail = tail
+    self.reached_since = since is None
+
+  @property
+  def active(self):
+    return self.since is not None or self.regex is not None or self.tail is not None
+
+  def query_params(self, exclude=()):
+    """
+    :param tuple(str) exclude: Names of filters not to ask for (e.g. to do them here instead)
+    :return: Query params asking the API to apply these filters
+    :rtype: dict
+    """
+    params = {}
+
+    if self.since is not None:
+      params['since'] = format_timestamp(self.since)
+
+    if self.pattern is not None:
+      params['grep'] = self.pattern
+
+    if self.tail is not None:
+      params['tail'] = self.tail
+
+    return {k: v for k, v in params.items() if k not in exclude}
+
+  def without(self, applied):
+    """
+    :param set(str) applied: Names of filters already applied (see applied_filters)
+    :return: A filter doing only the rest
+    :rtype: LogFilter
+    """
+    return LogFilter(since=None if 'since' in applied else self.since,
+                     pattern=None if 'grep' in applied else self.pattern,
+                     tail=None if 'tail' in applied else self.tail)
+
+  def filter(self, lines):
+    """
+    Filter the next batch of lines of a log by 'since' and 'pattern' (not 'tail',
+    which needs the end of the log).
+
+    :param list(str) lines: Next lines of the log
+    :return: The lines that pass
+    :rtype: list(str)
+    """
+    if not self.reached_since:
+      for i, line in enumerate(lines):
+        ts = line_timestamp(line)
+
+        if ts is not None and ts >= self.since:
+          self.reached_since = True
+          lines = lines[i:]
+          break
+      else:
+        return []
+
+    if self.regex is not None:
+      search = self.regex.search
+      lines = [line for line in lines if search(line)]
+
+    return lines
+
+  def apply(self, lines, batch_size=1000):
+    """
+    Filter a whole log.
+
+    :param lines: Lines of the log
+      :type: iterable(str)
+    :param int batch_size: Lines to filter at a time
+    :return: Generator of the lines that pass
+    """
+    passed = self._iter_filtered(lines, batch_size)
+
+    if self.tail is None:
+      return passed
+
+    # Only ever holds the last 'tail' lines.
+    return iter(deque(passed, maxlen=self.tail))
+
+  def _iter_filtered(self, lines, batch_size):
+    batch = []
+
+    for line in lines:
+      batch.append(line)
+
+      if len(batch) >= batch_size:
+        yield from self.filter(batch)
+        batch = []
+
+    yield from self.filter(batch)
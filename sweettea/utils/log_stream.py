@@ -0,0 +1,107 @@
+"""
+Helpers for reading and printing line-oriented log streams quickly
+"""
+import codecs
+import random
+import time
+
+# Characters str.splitlines() breaks lines on.
+LINE_BREAKS = frozenset('\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029')
+
+# Response header giving the offset (in lines) in the whole log of a log stream's first line.
+LOG_OFFSET_HEADER = 'X-Log-Offset'
+
+
+def iter_line_batches(raw, read_size=64 * 1024, newline=None):
+  """
+  Read a byte stream in large reads, yielding the complete lines of each read as one batch.
+
+  Reads return whatever has arrived (up to 'read_size' bytes) rather than waiting
+  for a full buffer, and bytes are decoded as UTF-8 incrementally, so multi-byte
+  characters split across reads come out whole (invalid bytes become U+FFFD).
+  Lines are split like str.splitlines() -- or only on 'newline', so the lines
+  counted are exactly the ones the server sent -- and an unterminated last line
+  is yielded once the stream ends.
+
+  :param raw: Binary stream (e.g. a streamed response's urllib3 'raw')
+  :param int read_size: Max bytes per read
+  :param str newline: Only line break to split on (default: any of LINE_BREAKS)
+  :return: Generator of (list of lines, whether the read drained the stream's available data)
+  """
+  decoder = codecs.getincrementaldecoder('utf-8')('replace')
+  read = getattr(raw, 'read1', None) or raw.read
+  pending = ''
+
+  while True:
+    data = read(read_size)
+
+    if not data:
+      break
+
+    text = pending + decoder.decode(data)
+
+    # Hold back a trailing partial line until the rest of it arrives.
+    if newline:
+      lines = text.split(newline)
+      pending = lines.pop()
+    else:
+      lines = text.splitlines()
+      pending = lines.pop() if lines and text[-1] not in LINE_BREAKS else ''
+
+    yield lines, len(data) < read_size
+
+  pending += decoder.decode(b'', final=True)
+
+  if pending:
+    yield [pending], True
+
+
+def log_offset(headers):
+  """
+  :param dict headers: Response headers of a log stream
+  :return: Offset (in lines) of the stream's first line in the whole log (None if the API didn't give one)
+  :rtype: int
+  """
+  value = headers.get(LOG_OFFSET_HEADER)
+  return int(value) if value and value.isdigit() else None
+
+
+def backoff_delay(attempt, base=0.5, cap=30):
+  """
+  Seconds to wait before retry number 'attempt' (from 0): exponential backoff,
+  with jitter so that many clients dropped at once don't all reconnect at once.
+
+  :rtype: float
+  """
+  return min(base * 2 ** attempt, cap) * random.uniform(0.5, 1)
+
+
+class LineWriter(object):
+  """
+  Writes batches of lines to a text stream, flushing at most every 'flush_interval'
+  seconds while output keeps coming -- and right away when asked to (e.g. once
+  there's nothing more to read for now), so output is never held back while idle.
+  """
+
+  def __init__(self, out, flush_interval=0.1):
+    """
+    :param out: Text stream to write to
+    :param float flush_interval: Max seconds written lines may sit unflushed while more are arriving
+    """
+    self.out = out
+    self.flush_interval = flush_interval
+    self.last_flush = time.monotonic()
+    self.unflushed = False
+
+  def write(self, lines, flush=False):
+    if lines:
+      self.out.write('\n'.join(lines) + '\n')
+      self.unflushed = True
+
+    if self.unflushed and (flush or time.monotonic() - self.last_flush >= self.flush_interval):
+      self.flush()
+
+  def flush(self):
+    self.out.flush()
+    self.last_flush = time.monotonic()
+    self.unflushed = False
@@ -0,0 +1,474 @@
+"""
+Caching HTTP mirror of the SweetTea API's model downloads, for serving a fleet of machines on a LAN
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from sweettea.definitions import auth_header_name
+from sweettea.utils.abstract_api import AbstractApi
+from sweettea.utils.file_utils import upsert_parent_dirs
+from sweettea.utils.file_utils.file_downloader import IDENTITY_ENCODING
+
+# Response headers of a model download that the mirror stores and replays.
+STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Sweet-Tea-File-Type')
+
+# Request headers that pick which object is served (on top of the route and query).
+VARY_HEADERS = ('Sweet-Tea-File-Type',)
+
+
+class ModelMirror(object):
+  """
+  Keeps model downloads from an upstream API in an on-disk store and serves them
+  (Range requests included) to clients on the local network, so that a fleet
+  rolling out the same model pulls it over the upstream link only once. The
+  routes under the mirrored one (e.g. /model/manifest, /model/recipe and
+  /model/blobs, used by --sync and --cdc downloads) are mirrored the same way.
+
+  Objects are evicted least-recently-used first once the store outgrows 'max_size'
+  (responses already being sent keep reading the object they opened).
+
+  Concurrent requests for the same object share a single upstream download:
+  the first one fetches it while the rest wait for it to land. A stored object
+  is only served to a client whose auth header the API accepted for it within
+  the last 'ttl' seconds -- otherwise it's revalidated upstream with a
+  conditional request (If-None-Match) made with the client's auth header, so
+  only clients the API accepts are served.
+
+  Basic usage:
+
+    mirror = ModelMirror(upstream_url, store_dir)
+    mirror.serve('0.0.0.0', 8700)  # blocks
+
+    $ MIRROR_URL=http://mirror-host:8700 st download model ...
+
+  """
+
+  def __init__(self, upstream_url, store_dir, route='/model', ttl=60, chunk_size=1024 * 1024, max_size=None):
+    """
+    :param str upstream_url: Base url of the upstream API
+    :param str store_dir: Directory to keep downloaded objects in
+    :param str route: Route of the upstream API to mirror (along with the routes under it)
+    :param int ttl: Seconds a client's access to a stored object is trusted before being revalidated upstream
+    :param int chunk_size: Size of each read/write when copying bodies (in bytes)
+    :param int max_size: Size (in bytes) past which least recently used objects are evicted (None = no limit)
+    """
+    self.upstream = AbstractApi(base_url=upstream_url, pool_maxsize=32)
+    self.store_dir = store_dir
+    self.route = route.rstrip('/')
+    self.ttl = ttl
+    self.chunk_size = chunk_size
+    self.max_size = max_size
+    self.objects_dir = os.path.join(store_dir, 'objects')
+    self.lock = threading.Lock()
+    self.in_flight = {}
+    self.validated = {}
+    self.upstream_bytes = 0
+    self.server = None
+    self.objects = self._load_objects()
+
+  def serve(self, host, port):
+    """Serve until interrupted."""
+    self.start(host, port)
+
+    try:
+      threading.Event().wait()
+    except KeyboardInterrupt:
+      self.stop()
+
+  def start(self, host='127.0.0.1', port=0):
+    """
+    Serve in a background thread.
+
+    :return: Base url of the mirror
+    :rtype: str
+    """
+    owner = self
+
+    class Handler(MirrorHandler):
+      mirror = owner
+
+    self.server = ThreadingHTTPServer((host, port), Handler)
+    self.server.daemon_threads = True
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    return 'http://{}:{}'.format(host, self.server.server_port)
+
+  def stop(self):
+    if self.server:
+      self.server.shutdown()
+      self.server.server_close()
+      self.server = None
+
+    self.upstream.close()
+
+  def get(self, path, headers):
+    """
+    Open (fetching or revalidating upstream if needed) the stored object for a request.
+
+    :param str path: Requested route + query string
+    :param headers: Request headers
+    :return: (open object file, stored metadata) if the object is available, otherwise
+      (None, (status, body)) with the upstream error to relay
+    :rtype: tuple
+    """
+    key = self.key(path, headers)
+
+    for _ in range(2):
+      obj_path, meta = self._lookup(path, headers)
+
+      if obj_path is None:
+        return None, meta
+
+      # Opened under the lock, so eviction can't remove the object in between.
+      with self.lock:
+        try:
+          f = open(obj_path, 'rb')
+        except FileNotFoundError:
+          # Evicted since it was looked up -- fetch it again.
+          continue
+
+        if key in self.objects:
+          self.objects[key]['last_used'] = time.time()
+
+      return f, meta
+
+    return None, (503, {'error': 'object_evicted'})
+
+  def _lookup(self, path, headers):
+    """
+    Find (fetching or revalidating upstream if needed) the stored object for a request.
+
+    :return: (object path, stored metadata), or (None, (status, body)) with the upstream error to relay
+    :rtype: tuple
+    """
+    key = self.key(path, headers)
+    access_key = self.access_key(key, headers)
+    obj_path = os.path.join(self.objects_dir, key)
+    meta = self._load_meta(obj_path)
+
+    with self.lock:
+      validated_at = self.validated.get(access_key)
+
+    # Serve straight from the store only if the API recently accepted this client for this object.
+    if meta and validated_at and time.time() - validated_at < self.ttl and os.path.exists(obj_path):
+      return obj_path, meta
+
+    with self.lock:
+      fetch = self.in_flight.get(key)
+      leader = fetch is None
+
+      if leader:
+        fetch = self.in_flight[key] = Fetch(access_key)
+
+    if not leader:
+      fetch.done.wait()
+
+      # Another client's fetch says nothing about this one's credentials -- check them
+      # too (usually a 304 against the copy that fetch just stored).
+      if fetch.access_key != access_key:
+        return self._lookup(path, headers)
+
+      return fetch.result
+
+    try:
+      fetch.result = self._fetch(path, headers, obj_path, meta)
+
+      if fetch.result[0] is not None:
+        self._record_access(access_key)
+    except Exception as e:
+      fetch.result = None, (502, {'error': 'upstream_failed', 'log': str(e)})
+    finally:
+      with self.lock:
+        del self.in_flight[key]
+
+      fetch.done.set()
+
+    return fetch.result
+
+  def _record_access(self, access_key):
+    """Note that the API just accepted a client for an object (forgetting expired acceptances)."""
+    now = time.time()
+
+    with self.lock:
+      self.validated = {k: t for k, t in self.validated.items() if now - t < self.ttl}
+      self.validated[access_key] = now
+
+  def _fetch(self, path, headers, obj_path, meta):
+    """Download an object from upstream into the store, or confirm the stored copy is current."""
+    req_headers = {h: headers[h] for h in VARY_HEADERS + (auth_header_name,) if headers.get(h)}
+    req_headers.update(IDENTITY_ENCODING)
+
+    if meta and meta.get('ETag') and os.path.exists(obj_path):
+      req_headers['If-None-Match'] = meta['ETag']
+
+    resp = self.upstream.get(path,
+                             headers=req_headers,
+                             stream=True,
+                             log_on_error=False,
+                             exit_on_error=False,
+                             raise_errors=True)
+
+    if resp.status == 304:
+      resp.response_obj.close()
+      meta['checked_at'] = time.time()
+      self._save_meta(obj_path, meta)
+      return obj_path, meta
+
+    if not resp.ok:
+      return None, (resp.status, resp.json)
+
+    # Download to a temp file, then move it into place for readers of the old copy to keep their handle.
+    tmp_path = '{}.{}.tmp'.format(obj_path, threading.get_ident())
+    upsert_parent_dirs(tmp_path)
+
+    resp.response_obj.raw.decode_content = True
+
+    try:
+      with open(tmp_path, 'wb') as f:
+        while True:
+          chunk = resp.response_obj.raw.read(self.chunk_size)
+
+          if not chunk:
+            break
+
+          f.write(chunk)
+
+          with self.lock:
+            self.upstream_bytes += len(chunk)
+
+      length = resp.headers.get('Content-Length')
+      size = os.path.getsize(tmp_path)
+
+      if length is not None and size != int(length):
+        raise IOError('upstream closed the connection after {} of {} bytes'.format(size, length))
+
+      meta = {h: resp.headers[h] for h in STORED_HEADERS if resp.headers.get(h)}
+      meta['checked_at'] = time.time()
+
+      # Replace the object before its metadata, so the metadata never describes a different body.
+      os.replace(tmp_path, obj_path)
+    finally:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    self._save_meta(obj_path, meta)
+
+    with self.lock:
+      self.objects[os.path.basename(obj_path)] = {'size': size, 'last_used': time.time()}
+      self._evict(keep=os.path.basename(obj_path))
+
+    return obj_path, meta
+
+  def _evict(self, keep=None):
+    """Remove least recently used objects until the store fits within max_size (call with the lock held)."""
+    if self.max_size is None:
+      return
+
+    total = sum(obj['size'] for obj in self.objects.values())
+
+    for key, obj in sorted(self.objects.items(), key=lambda item: item[1]['last_used']):
+      if total <= self.max_size:
+        break
+
+      if key == keep:
+        continue
+
+      obj_path = os.path.join(self.objects_dir, key)
+
+      for path in (obj_path + '.json', obj_path):
+        if os.path.exists(path):
+          os.remove(path)
+
+      del self.objects[key]
+      total -= obj['size']
+
+  def _load_objects(self):
+    """
+    :return: Map of store key --> {size, last_used} of the objects already in the store
+      (clearing out temp files left behind by a previous run)
+    :rtype: dict
+    """
+    objects = {}
+
+    try:
+      names = os.listdir(self.objects_dir)
+    except (IOError, OSError):
+      return objects
+
+    for name in names:
+      path = os.path.join(self.objects_dir, name)
+
+      if name.endswith('.tmp'):
+        os.remove(path)
+      elif not name.endswith('.json'):
+        st = os.stat(path)
+        objects[name] = {'size': st.st_size, 'last_used': st.st_mtime}
+
+    return objects
+
+  @staticmethod
+  def key(path, headers):
+    """:return: Store key of a request (route + query + headers that pick the object)"""
+    ident = json.dumps([path] + [headers.get(h) for h in VARY_HEADERS])
+    return hashlib.sha256(ident.encode('utf-8')).hexdigest()
+
+  @staticmethod
+  def access_key(key, headers):
+    """:return: Key of a client's access to a stored object (store key + a hash of its auth header)"""
+    ident = json.dumps([key, headers.get(auth_header_name)])
+    return hashlib.sha256(ident.encode('utf-8')).hexdigest()
+
+  @staticmethod
+  def _load_meta(obj_path):
+    try:
+      with open(obj_path + '.json') as f:
+        return json.load(f)
+    except (IOError, OSError, ValueError):
+      return None
+
+  @staticmethod
+  def _save_meta(obj_path, meta):
+    tmp_path = obj_path + '.json.tmp'
+
+    with open(tmp_path, 'w') as f:
+      json.dump(meta, f)
+
+    os.replace(tmp_path, obj_path + '.json')
+
+
+class Fetch(object):
+  """An upstream fetch that other requests for the same object wait on."""
+
+  def __init__(self, access_key):
+    """
+    :param str access_key: Access key (see ModelMirror.access_key) of the client the fetch is made for
+    """
+    self.access_key = access_key
+    self.done = threading.Event()
+    self.result = None
+
+
+class MirrorHandler(BaseHTTPRequestHandler):
+  """Serves the mirrored routes from the owning ModelMirror's store."""
+  protocol_version = 'HTTP/1.1'
+  mirror = None
+
+  def log_message(self, *args):
+    pass
+
+  def do_GET(self):
+    route = urlparse(self.path).path.rstrip('/')
+
+    if route != self.mirror.route and not route.startswith(self.mirror.route + '/'):
+      return self.send_json(404, {'error': 'route_not_found'})
+
+    f, meta = self.mirror.get(self.path, self.headers)
+
+    if f is None:
+      return self.send_json(*meta)
+
+    # Already open, so the body stays consistent even if the object is replaced or evicted mid-response.
+    with f:
+      size = os.fstat(f.fileno()).st_size
+      headers = {h: meta[h] for h in STORED_HEADERS if h in meta}
+      headers['Accept-Ranges'] = 'bytes'
+      headers.setdefault('Last-Modified', formatdate(meta['checked_at'], usegmt=True))
+
+      if meta.get('ETag') and self.headers.get('If-None-Match') == meta['ETag']:
+        return self.send_body(304, headers, f, 0, 0)
+
+      start, end = parse_range(self.headers.get('Range'), size)
+      if_range = self.headers.get('If-Range')
+
+      # Serve the whole object if no (satisfiable) range was asked for, or if If-Range doesn't match.
+      if start is None or (if_range and if_range not in (meta.get('ETag'), meta.get('Last-Modified'))):
+        return self.send_body(200, headers, f, 0, size)
+
+      if start >= size:
+        headers['Content-Range'] = 'bytes */{}'.format(size)
+        return self.send_body(416, headers, f, 0, 0)
+
+      headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+
+      self.send_body(206, headers, f, start, end - start + 1)
+
+  def send_body(self, status, headers, f, start, length):
+    self.send_response(status)
+
+    for k, v in headers.items():
+      self.send_header(k, v)
+
+    self.send_header('Content-Length', str(length))
+    self.end_headers()
+
+    if not length:
+      return
+
+    try:
+      # Zero-copy from the page cache to the socket where possible.
+      self.wfile.flush()
+      sent = 0
+
+      while sent < length:
+        n = os.sendfile(self.connection.fileno(), f.fileno(), start + sent, length - sent)
+
+        if not n:
+          break
+
+        sent += n
+    except AttributeError:
+      f.seek(start)
+      shutil.copyfileobj(_LimitedReader(f, length), self.wfile, self.mirror.chunk_size)
+    except (BrokenPipeError, ConnectionResetError):
+      self.close_connection = True
+
+  def send_json(self, status, body):
+    data = json.dumps(body or {}).encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+
+class _LimitedReader(object):
+
+  def __init__(self, f, length):
+    self.f = f
+    self.remaining = length
+
+  def read(self, size):
+    data = self.f.read(min(size, self.remaining))
+    self.remaining -= len(data)
+    return data
+
+
+def parse_range(value, size):
+  """
+  Parse a single 'Range: bytes=start-end' header (suffix ranges included).
+
+  :return: (start, end) inclusive, or (None, None) if absent/unsupported
+  :rtype: tuple
+  """
+  if not value or not value.startswith('bytes=') or ',' in value:
+    return None, None
+
+  try:
+    first, last = value[len('bytes='):].split('-', 1)
+
+    if not first:
+      return max(size - int(last), 0), size - 1
+
+    # A last byte before the first makes the header invalid, so it's ignored.
+    if last and int(last) < int(first):
+      return None, None
+
+    return int(first), min(int(last), size - 1) if last else size - 1
+  except ValueError:
+    return None, None
@@ -1,10 +1,27 @@
+import json
 import os
 from sweettea import log
 from sweettea.definitions import tmp_model_archive_path
-from sweettea.utils.file_utils import zip_dir
+from sweettea.utils import project_config
+from sweettea.utils.file_utils import dir_fingerprint, zip_dir
+from sweettea.utils.file_utils.ignore import load_ignore_rules
+from sweettea.utils.file_utils.zip_writer import DEFAULT_COMPRESSION_LEVEL
 
 
-def get_upload_ready_model_path(path):
+def get_upload_ready_model_path(path, compression_level=DEFAULT_COMPRESSION_LEVEL, hash_contents=False,
+                                reproducible=False, ignore=None, scan_workers=0):
+  """
+  :param str path: Model file or directory
+  :param int compression_level: zlib compression level 0-9 to zip directories with
+  :param bool hash_contents: Whether to compare file contents (not just sizes and mtimes)
+    when deciding if a previously zipped directory is unchanged
+  :param bool reproducible: Whether to zip directories reproducibly (see zip_dir)
+  :param ignore: Exclusion rules for paths inside a directory that shouldn't be uploaded
+    :type: sweettea.utils.file_utils.ignore.IgnoreRules
+  :param int scan_workers: Number of threads to stat and read ahead files with while scanning a directory
+  :return: Path of the file to upload -- the model itself, or an archive of the model directory
+  :rtype: str
+  """
   # Ensure specified model path exists.
   if not os.path.exists(path):
     log('No model file or directory found at "{}".'.format(path))
@@ -14,8 +31,99 @@ def get_upload_ready_model_path(path):
   if not os.path.isdir(path):
     return os.path.abspath(path)
 
+  fingerprint = {
+    'src': os.path.abspath(path),
+    'tree': dir_fingerprint(path, hash_contents=hash_contents, ignore=ignore, scan_workers=scan_workers),
+    'hash_contents': hash_contents,
+    'compression_level': compression_level,
+    'reproducible': reproducible
+  }
+
+  # Reuse the archive from last time if the directory hasn't changed since.
+  if archive_matches_fingerprint(tmp_model_archive_path, fingerprint):
+    log('Model directory unchanged -- reusing its existing archive.')
+    return tmp_model_archive_path
+
+  # Forget the old archive's fingerprint before touching it, so it can't vouch for a half-written one.
+  remove_fingerprint(tmp_model_archive_path)
+
   # If path is a directory, compress it into a zipfile inside st tmp storage.
-  zip_dir(path, tmp_model_archive_path)
+  digest = zip_dir(path, tmp_model_archive_path, compression_level=compression_level, reproducible=reproducible,
+                   ignore=ignore, scan_workers=scan_workers)
+
+  save_fingerprint(tmp_model_archive_path, fingerprint, digest)
 
   # Return path to compressed model file.
   return tmp_model_archive_path
+
+
+def get_model_ignore_rules(path):
+  """
+  Exclusion rules for packaging a model directory: the project config's 'training.model.ignore'
+  patterns (a list, or a string of lines), then the directory's own .stignore file.
+
+  :param str path: Model directory
+  :rtype: sweettea.utils.file_utils.ignore.IgnoreRules
+  """
+  model_cfg = (project_config.config.load().get_value() or {}).get('training', {}).get('model', {})
+  patterns = model_cfg.get('ignore') or []
+
+  if isinstance(patterns, str):
+    patterns = patterns.splitlines()
+
+  return load_ignore_rules(path, extra_patterns=patterns)
+
+
+def fingerprint_path(archive_path):
+  return archive_path + '.fingerprint.json'
+
+
+def archive_matches_fingerprint(archive_path, fingerprint):
+  """
+  Whether an archive was built from a directory with the given fingerprint, and is
+  still exactly as it was written (same size and mtime as when its fingerprint was saved).
+  """
+  try:
+    with open(fingerprint_path(archive_path)) as f:
+      saved = json.load(f)
+
+    st = os.stat(archive_path)
+  except (IOError, OSError, ValueError):
+    return False
+
+  return saved.get('fingerprint') == fingerprint and \
+    saved.get('archive_size') == st.st_size and \
+    saved.get('archive_mtime') == st.st_mtime_ns
+
+
+def get_archive_digest(archive_path):
+  """
+  :return: sha256 of an archive built by 'get_upload_ready_model_path', as recorded when it was written
+    (stable across rebuilds of an unchanged tree if it was zipped reproducibly)
+  :rtype: str or None
+  """
+  try:
+    with open(fingerprint_path(archive_path)) as f:
+      return json.load(f).get('archive_digest')
+  except (IOError, OSError, ValueError):
+    return None
+
+
+def save_fingerprint(archive_path, fingerprint, digest):
+  st = os.stat(archive_path)
+  tmp_path = fingerprint_path(archive_path) + '.tmp'
+
+  with open(tmp_path, 'w') as f:
+    json.dump({
+      'fingerprint': fingerprint,
+      'archive_digest': digest,
+      'archive_size': st.st_size,
+      'archive_mtime': st.st_mtime_ns
+    }, f)
+
+  os.replace(tmp_path, fingerprint_path(archive_path))
+
+
+def remove_fingerprint(archive_path):
+  if os.path.exists(fingerprint_path(archive_path)):
+    os.remove(fingerprint_path(archive_path))
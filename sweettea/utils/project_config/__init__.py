@@ -8,7 +8,7 @@ MODEL_UPLOAD_CRITERIA_EVAL = 'eval'
 
 
 def file_path():
-  return os.path.join(os.getcwd(), config_file_name)s
+  return os.path.join(os.getcwd(), config_file_name)
 
 
 def validate_training_bp(val):
@@ -27,6 +27,10 @@ def validate_model_upload_criteria(val):
   return val in {MODEL_UPLOAD_CRITERIA_ALWAYS, MODEL_UPLOAD_CRITERIA_EVAL}
 
 
+def validate_ignore_patterns(val):
+  return isinstance(val, str) or (isinstance(val, list) and all(isinstance(p, str) for p in val))
+
+
 config = ConfigFile(path=file_path(), config=ConfigMap(key_order=('training', 'hosting'), value={
   'training': ConfigMap(key_order=('buildpack', 'dataset', 'train', 'test', 'eval', 'model'), value={
     'buildpack': ConfigKey(required=True, custom_validation=validate_training_bp),
@@ -37,9 +41,10 @@ config = ConfigFile(path=file_path(), config=ConfigMap(key_order=('training', 'h
     'train': ConfigKey(required=True, validation='mod_function'),
     'test': ConfigKey(validation='mod_function'),
     'eval': ConfigKey(validation='mod_function'),
-    'model': ConfigMap(key_order=('path', 'upload_criteria'), value={
+    'model': ConfigMap(key_order=('path', 'upload_criteria', 'ignore'), value={
       'path': ConfigKey(required=True, custom_validation=validate_model_path),
-      'upload_criteria': ConfigKey(required=True, custom_validation=validate_model_upload_criteria)
+      'upload_criteria': ConfigKey(required=True, custom_validation=validate_model_upload_criteria),
+      'ignore': ConfigKey(custom_validation=validate_ignore_patterns)
     })
   }),
   'hosting': ConfigMap(key_order=('buildpack', 'predict', 'model'), value={
@@ -43,9 +43,9 @@ class ConfigFile(object):
 
     # Load the yaml config file from disk.
     with open(self.path, 'r') as f:
-      cfg = yaml.load(f)
+      cfg = yaml.safe_load(f)
 
-    self.unmarshal(cfg)
+    self.unmarshal(cfg or {})
 
     return self
 